@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""Microbenchmark of per-host processing in "generate_inventory".
+
+It measures grouping and host vars extraction only (no HTTP),
+by feeding synthetic hosts to the inventory builder.
+
+Usage:
+    python benchmarks/bench_host_processing.py [--hosts 20000] [--repeat 5]
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from netbox import netbox  # noqa: E402
+
+
+CONFIG_DATA = {
+    "netbox": {
+        "main": {"api_url": "http://localhost/api/dcim/devices/"},
+        "group_by": {
+            "default": ["device_role", "rack", "platform", "site"],
+            "custom": ["env"]
+        },
+        "hosts_vars": {
+            "ip": {"ansible_ssh_host": "primary_ip", "ansible_host": "primary_ip4"},
+            "general": {"rack_name": "rack", "site_name": "site", "serial_number": "serial"},
+            "custom": {"env": "env", "label": "label"}
+        }
+    }
+}
+
+
+class Args(object):
+    config_file = "netbox.yml"
+    host = None
+    list = True
+    refresh_cache = False
+
+
+def make_hosts(hosts_count):
+    """Make synthetic hosts like Netbox API output."""
+
+    hosts_list = []
+    for host_id in range(hosts_count):
+        ip_address = {"id": host_id, "family": 4, "address": "10.%d.%d.%d/24" % (
+            host_id >> 16 & 255, host_id >> 8 & 255, host_id & 255)}
+        hosts_list.append({
+            "id": host_id,
+            "name": "host%06d" % host_id,
+            "device_role": {"id": host_id % 10, "name": "role%02d" % (host_id % 10), "slug": "role"},
+            "rack": {"id": host_id % 500, "name": "rack%03d" % (host_id % 500)},
+            "platform": None if host_id % 7 == 0 else {"id": 1, "name": "platform%d" % (host_id % 3)},
+            "site": {"id": host_id % 20, "name": "site%02d" % (host_id % 20)},
+            "serial": "SN%08d" % host_id,
+            "primary_ip": ip_address,
+            "primary_ip4": ip_address,
+            "custom_fields": {
+                "label": "label%d" % (host_id % 50),
+                "env": {"id": host_id % 3, "value": ("prod", "staging", "dev")[host_id % 3]}
+            }
+        })
+    return hosts_list
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hosts", type=int, default=20000, help="Number of synthetic hosts.")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of runs, the best one is reported.")
+    arguments = parser.parse_args()
+
+    hosts_list = make_hosts(arguments.hosts)
+    netbox_inventory = netbox.NetboxAsInventory(Args, CONFIG_DATA)
+    netbox_inventory.iter_hosts_pages = lambda *args, **kwargs: iter([hosts_list])
+
+    timings = []
+    for _ in range(arguments.repeat):
+        start_time = time.time()
+        netbox_inventory.generate_inventory()
+        timings.append(time.time() - start_time)
+
+    best_time = min(timings)
+    print("hosts: %d, best of %d: %.3f s, per host: %.2f us" % (
+        arguments.hosts, arguments.repeat, best_time, best_time / arguments.hosts * 1e6))
+
+
+if __name__ == "__main__":
+    main()
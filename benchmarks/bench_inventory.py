@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+"""Benchmark suite of inventory generation against a fake Netbox API.
+
+Every scenario runs in a new process, and it reports the wall time,
+the peak RSS of that process, and the number of API requests.
+
+Scenarios:
+    get_hosts_list: Fetch all devices from the fake API.
+    grouping: Group synthetic hosts (no HTTP).
+    hosts_vars: Extract host vars of synthetic hosts (no HTTP).
+    json_output: Print the inventory of synthetic hosts as JSON (no HTTP).
+    end_to_end: Fetch, group, extract vars, and print the inventory.
+
+Usage:
+    python benchmarks/bench_inventory.py [--hosts 1000 10000 100000] [--latency 0.01]
+        [--page-size 1000] [--max-workers 4] [--backend requests] [--scenarios grouping json_output]
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+BENCHMARKS_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_PATH, os.pardir))
+from netbox import netbox  # noqa: E402
+from fake_netbox import FakeNetbox  # noqa: E402
+from bench_host_processing import CONFIG_DATA, Args, make_hosts  # noqa: E402
+
+SCENARIOS = ["get_hosts_list", "grouping", "hosts_vars", "json_output", "end_to_end"]
+
+
+def get_peak_rss():
+    """Get peak RSS of this process in MB."""
+
+    import resource
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # It's in bytes on macOS and in kilobytes on Linux.
+    return peak_rss / (1024.0 * 1024.0) if sys.platform == "darwin" else peak_rss / 1024.0
+
+
+def make_netbox_inventory(api_url, page_size, max_workers, backend, group_by=True, hosts_vars=True):
+    config_data = json.loads(json.dumps(CONFIG_DATA))
+    config_data["netbox"]["main"].update({
+        "api_url": api_url,
+        "page_size": page_size,
+        "max_workers": max_workers,
+        "backend": backend
+    })
+    if not group_by:
+        config_data["netbox"]["group_by"] = {}
+    if not hosts_vars:
+        config_data["netbox"]["hosts_vars"] = {}
+    return netbox.NetboxAsInventory(Args, config_data)
+
+
+def run_scenario(arguments):
+    """Run one scenario in this process and print its result as JSON."""
+
+    scenario = arguments.run_scenario
+    netbox_inventory = make_netbox_inventory(arguments.api_url, arguments.page_size, arguments.max_workers,
+                                             arguments.backend, group_by=scenario != "hosts_vars",
+                                             hosts_vars=scenario != "grouping")
+
+    # Scenarios without HTTP use synthetic hosts in memory.
+    if scenario in ("grouping", "hosts_vars", "json_output"):
+        hosts_list = make_hosts(arguments.hosts)
+        netbox_inventory.iter_hosts_pages = lambda *args, **kwargs: iter([hosts_list])
+
+    ansible_inventory = None
+    if scenario == "json_output":
+        ansible_inventory = netbox_inventory.generate_inventory()
+
+    with open(os.devnull, "w") as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            start_time = time.time()
+            if scenario == "get_hosts_list" and arguments.backend == "graphql":
+                list(netbox_inventory.iter_graphql_hosts_pages(netbox_inventory.endpoints[0]))
+            elif scenario == "get_hosts_list":
+                endpoint = netbox_inventory.endpoints[0]
+                netbox_inventory.get_hosts_list(endpoint.api_url, max_workers=netbox_inventory.max_workers,
+                                                session=netbox_inventory.session, api_params=endpoint.api_params)
+            elif scenario in ("grouping", "hosts_vars"):
+                netbox_inventory.generate_inventory()
+            elif scenario == "json_output":
+                netbox_inventory.print_inventory_json(ansible_inventory)
+            else:
+                netbox_inventory.print_inventory_json(netbox_inventory.generate_inventory())
+            wall_time = time.time() - start_time
+        finally:
+            sys.stdout = stdout
+
+    print(json.dumps({"wall_time": wall_time, "peak_rss": get_peak_rss()}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hosts", type=int, nargs="+", default=[1000, 10000],
+                        help="Number of devices, e.g. 1000 10000 100000.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds of fake API latency per request.")
+    parser.add_argument("--page-size", type=int, default=1000, help="Page size of API requests.")
+    parser.add_argument("--max-page-size", type=int, default=1000, help="Max page size of fake API.")
+    parser.add_argument("--max-workers", type=int, default=1, help="Number of pages fetched at the same time.")
+    parser.add_argument("--backend", default="requests", choices=["requests", "asyncio", "graphql"],
+                        help="HTTP backend.")
+    parser.add_argument("--scenarios", nargs="+", default=SCENARIOS, choices=SCENARIOS, help="Scenarios to run.")
+    parser.add_argument("--run-scenario", choices=SCENARIOS, help=argparse.SUPPRESS)
+    parser.add_argument("--api-url", help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    if arguments.run_scenario:
+        arguments.hosts = arguments.hosts[0]
+        run_scenario(arguments)
+        return
+
+    print("%-16s %8s %10s %10s %9s" % ("scenario", "hosts", "time (s)", "RSS (MB)", "requests"))
+    for hosts_count in arguments.hosts:
+        fake_netbox = FakeNetbox(make_hosts(hosts_count), latency=arguments.latency,
+                                 max_page_size=arguments.max_page_size).start()
+        try:
+            for scenario in arguments.scenarios:
+                requests_count = fake_netbox.requests_count
+                scenario_output = subprocess.check_output([
+                    sys.executable, os.path.abspath(__file__), "--run-scenario", scenario,
+                    "--api-url", fake_netbox.api_url, "--hosts", str(hosts_count),
+                    "--page-size", str(arguments.page_size), "--max-workers", str(arguments.max_workers),
+                    "--backend", arguments.backend])
+                scenario_result = json.loads(scenario_output.decode("utf-8").splitlines()[-1])
+                print("%-16s %8d %10.3f %10.1f %9d" % (
+                    scenario, hosts_count, scenario_result["wall_time"], scenario_result["peak_rss"],
+                    fake_netbox.requests_count - requests_count))
+        finally:
+            fake_netbox.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""Startup benchmark of the inventory script.
+
+It measures the import time of the script (using "python -X importtime"),
+and the wall time of cached "--list" and "--host" calls, which Ansible may
+run many times. Every run is a new interpreter, so it's a cold start.
+
+Usage:
+    python benchmarks/bench_startup.py [--hosts 20000] [--repeat 10] [--top 10]
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+import yaml
+
+BENCHMARKS_PATH = os.path.dirname(os.path.abspath(__file__))
+ROOT_PATH = os.path.join(BENCHMARKS_PATH, os.pardir)
+SCRIPT_PATH = os.path.join(ROOT_PATH, "netbox", "netbox.py")
+
+sys.path.insert(0, ROOT_PATH)
+from netbox import netbox  # noqa: E402
+from bench_host_processing import CONFIG_DATA, Args, make_hosts  # noqa: E402
+
+
+def get_import_times(top_modules):
+    """Import the script with "-X importtime" and get the slowest modules.
+
+    Returns:
+        A tuple of total import time (us) and a list of (cumulative time, module name).
+    """
+
+    import_output = subprocess.check_output(
+        [sys.executable, "-X", "importtime", "-c", "from netbox import netbox"],
+        cwd=ROOT_PATH, stderr=subprocess.STDOUT).decode("utf-8")
+
+    modules_times = []
+    for line in import_output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_time, module_name = line.split("|")
+        modules_times.append((int(cumulative_time), module_name.rstrip()))
+
+    total_time = [module_time for module_time, module_name in modules_times if module_name.strip() == "netbox.netbox"]
+    modules_times.sort(reverse=True)
+    return sum(total_time), modules_times[:top_modules]
+
+
+def time_script(script_args, repeat):
+    """Run the script many times and get the best wall time in seconds."""
+
+    timings = []
+    with open(os.devnull, "w") as devnull:
+        for _ in range(repeat):
+            start_time = time.time()
+            subprocess.check_call([sys.executable, SCRIPT_PATH] + script_args, stdout=devnull)
+            timings.append(time.time() - start_time)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hosts", type=int, default=20000, help="Number of synthetic hosts in cached inventory.")
+    parser.add_argument("--repeat", type=int, default=10, help="Number of runs, the best one is reported.")
+    parser.add_argument("--top", type=int, default=10, help="Number of the slowest imported modules.")
+    arguments = parser.parse_args()
+
+    total_import_time, slowest_modules = get_import_times(arguments.top)
+    print("import netbox.netbox: %.1f ms" % (total_import_time / 1000.0))
+    for module_time, module_name in slowest_modules:
+        print("  %8.1f ms %s" % (module_time / 1000.0, module_name))
+
+    # Cache synthetic inventory, so the script doesn't call netbox API.
+    cache_path = tempfile.mkdtemp(prefix="bench-startup-")
+    try:
+        config_file = os.path.join(cache_path, "netbox.yml")
+        config_data = dict(CONFIG_DATA, netbox=dict(CONFIG_DATA["netbox"], cache={
+            "enabled": True, "path": cache_path, "ttl": 3600}))
+        with open(config_file, "w") as config_yaml_file:
+            yaml.safe_dump(config_data, config_yaml_file)
+
+        hosts_list = make_hosts(arguments.hosts)
+        netbox_inventory = netbox.NetboxAsInventory(Args, netbox.open_yaml_file(config_file))
+        netbox_inventory.iter_hosts_pages = lambda *args, **kwargs: iter([hosts_list])
+        netbox_inventory.get_inventory()
+
+        for script_args in (["--list"], ["--host", hosts_list[-1]["name"]]):
+            best_time = time_script(["--config-file", config_file] + script_args, arguments.repeat)
+            print("cached %s (%d hosts), best of %d: %.1f ms" % (
+                " ".join(script_args[:1]), arguments.hosts, arguments.repeat, best_time * 1000))
+    finally:
+        shutil.rmtree(cache_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+"""Fake Netbox API server for benchmarks.
+
+It serves synthetic devices on "/api/dcim/devices/" with Netbox pagination
+("count", "next", "limit" and "offset"), "name" filter, and "fields"/"brief"
+query parameters, and "ETag" validators ("304 Not Modified" for "If-None-Match").
+Also "/graphql/" serves "device_list" queries (with pagination,
+"name" filter, and type introspection). Every response could be delayed to simulate a slow API.
+
+Usage:
+    python benchmarks/fake_netbox.py [--hosts 10000] [--port 8000] [--latency 0.05]
+"""
+
+from __future__ import print_function
+
+import re
+import json
+import hashlib
+import time
+import argparse
+import threading
+
+try:
+    from socketserver import ThreadingMixIn
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from urllib.parse import urlparse, parse_qsl, urlencode
+except ImportError:
+    from SocketServer import ThreadingMixIn
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from urlparse import urlparse, parse_qsl
+    from urllib import urlencode
+
+from bench_host_processing import make_hosts
+
+DEVICES_PATH = "/api/dcim/devices/"
+GRAPHQL_PATH = "/graphql/"
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeNetbox(object):
+    """Fake Netbox API server which runs in a background thread.
+
+    Attributes:
+        hosts_list: A list of hosts which are served as devices.
+        latency: Float, seconds to wait before every response.
+        page_size: Int, default page size if "limit" is not set.
+        max_page_size: Int, max page size like "MAX_PAGE_SIZE" in netbox.
+        requests_count: Int, number of API requests.
+    """
+
+    def __init__(self, hosts_list, latency=0.0, page_size=50, max_page_size=1000, port=0):
+        self.hosts_list = hosts_list
+        self.hosts_index = dict((host["name"], host) for host in hosts_list)
+        self.latency = latency
+        self.page_size = page_size
+        self.max_page_size = max_page_size
+        self.requests_count = 0
+        self.requests_lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._make_handler())
+        self.graphql_types = self._make_graphql_types(hosts_list)
+
+    @property
+    def api_url(self):
+        return "http://127.0.0.1:%s%s" % (self.server.server_port, DEVICES_PATH)
+
+    def start(self):
+        server_thread = threading.Thread(target=self.server.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_page(self, query_params):
+        """Get a page of devices like Netbox API."""
+
+        if "name" in query_params:
+            hosts_list = [self.hosts_index[query_params["name"]]] if query_params["name"] in self.hosts_index else []
+        else:
+            hosts_list = self.hosts_list
+
+        page_limit = min(int(query_params.get("limit") or self.page_size), self.max_page_size)
+        page_offset = int(query_params.get("offset") or 0)
+        page_hosts = hosts_list[page_offset:page_offset + page_limit]
+
+        if query_params.get("brief") == "true":
+            page_hosts = [{"id": host["id"], "name": host["name"]} for host in page_hosts]
+        elif query_params.get("fields"):
+            fields = query_params["fields"].split(",")
+            page_hosts = [dict((field, host.get(field)) for field in fields) for host in page_hosts]
+
+        next_url = None
+        if page_offset + page_limit < len(hosts_list):
+            next_params = dict(query_params, limit=page_limit, offset=page_offset + page_limit)
+            next_url = "%s?%s" % (self.api_url, urlencode(sorted(next_params.items())))
+
+        return {
+            "count": len(hosts_list),
+            "next": next_url,
+            "previous": None,
+            "results": page_hosts
+        }
+
+    @staticmethod
+    def _make_graphql_types(hosts_list):
+        """Make GraphQL types from hosts data, every nested dict is an object type."""
+
+        device_fields = {}
+        graphql_types = {"Query": {"device_list": ("OBJECT", "DeviceType")}, "DeviceType": device_fields}
+        for host in hosts_list[:100]:
+            for field_name, field_value in host.items():
+                if field_name == "custom_fields":
+                    device_fields[field_name] = ("SCALAR", "JSON")
+                elif isinstance(field_value, dict):
+                    type_name = "%sType" % field_name.title().replace("_", "")
+                    device_fields[field_name] = ("OBJECT", type_name)
+                    graphql_types.setdefault(type_name, {}).update(
+                        (key, ("SCALAR", "String")) for key in field_value)
+                elif field_name not in device_fields:
+                    device_fields[field_name] = ("SCALAR", "String")
+        return graphql_types
+
+    def get_graphql_output(self, graphql_request):
+        """Run a GraphQL query of "device_list" or type introspection."""
+
+        graphql_query = graphql_request["query"]
+        variables = graphql_request.get("variables") or {}
+        if "__type" in graphql_query:
+            fields = [{"name": field_name, "type": {"kind": kind, "name": type_name, "ofType": None}}
+                      for field_name, (kind, type_name) in self.graphql_types.get(variables["name"], {}).items()]
+            return {"data": {"__type": {"fields": fields}}}
+
+        # Selection of "device_list" is parsed to a dict of fields (None for scalar fields).
+        tokens = re.findall(r"\w+|[{}]", graphql_query[graphql_query.index(") {", graphql_query.index("device_list")):])
+
+        def parse_selection(token_index):
+            selection = {}
+            while tokens[token_index] != "}":
+                field_name = tokens[token_index]
+                if tokens[token_index + 1] == "{":
+                    selection[field_name], token_index = parse_selection(token_index + 2)
+                else:
+                    selection[field_name], token_index = None, token_index + 1
+            return selection, token_index + 1
+
+        def select(host_data, selection):
+            if not isinstance(host_data, dict):
+                return host_data
+            return dict((field_name, select(host_data.get(field_name), field_selection) if field_selection
+                         else host_data.get(field_name)) for field_name, field_selection in selection.items())
+
+        selection, _ = parse_selection(1)
+        name_filter = re.search(r'name: "([^"]*)"', graphql_query)
+        if name_filter:
+            hosts_list = [self.hosts_index[name_filter.group(1)]] if name_filter.group(1) in self.hosts_index else []
+        else:
+            hosts_list = self.hosts_list
+
+        page_offset = variables.get("offset", 0)
+        page_limit = min(variables.get("limit", self.page_size), self.max_page_size)
+        page_hosts = hosts_list[page_offset:page_offset + page_limit]
+        return {"data": {"device_list": [select(host, selection) for host in page_hosts]}}
+
+    def _make_handler(self):
+        fake_netbox = self
+
+        class FakeNetboxHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                with fake_netbox.requests_lock:
+                    fake_netbox.requests_count += 1
+                request_url = urlparse(self.path)
+                if request_url.path != DEVICES_PATH:
+                    self.send_error(404)
+                    return
+
+                if fake_netbox.latency:
+                    time.sleep(fake_netbox.latency)
+
+                page_output = json.dumps(fake_netbox.get_page(dict(parse_qsl(request_url.query)))).encode("utf-8")
+                page_etag = '"%s"' % hashlib.sha1(page_output).hexdigest()
+                if self.headers.get("If-None-Match") == page_etag:
+                    self.send_response(304)
+                    self.send_header("ETag", page_etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("ETag", page_etag)
+                self.send_header("Content-Length", str(len(page_output)))
+                self.end_headers()
+                self.wfile.write(page_output)
+
+            def do_POST(self):
+                with fake_netbox.requests_lock:
+                    fake_netbox.requests_count += 1
+                if urlparse(self.path).path != GRAPHQL_PATH:
+                    self.send_error(404)
+                    return
+
+                if fake_netbox.latency:
+                    time.sleep(fake_netbox.latency)
+
+                graphql_request = json.loads(self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8"))
+                graphql_output = json.dumps(fake_netbox.get_graphql_output(graphql_request)).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(graphql_output)))
+                self.end_headers()
+                self.wfile.write(graphql_output)
+
+            def log_message(self, *args):
+                pass
+
+        return FakeNetboxHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hosts", type=int, default=10000, help="Number of synthetic devices.")
+    parser.add_argument("--port", type=int, default=8000, help="Port of the fake API.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before every response.")
+    parser.add_argument("--page-size", type=int, default=50, help="Default page size.")
+    parser.add_argument("--max-page-size", type=int, default=1000, help="Max page size.")
+    arguments = parser.parse_args()
+
+    fake_netbox = FakeNetbox(make_hosts(arguments.hosts), latency=arguments.latency, port=arguments.port,
+                             page_size=arguments.page_size, max_page_size=arguments.max_page_size)
+    print("Serving %d devices on %s" % (arguments.hosts, fake_netbox.api_url))
+    try:
+        fake_netbox.server.serve_forever()
+    except KeyboardInterrupt:
+        fake_netbox.server.server_close()
+
+
+if __name__ == "__main__":
+    main()
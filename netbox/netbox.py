@@ -3,21 +3,45 @@
 # Copyright: (c) 2017, Ahmed AbouZaid <http://aabouzaid.com/>
 # GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
 
+# Only light modules are imported here, heavy ones (e.g. "requests") are imported
+# when they are used, so cached inventory is returned without importing them.
+import io
 import os
 import sys
+import time
 import yaml
+import hashlib
 import argparse
+import threading
+from itertools import islice, product
+from contextlib import contextmanager
+from collections import deque, OrderedDict
 
 try:
-    import requests
+    from urllib.parse import urlparse, parse_qs
 except ImportError:
-    sys.exit('requests package is required for this inventory script.')
+    from urlparse import urlparse, parse_qs
 
 try:
     import json
 except ImportError:
     import simplejson as json
 
+# Faster JSON library, the standard one is used if it's not installed.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Strings which are repeated in many hosts (e.g. site and role names) are kept once in memory.
+try:
+    intern_string = sys.intern
+except AttributeError:
+    intern_string = intern  # Python 2.
+
+# Dict keeps insertion order in Python 3.7 and above, and it's lighter than OrderedDict.
+ordered_dict = dict if sys.version_info >= (3, 7) else OrderedDict
+
 
 # Script.
 def cli_arguments():
@@ -34,6 +58,29 @@ def cli_arguments():
                         action="store_true")
     parser.add_argument("--host", help="Print specific host vars as Ansible dynamic inventory syntax.",
                         action="store")
+    parser.add_argument("--refresh-cache", help="Ignore cached inventory and get it again from Netbox API.",
+                        action="store_true")
+    parser.add_argument("--backend", help="""HTTP backend of Netbox API requests, it overrides "main.backend"
+                                in config file.""",
+                        choices=["requests", "asyncio", "graphql"], action="store")
+    parser.add_argument("--stats", help="""Write timing and counters of the run to stderr,
+                                or to a JSON file if a path is set.""",
+                        nargs="?", const="-", metavar="STATS_FILE", action="store")
+    parser.add_argument("--profile", help="Write cProfile stats of the run to a file (it could be read by pstats).",
+                        metavar="PROFILE_FILE", action="store")
+    parser.add_argument("--export", help="""Generate inventory and write it to a static JSON file
+                                ("export.path" in config file by default), e.g. by cron.""",
+                        nargs="?", const="", metavar="EXPORT_FILE", action="store")
+    parser.add_argument("--serve-file", help="""Print exported inventory file if it's fresh
+                                ("export.path" in config file by default), otherwise generate inventory.
+                                It's enabled by "export.serve" in config file too.""",
+                        nargs="?", const="", metavar="EXPORT_FILE", action="store")
+    parser.add_argument("--daemon", help="""Run as a daemon which keeps inventory in memory, refreshes it
+                                periodically, and answers "--client" calls on a Unix socket.""",
+                        action="store_true")
+    parser.add_argument("--client", help="""Get inventory from the daemon (it's generated as usual
+                                if the daemon is not running). It's enabled by "daemon.client" in config file too.""",
+                        action="store_true")
     arguments = parser.parse_args()
     return arguments
 
@@ -49,11 +96,14 @@ def open_yaml_file(yaml_file):
         Content of YAML the file.
     """
 
+    # LibYAML loader is faster if it's available.
+    yaml_loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
     # Load content of YAML file.
     try:
         with open(yaml_file, 'r') as config_yaml_file:
             try:
-                yaml_file_content = yaml.safe_load(config_yaml_file)
+                yaml_file_content = yaml.load(config_yaml_file, Loader=yaml_loader)
             except yaml.YAMLError as yaml_error:
                 sys.exit(yaml_error)
     except IOError as io_error:
@@ -61,6 +111,661 @@ def open_yaml_file(yaml_file):
     return yaml_file_content
 
 
+def import_requests():
+    """Import "requests" package, it's imported only when netbox API is called.
+
+    Returns:
+        The requests module.
+    """
+
+    try:
+        import requests
+    except ImportError:
+        sys.exit('requests package is required for this inventory script.')
+    return requests
+
+
+def create_http_session(pool_size=10, retries=3, backoff_factor=0.5, http_cache=None):
+    """Create HTTP session.
+
+    The session is shared by all API calls, so connections are kept alive and reused
+    instead of a new TCP/TLS handshake for every page.
+
+    Args:
+        pool_size: Int, max number of connections kept per host.
+        retries: Int, number of retries when the API is down or rate limited (429/5xx).
+        backoff_factor: Float, factor of the exponential sleep between retries.
+        http_cache: HTTP cache which GET requests are revalidated by (no cache if it's None).
+
+    Returns:
+        A requests session.
+    """
+
+    requests = import_requests()
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    class HttpCacheAdapter(HTTPAdapter):
+        def send(self, request, **kwargs):
+            return http_cache.send(super(HttpCacheAdapter, self).send, request, **kwargs)
+
+    retry = Retry(total=retries, backoff_factor=backoff_factor,
+                  status_forcelist=(429, 500, 502, 503, 504), raise_on_status=False)
+    adapter_class = HTTPAdapter if http_cache is None else HttpCacheAdapter
+    adapter = adapter_class(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class InventoryStats(object):
+    """Timing and counters of inventory run (used by "--stats").
+
+    If it's disabled, its methods do nothing, so it could be called in hot paths.
+
+    Attributes:
+        enabled: Bool, record timing and counters or not.
+        timings: Dict, seconds of every phase e.g. "http" and "grouping".
+        counters: Dict, counters e.g. "pages_fetched" and "cache_hits".
+        clock: A function returns current time if it's enabled, otherwise 0.
+    """
+
+    def __init__(self, enabled=False):
+        self._lock = threading.Lock()
+        self.reset(enabled)
+
+    def reset(self, enabled=False):
+        self.enabled = enabled
+        self.timings = OrderedDict()
+        self.counters = OrderedDict()
+        self.clock = time.time if enabled else (lambda: 0)
+
+    def add_time(self, phase, seconds):
+        if self.enabled:
+            with self._lock:
+                self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+
+    def count(self, counter, value=1):
+        if self.enabled:
+            with self._lock:
+                self.counters[counter] = self.counters.get(counter, 0) + value
+
+    @contextmanager
+    def timer(self, phase):
+        """Add the time of a code block to a phase."""
+
+        started = self.clock()
+        try:
+            yield
+        finally:
+            self.add_time(phase, self.clock() - started)
+
+    def write(self, stats_file):
+        """Write timing and counters.
+
+        Args:
+            stats_file: String, path of JSON file, or "-" for human readable stats on stderr.
+        """
+
+        if stats_file != "-":
+            with open(stats_file, "w") as stats_json_file:
+                json.dump({"timings": self.timings, "counters": self.counters}, stats_json_file, indent=2)
+            return
+
+        # Timing of requests made at the same time are added up, so they could be more than "total".
+        sys.stderr.write("Timings (seconds):\n")
+        for phase, seconds in self.timings.items():
+            sys.stderr.write("  %-20s %10.4f\n" % (phase, seconds))
+        sys.stderr.write("Counters:\n")
+        for counter, value in self.counters.items():
+            sys.stderr.write("  %-20s %10d\n" % (counter, value))
+
+
+# Stats of current run, it's shared by static methods and all endpoints.
+inventory_stats = InventoryStats()
+
+
+def json_loads(json_data):
+    """Decode JSON using "orjson" if it's installed, otherwise the standard "json".
+
+    Args:
+        json_data: String or bytes of JSON document.
+
+    Returns:
+        The decoded JSON data.
+    """
+
+    with inventory_stats.timer("json_decode"):
+        if orjson:
+            return orjson.loads(json_data)
+        if isinstance(json_data, bytes) and not isinstance(json_data, str):
+            json_data = json_data.decode("utf-8")
+        return json.loads(json_data)
+
+
+def json_dumps(json_data):
+    """Encode JSON using "orjson" if it's installed, otherwise the standard "json".
+
+    Args:
+        json_data: JSON serializable data.
+
+    Returns:
+        String, the encoded JSON document.
+    """
+
+    if orjson:
+        return orjson.dumps(json_data, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(json_data)
+
+
+def iter_json_chunks(json_data, split_depth=3):
+    """Encode JSON piece by piece, so no big string is built for the whole document.
+
+    Dicts are split by their keys up to "split_depth" levels (e.g. inventory groups,
+    and every host of "_meta.hostvars"), and every value under that is encoded at once.
+
+    Args:
+        json_data: JSON serializable data.
+        split_depth: Int, number of dict levels which are split.
+
+    Yields:
+        Strings, pieces of the encoded JSON document.
+    """
+
+    if split_depth < 1 or not isinstance(json_data, dict) or not json_data:
+        yield json_dumps(json_data)
+        return
+
+    # Use the same separators of the library which encodes the values.
+    item_separator, key_separator = (",", ":") if orjson else (", ", ": ")
+    separator = "{"
+    for key, value in json_data.items():
+        # Non-string keys are converted like the standard "json" (e.g. 1 to "1" and True to "true").
+        if not isinstance(key, (type(""), type(u""))):
+            key = json.dumps(key)
+        # Values which are not split are encoded with their key (e.g. vars of every host).
+        if split_depth == 1 or not isinstance(value, dict) or not value:
+            yield "%s%s%s%s" % (separator, json_dumps(key), key_separator, json_dumps(value))
+        else:
+            yield "%s%s%s" % (separator, json_dumps(key), key_separator)
+            for json_chunk in iter_json_chunks(value, split_depth - 1):
+                yield json_chunk
+        separator = item_separator
+    yield "}"
+
+
+def write_json(json_data, output_file, buffer_size=65536):
+    """Write JSON to a file in chunks.
+
+    Args:
+        json_data: JSON serializable data.
+        output_file: File object which JSON is written to e.g. stdout.
+        buffer_size: Int, number of characters which are written at once.
+    """
+
+    json_buffer = []
+    buffered_size = 0
+    for json_chunk in iter_json_chunks(json_data):
+        json_buffer.append(json_chunk)
+        buffered_size += len(json_chunk)
+        if buffered_size >= buffer_size:
+            output_file.write("".join(json_buffer))
+            json_buffer = []
+            buffered_size = 0
+    output_file.write("".join(json_buffer))
+
+
+class InventoryCache(object):
+    """On-disk cache for inventory script.
+
+    Every entry is a JSON file, and its age is the modification time of that file.
+
+    Attributes:
+        cache_path: Path of cache directory.
+        cache_ttl: Seconds which cache entry is considered fresh.
+    """
+
+    def __init__(self, cache_path, cache_ttl):
+        self.cache_path = os.path.expanduser(cache_path)
+        self.cache_ttl = cache_ttl
+
+    @staticmethod
+    def make_key(*key_parts):
+        """Make cache key from any JSON serializable values.
+
+        Returns:
+            String, hash of the key parts.
+        """
+
+        key_data = json.dumps(key_parts, sort_keys=True, default=str)
+        return hashlib.sha1(key_data.encode("utf-8")).hexdigest()
+
+    def _entry_path(self, entry_name):
+        return os.path.join(self.cache_path, "%s.json" % entry_name)
+
+    def get(self, entry_name):
+        """Get cache entry.
+
+        Args:
+            entry_name: String, name of cache entry.
+
+        Returns:
+            A tuple of entry data and if it's fresh or not.
+            If entry is not found or it's unreadable, data will be None.
+        """
+
+        entry_path = self._entry_path(entry_name)
+        try:
+            entry_age = time.time() - os.path.getmtime(entry_path)
+            with open(entry_path, "r") as entry_file:
+                entry_data = json_loads(entry_file.read())
+        except (IOError, OSError, ValueError):
+            inventory_stats.count("cache_misses")
+            return None, False
+        is_fresh = entry_age < self.cache_ttl
+        inventory_stats.count("cache_hits" if is_fresh else "cache_stale")
+        return entry_data, is_fresh
+
+    def get_path(self, entry_name):
+        """Get the path of cache entry file, so it could be read without decoding it.
+
+        Args:
+            entry_name: String, name of cache entry.
+
+        Returns:
+            A tuple of entry path and if it's fresh or not.
+            If entry is not found, path will be None.
+        """
+
+        entry_path = self._entry_path(entry_name)
+        try:
+            entry_age = time.time() - os.path.getmtime(entry_path)
+        except (IOError, OSError):
+            inventory_stats.count("cache_misses")
+            return None, False
+        is_fresh = entry_age < self.cache_ttl
+        inventory_stats.count("cache_hits" if is_fresh else "cache_stale")
+        return entry_path, is_fresh
+
+    def set(self, entry_name, entry_data):
+        """Set cache entry.
+
+        The entry is written to a temporary file then renamed,
+        so readers never see a partially written entry.
+
+        Args:
+            entry_name: String, name of cache entry.
+            entry_data: JSON serializable data.
+        """
+
+        if not os.path.isdir(self.cache_path):
+            os.makedirs(self.cache_path)
+
+        import tempfile
+        entry_fd, entry_tmp_path = tempfile.mkstemp(dir=self.cache_path, suffix=".tmp")
+        try:
+            with os.fdopen(entry_fd, "w") as entry_file:
+                write_json(entry_data, entry_file)
+            os.rename(entry_tmp_path, self._entry_path(entry_name))
+        except (IOError, OSError):
+            if os.path.exists(entry_tmp_path):
+                os.remove(entry_tmp_path)
+            raise
+
+    def lock(self, entry_name):
+        """Create a lock for cache entry, so only one process refreshes it.
+
+        A lock older than cache TTL is considered left over and it will be replaced.
+
+        Returns:
+            True if the lock is acquired, otherwise False.
+        """
+
+        lock_path = "%s.lock" % self._entry_path(entry_name)
+        if not os.path.isdir(self.cache_path):
+            os.makedirs(self.cache_path)
+
+        try:
+            if time.time() - os.path.getmtime(lock_path) > self.cache_ttl:
+                os.remove(lock_path)
+        except OSError:
+            pass
+
+        try:
+            os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except OSError:
+            return False
+        return True
+
+    def unlock(self, entry_name):
+        """Remove the lock of cache entry."""
+
+        try:
+            os.remove("%s.lock" % self._entry_path(entry_name))
+        except OSError:
+            pass
+
+
+class HttpCache(object):
+    """On-disk cache of API responses which are revalidated by conditional requests.
+
+    A response which has "ETag" or "Last-Modified" header is stored by its full URL,
+    then next requests of that URL send "If-None-Match"/"If-Modified-Since" headers,
+    and the stored response is used if netbox API answers "304 Not Modified".
+    Every entry is a file of a JSON header line then the response body, and its
+    modification time is the last time it's used, so the least recently used
+    entries are removed when the cache is bigger than its max size.
+
+    Attributes:
+        cache_path: Path of cache directory.
+        max_size: Int, max size of all entries in bytes.
+    """
+
+    def __init__(self, cache_path, max_size):
+        self.cache_path = os.path.expanduser(cache_path)
+        self.max_size = max_size
+        self._cache_size = None
+        self._size_lock = threading.Lock()
+
+    def _entry_path(self, url):
+        return os.path.join(self.cache_path, "%s.http" % InventoryCache.make_key(url))
+
+    def get(self, url):
+        """Get stored response of URL.
+
+        Args:
+            url: String, full URL of the request (with query parameters).
+
+        Returns:
+            A tuple of response validators (a dict has "etag" and "last_modified") and response body.
+            If the response is not stored, both of them will be None.
+        """
+
+        entry_path = self._entry_path(url)
+        try:
+            with open(entry_path, "rb") as entry_file:
+                entry_header = json_loads(entry_file.readline())
+                entry_body = entry_file.read()
+            # Using an entry makes it the most recently used one.
+            os.utime(entry_path, None)
+        except (IOError, OSError, ValueError):
+            return None, None
+        if entry_header.get("url") != url:
+            return None, None
+        return entry_header, entry_body
+
+    def set(self, url, validators, body):
+        """Store response of URL, and remove the least recently used entries if the cache is full.
+
+        Args:
+            url: String, full URL of the request (with query parameters).
+            validators: Dict, "etag" and "last_modified" of the response.
+            body: Bytes, response body.
+        """
+
+        if not os.path.isdir(self.cache_path):
+            os.makedirs(self.cache_path)
+
+        import tempfile
+        entry_header = json.dumps(dict(validators, url=url)).encode("utf-8")
+        entry_fd, entry_tmp_path = tempfile.mkstemp(dir=self.cache_path, suffix=".tmp")
+        try:
+            with os.fdopen(entry_fd, "wb") as entry_file:
+                entry_file.write(entry_header + b"\n")
+                entry_file.write(body)
+            os.rename(entry_tmp_path, self._entry_path(url))
+        except (IOError, OSError):
+            if os.path.exists(entry_tmp_path):
+                os.remove(entry_tmp_path)
+            raise
+
+        with self._size_lock:
+            if self._cache_size is None:
+                self._cache_size = sum(entry_size for _, entry_size, _ in self._list_entries())
+            else:
+                self._cache_size += len(entry_header) + 1 + len(body)
+            if self._cache_size > self.max_size:
+                self._cache_size = self.prune()
+
+    def _list_entries(self):
+        entries = []
+        for entry_name in os.listdir(self.cache_path):
+            if not entry_name.endswith(".http"):
+                continue
+            entry_path = os.path.join(self.cache_path, entry_name)
+            try:
+                entry_stat = os.stat(entry_path)
+            except OSError:
+                continue
+            entries.append((entry_stat.st_mtime, entry_stat.st_size, entry_path))
+        return entries
+
+    def prune(self):
+        """Remove the least recently used entries until the cache is not bigger than its max size.
+
+        Returns:
+            Int, the size of the cache after removing entries.
+        """
+
+        entries = sorted(self._list_entries())
+        cache_size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, entry_path in entries:
+            if cache_size <= self.max_size:
+                break
+            try:
+                os.remove(entry_path)
+            except OSError:
+                continue
+            cache_size -= entry_size
+            inventory_stats.count("http_cache_evictions")
+        return cache_size
+
+    def send(self, send_request, request, **kwargs):
+        """Send HTTP request with the validators of its stored response.
+
+        Args:
+            send_request: A function sends the request e.g. "send" of HTTP adapter.
+            request: Prepared HTTP request.
+
+        Returns:
+            HTTP response, the stored one is used (with 200 status) if the API answers "304 Not Modified".
+        """
+
+        if request.method != "GET":
+            return send_request(request, **kwargs)
+
+        validators, cached_body = self.get(request.url)
+        if validators:
+            if validators.get("etag"):
+                request.headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                request.headers["If-Modified-Since"] = validators["last_modified"]
+
+        response = send_request(request, **kwargs)
+        if response.status_code == 304 and cached_body is not None:
+            inventory_stats.count("http_not_modified")
+            response.status_code = 200
+            response._content = cached_body
+            response.from_http_cache = True
+            return response
+
+        if response.status_code == 200:
+            validators = {"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}
+            if validators["etag"] or validators["last_modified"]:
+                try:
+                    self.set(request.url, validators, response.content)
+                except (IOError, OSError) as cache_error:
+                    sys.stderr.write("Cannot write HTTP cache.\n%s\n" % cache_error)
+        return response
+
+
+class InventoryEndpoint(object):
+    """Netbox API endpoint of inventory hosts e.g. devices or virtual machines.
+
+    Attributes:
+        api_url: Netbox API URL of hosts.
+        group_by: Dict, "group_by" config of the endpoint.
+        hosts_vars: Dict, "hosts_vars" config of the endpoint.
+        group_by_plan: List, compiled "group_by" config.
+        hosts_vars_plan: List, compiled "hosts_vars" config.
+        api_params: Dict, query parameters for all API requests of the endpoint.
+        object_type: String, netbox object type of hosts e.g. "dcim.device".
+        api_params_splits: List, query parameters of every request when hosts are fetched
+            by many requests at the same time (one per value of split filters).
+        filters: Dict, "filters" config of the endpoint (GraphQL backend sends them as they are).
+    """
+
+    def __init__(self, api_url, group_by, hosts_vars, group_by_plan, hosts_vars_plan, api_params, object_type,
+                 api_params_splits=None, filters=None):
+        self.api_url = api_url
+        self.group_by = group_by
+        self.hosts_vars = hosts_vars
+        self.group_by_plan = group_by_plan
+        self.hosts_vars_plan = hosts_vars_plan
+        self.api_params = api_params
+        self.object_type = object_type
+        self.api_params_splits = api_params_splits or []
+        self.filters = filters or {}
+        self.hosts_vars_names = [var_name for var_name, _, _, _ in hosts_vars_plan]
+
+
+class HostRecord(object):
+    """Compact host which has only the values that the inventory needs.
+
+    Host data from netbox API is reduced to this record right after it's fetched,
+    so the big nested host data is not kept in memory (e.g. in cache or sync state).
+
+    Attributes:
+        id: Netbox ID of the host.
+        name: String, host name.
+        groups: Tuple, group values in "group_by" order (False means "ungrouped" group).
+            Group values (e.g. site, role and platform names) are interned, since many hosts share them.
+        vars: Tuple, var values in "hosts_vars" order (None means the var is not set).
+    """
+
+    __slots__ = ("id", "name", "groups", "vars")
+
+    def __init__(self, host_id, host_name, host_groups, host_vars):
+        self.id = host_id
+        self.name = host_name
+        self.groups = host_groups
+        self.vars = host_vars
+
+    def to_list(self):
+        """Get JSON serializable record."""
+
+        return [self.id, self.name, self.groups, self.vars]
+
+    @classmethod
+    def from_list(cls, record_data):
+        """Make record from its JSON serializable data."""
+
+        host_id, host_name, host_groups, host_vars = record_data
+        return cls(host_id, host_name, tuple(intern_value(group_value) for group_value in host_groups),
+                   tuple(host_vars))
+
+
+def intern_value(value):
+    """Intern string value, so the same strings share memory. Other values are returned as they are."""
+
+    return intern_string(value) if type(value) is str else value
+
+
+class AnsibleInventory(object):
+    """Ansible inventory with a two-way index of hosts and groups.
+
+    Every group keeps its hosts as an ordered set, and every host keeps its groups,
+    so a host is added, moved, or removed in time proportional to the number of its groups
+    (not by scanning all groups). It's serialized to the standard Ansible dynamic inventory.
+
+    Attributes:
+        groups: Dict, hosts of every group (an ordered dict of host names for every group).
+        hosts_groups: Dict, a tuple of groups of every host in the order they're added.
+            Tuples of strings are not tracked by the garbage collector, so big inventories are built faster.
+        hosts_vars: Dict, vars of every host (it's "_meta.hostvars" in the inventory).
+    """
+
+    def __init__(self):
+        self.groups = dict()
+        self.hosts_groups = dict()
+        self.hosts_vars = dict()
+
+    def add_host(self, host_name, host_groups=(), host_vars=None):
+        """Add a host to groups and set its vars.
+
+        Args:
+            host_name: String, the host that will be added.
+            host_groups: Group values, False means "ungrouped" group (like host records).
+            host_vars: Dict, host vars (None means the vars are not changed).
+        """
+
+        if host_vars is not None:
+            self.hosts_vars[host_name] = host_vars
+        if not host_name:
+            return
+
+        groups = self.groups
+        added_groups = []
+        for group_value in host_groups:
+            group_value = group_value or "ungrouped"
+            group_hosts = groups.get(group_value)
+            if group_hosts is None:
+                group_hosts = groups[group_value] = ordered_dict()
+            if host_name not in group_hosts:
+                group_hosts[host_name] = None
+                added_groups.append(group_value)
+
+        groups_of_host = self.hosts_groups.get(host_name)
+        if groups_of_host is None or added_groups:
+            self.hosts_groups[host_name] = (groups_of_host or ()) + tuple(added_groups)
+
+    def _remove_host_from_group(self, host_name, group_value):
+        group_hosts = self.groups[group_value]
+        del group_hosts[host_name]
+        # Groups without hosts are removed, like they are never added.
+        if not group_hosts:
+            del self.groups[group_value]
+
+    def move_host(self, host_name, host_groups=(), host_vars=None):
+        """Move a host to its new groups, it stays in the same place of groups which it's already in.
+
+        Args:
+            host_name: String, the host that will be moved (it's added if it's not in the inventory).
+            host_groups: Group values, False means "ungrouped" group.
+            host_vars: Dict, new host vars (None means the vars are not changed).
+        """
+
+        groups_of_host = self.hosts_groups.get(host_name)
+        if groups_of_host:
+            new_groups = set(group_value or "ungrouped" for group_value in host_groups)
+            for group_value in groups_of_host:
+                if group_value not in new_groups:
+                    self._remove_host_from_group(host_name, group_value)
+            self.hosts_groups[host_name] = tuple(
+                group_value for group_value in groups_of_host if group_value in new_groups)
+        self.add_host(host_name, host_groups, host_vars)
+
+    def remove_host(self, host_name):
+        """Remove a host from all its groups and remove its vars."""
+
+        for group_value in self.hosts_groups.pop(host_name, ()):
+            self._remove_host_from_group(host_name, group_value)
+        self.hosts_vars.pop(host_name, None)
+
+    def to_dict(self):
+        """Get the inventory in Ansible dynamic inventory format.
+
+        Returns:
+            A dict has groups with their hosts lists, and "_meta.hostvars".
+        """
+
+        inventory_dict = {"_meta": {"hostvars": dict(self.hosts_vars)}}
+        inventory_dict.update((group_value, list(group_hosts)) for group_value, group_hosts in self.groups.items())
+        return inventory_dict
+
+
 class NetboxAsInventory(object):
     """Netbox as a dynamic inventory for Ansible.
 
@@ -70,18 +775,77 @@ class NetboxAsInventory(object):
         script_config_data: Content of its config which comes from YAML file.
     """
 
+    # The section of host data which every category comes from (None means host data itself).
+    group_by_sources = {
+        "default": None,
+        "custom": "custom_fields"
+    }
+    hosts_vars_sources = {
+        "ip": None,
+        "general": None,
+        "custom": "custom_fields"
+    }
+
+    # Adaptive page size targets.
+    min_page_size = 10
+    page_target_time = 1.0
+    page_target_bytes = 4 * 1024 * 1024
+
     def __init__(self, script_args, script_config_data):
         # Script arguments.
         self.config_file = script_args.config_file
         self.list = script_args.list
         self.host = script_args.host
+        self.refresh_cache = getattr(script_args, "refresh_cache", False)
+        inventory_stats.reset(enabled=bool(getattr(script_args, "stats", None)))
+        backend = getattr(script_args, "backend", None)
 
         # Script configuration.
         self.script_config = script_config_data
-        self.api_url = self._config(["main", "api_url"])
+        endpoints_config = self._config(["endpoints"], optional=True)
+        self.api_url = self._config(["main", "api_url"], optional=bool(endpoints_config))
         self.api_token = self._config(["main", "api_token"], default="", optional=True)
-        self.group_by = self._config(["group_by"], default={})
-        self.hosts_vars = self._config(["hosts_vars"], default={})
+        self.max_workers = self._config(["main", "max_workers"], default=1, optional=True) or 1
+        self.timeout = self._config(["main", "timeout"], optional=True)
+        self.group_by = self._config(["group_by"], default={}, optional=bool(endpoints_config)) or {}
+        self.hosts_vars = self._config(["hosts_vars"], default={}, optional=bool(endpoints_config)) or {}
+
+        # Inventory cache.
+        self.cache = None
+        self.cache_stale_while_revalidate = False
+        self.cache_key = InventoryCache.make_key(self.script_config, self.api_url)
+        cache_path = self._config(["cache", "path"], default="~/.cache/ansible-netbox-inventory", optional=True)
+        if self._config(["cache", "enabled"], optional=True):
+            self.cache = InventoryCache(cache_path, self._config(["cache", "ttl"], default=300, optional=True))
+            self.cache_stale_while_revalidate = self._config(["cache", "stale_while_revalidate"], optional=True)
+
+        # HTTP cache, API responses are revalidated by conditional requests instead of downloading them again.
+        self.http_cache = None
+        if self._config(["http_cache", "enabled"], optional=True):
+            self.http_cache = HttpCache(
+                self._config(["http_cache", "path"], default=os.path.join(cache_path, "http"), optional=True),
+                self._config(["http_cache", "max_size"], default=100 * 1024 * 1024, optional=True))
+
+        # Inventory daemon, it keeps inventory in memory and answers on a Unix socket.
+        self.daemon_socket = os.path.expanduser(
+            self._config(["daemon", "socket"], default=os.path.join(cache_path, "netbox.sock"), optional=True))
+        self.daemon_refresh_interval = self._config(["daemon", "refresh_interval"], default=300, optional=True)
+        self.daemon_client = getattr(script_args, "client", False) or \
+            self._config(["daemon", "client"], optional=True)
+
+        # Webhook listener of the daemon, netbox webhooks of hosts changes update the inventory in memory.
+        self.daemon_webhook_port = self._config(["daemon", "webhook", "port"], optional=True)
+        self.daemon_webhook_listen = self._config(["daemon", "webhook", "listen"], default="127.0.0.1", optional=True)
+        self.daemon_webhook_secret = self._config(["daemon", "webhook", "secret"], optional=True)
+        self.daemon_cache_write_delay = self._config(["daemon", "webhook", "cache_write_delay"], default=10,
+                                                     optional=True)
+
+        # Static inventory file which is exported by "--export" and printed by "--serve-file".
+        self.export_path = self._config(["export", "path"], optional=True)
+        self.export_gzip = self._config(["export", "gzip"], optional=True)
+        self.export_max_age = self._config(["export", "max_age"], default=3600, optional=True)
+        # Ansible calls the script with "--list" or "--host" only, so "--serve-file" could be enabled by config.
+        self.export_serve = self._config(["export", "serve"], optional=True)
 
         # Get value based on key.
         self.key_map = {
@@ -91,6 +855,62 @@ class NetboxAsInventory(object):
             "ip": "address"
         }
 
+        # Page size.
+        self.max_page_size = self._config(["main", "max_page_size"], default=1000, optional=True)
+        self.adaptive_page_size = self._config(["main", "adaptive_page_size"], optional=True)
+        self.page_size = self._config(["main", "page_size"], optional=True)
+        self.trim_fields = self._config(["main", "trim_fields"], optional=True)
+
+        # Hosts filters which are sent to netbox API, e.g. {"status": "active", "site": ["site-a", "site-b"]}.
+        self.filters = self._config(["filters"], default={}, optional=True) or {}
+        self.split_filters = self._config(["split_filters"], default=[], optional=True) or []
+
+        # Related objects (e.g. sites and IP addresses) which are fetched once and used by dotted paths.
+        # The lookup tables are filled before hosts are processed, and compiled config refers to them.
+        self.prefetch = self._config(["prefetch"], default={}, optional=True) or {}
+        self.prefetch_params = {"limit": min(self.page_size, self.max_page_size)} if self.page_size else {}
+        self.lookup_tables = {}
+
+        # Hosts endpoints e.g. devices and virtual machines.
+        # If no endpoints in config, "main.api_url" with "group_by" and "hosts_vars" is used.
+        if not endpoints_config:
+            endpoints_config = [{"object_type": self._config(["sync", "object_type"], optional=True)}]
+        self.endpoints = [self._make_endpoint(endpoint_config) for endpoint_config in endpoints_config]
+
+        # All endpoints are fetched at the same time, and every one of them uses up to "max_workers" connections.
+        self.pool_size = max(self._config(["main", "pool_size"], default=10, optional=True),
+                             self.max_workers * len(self.endpoints))
+        self.retries = self._config(["main", "retries"], default=3, optional=True)
+        self.backoff_factor = self._config(["main", "backoff_factor"], default=0.5, optional=True)
+        self._session = None
+
+        # HTTP backend, "requests" (blocking), "asyncio" (all requests on a single event loop),
+        # or "graphql" (only the fields of the config are fetched by GraphQL queries).
+        self.backend = backend or self._config(["main", "backend"], default="requests", optional=True)
+        if self.backend not in ("requests", "asyncio", "graphql"):
+            sys.exit("The backend %s is not supported, it should be requests, asyncio, or graphql." % self.backend)
+        self.graphql_url = self._config(["main", "graphql_url"], optional=True) or \
+            self._get_graphql_url(self.endpoints[0].api_url)
+        self.graphql_types = {}
+
+        # Incremental sync, hosts are stored in the cache path and only changed hosts are fetched.
+        self.sync_store = None
+        if self._config(["sync", "incremental"], optional=True):
+            self.sync_store = InventoryCache(
+                cache_path, self._config(["sync", "full_sync_interval"], default=86400, optional=True))
+            self.sync_changelog_url = self._config(
+                ["sync", "changelog_url"], default=self._get_changelog_url(self.endpoints[0].api_url), optional=True)
+            self.sync_overlap = self._config(["sync", "overlap"], default=60, optional=True)
+
+    @property
+    def session(self):
+        """HTTP session of all API requests, it's created on first API request."""
+
+        if self._session is None:
+            self._session = create_http_session(pool_size=self.pool_size, retries=self.retries,
+                                                backoff_factor=self.backoff_factor, http_cache=self.http_cache)
+        return self._session
+
     def _get_value_by_path(self, source_dict, key_path,
                            ignore_key_error=False, default="", error_message=""):
         """Get key value from nested dict by path.
@@ -152,70 +972,621 @@ class NetboxAsInventory(object):
         return key_value
 
     @staticmethod
-    def get_hosts_list(api_url, api_token=None, specific_host=None):
-        """Retrieves hosts list from netbox API.
+    def _follow_path(data_dict, path_keys, lookup_tables, strict=True):
+        """Get value of dotted path (e.g. "site.region") from host data.
+
+        Every object on the path is replaced by the full object from lookup table
+        with the same name of its key (if it's prefetched), so its fields could be used.
+
+        Args:
+            data_dict: Dict, the host data.
+            path_keys: List, keys of the path.
+            lookup_tables: Dict, prefetched objects by ID for every key.
+            strict: Bool, raise KeyError if a key is not found, otherwise None is returned.
 
         Returns:
-            A list of all hosts from netbox API.
+            The value of the path, or None if any object on the path is empty.
         """
 
-        if not api_url:
-            sys.exit("Please check API URL in script configuration file.")
+        path_value = data_dict
+        last_index = len(path_keys) - 1
+        for key_index, key in enumerate(path_keys):
+            if not isinstance(path_value, dict):
+                return None
+            path_value = path_value[key] if strict else path_value.get(key)
+            if key_index < last_index and isinstance(path_value, dict) and key in lookup_tables:
+                path_value = lookup_tables[key].get(path_value.get("id"), path_value)
+        return path_value
 
-        api_url_headers = {}
-        api_url_params = {}
+    @staticmethod
+    def _make_group_getter(group, key_name, lookup_tables=None):
+        """Make a function that gets group value from host data.
 
-        if api_token:
-            api_url_headers.update({"Authorization": "Token %s" % api_token})
+        Args:
+            group: String, the section of host data which is used as a group,
+                or a dotted path through related objects e.g. "site.region".
+            key_name: String, the key of group value if the section is a dict.
+            lookup_tables: Dict, prefetched related objects which dotted paths go through.
 
-        if specific_host:
-            api_url_params.update({"name": specific_host})
+        Returns:
+            A function takes category data of the host and returns its group value.
+        """
 
-        hosts_list = []
+        error_message = "The key %s is not found. Please remember, Python is case sensitive."
+        path_keys = group.split(".")
+        lookup_tables = {} if lookup_tables is None else lookup_tables
 
-        # Pagination.
-        while api_url:
-            # Get hosts list.
-            api_output = requests.get(api_url, params=api_url_params, headers=api_url_headers)
+        def get_group_value(data_dict):
+            try:
+                group_value = data_dict[group]
+                if isinstance(group_value, dict):
+                    group_value = group_value[key_name]
+            except KeyError as key_error:
+                sys.exit(error_message % key_error)
+            return group_value
+
+        def get_group_path_value(data_dict):
+            try:
+                group_value = NetboxAsInventory._follow_path(data_dict, path_keys, lookup_tables)
+                if isinstance(group_value, dict):
+                    group_value = group_value[key_name]
+            except KeyError as key_error:
+                sys.exit(error_message % key_error)
+            return group_value
+        return get_group_path_value if len(path_keys) > 1 else get_group_value
 
-            # Check that a request is 200 and not something else like 404, 401, 500 ... etc.
-            api_output.raise_for_status()
+    @staticmethod
+    def _make_var_getter(var_data, key_name, lookup_tables=None):
+        """Make a function that gets var value from host data.
 
-            # Get api output data.
-            api_output_data = api_output.json()
+        Args:
+            var_data: String, the section of host data which is used as a var,
+                or a dotted path through related objects e.g. "primary_ip.dns_name".
+            key_name: String, the key of var value if the section is a dict.
+            lookup_tables: Dict, prefetched related objects which dotted paths go through.
 
-            if isinstance(api_output_data, dict) and "results" in api_output_data:
-                hosts_list += api_output_data["results"]
-                api_url = api_output_data["next"]
+        Returns:
+            A function takes category data of the host and returns its var value or None.
+        """
 
-        # Get hosts list.
-        return hosts_list
+        path_keys = var_data.split(".")
+        lookup_tables = {} if lookup_tables is None else lookup_tables
 
-    @staticmethod
-    def add_host_to_group(server_name, group_value, inventory_dict):
-        """Add a host to a single group.
+        def get_var_value(data_dict):
+            var_value = data_dict.get(var_data)
+            # This is because "custom_fields" has more than 1 type.
+            # Values inside "custom_fields" could be a key:value or a dict.
+            if isinstance(var_value, dict):
+                var_value = var_value.get(key_name)
+            return var_value
 
-        It checks if host in a group and adds the host to that group.
-        The group will be added if it's not in the inventory.
+        def get_var_path_value(data_dict):
+            var_value = NetboxAsInventory._follow_path(data_dict, path_keys, lookup_tables, strict=False)
+            if isinstance(var_value, dict):
+                var_value = var_value.get(key_name)
+            return var_value
+        return get_var_path_value if len(path_keys) > 1 else get_var_value
+
+    def _compile_group_by(self, groups_categories):
+        """Compile "group_by" config to a list of steps.
 
         Args:
-            server_name: String, the server that will be added to a group.
-            group_value: String, name that will be used as a group in the inventory.
-            inventory_dict: Dict, the inventory which will be updated.
+            groups_categories: Dict, it has a categories of groups.
 
         Returns:
-            The dict "inventory_dict" after adding the host to its group/s.
+            A list of tuples (source key, group getter).
+            If the getter is None, the host will go to catch-all group.
         """
 
-        # The value could be None/null.
-        if server_name and group_value:
-            # If the group not in the inventory it will be add.
-            if group_value not in inventory_dict:
-                inventory_dict.update({group_value: []})
+        # If no groups and no category in "group_by" section, the host will go to catch-all group.
+        if not groups_categories:
+            return [(None, None)]
 
-            # If the host not in the group it will be add.
-            if server_name not in inventory_dict[group_value]:
-                inventory_dict[group_value].append(server_name)
+        group_by_plan = []
+        for category in groups_categories:
+            key_name = self.key_map[category]
+            source_key = self.group_by_sources[category]
+
+            # If any category defined but no groups in "group_by" section, the host will go to catch-all group.
+            if not groups_categories[category]:
+                group_by_plan.append((None, None))
+                continue
+
+            for group in groups_categories[category]:
+                group_by_plan.append((source_key, self._make_group_getter(group, key_name, self.lookup_tables)))
+        return group_by_plan
+
+    def _compile_hosts_vars(self, host_vars):
+        """Compile "hosts_vars" config to a list of steps.
+
+        Args:
+            host_vars: Dict, it has selected fields to be used as host vars.
+
+        Returns:
+            A list of tuples (var name, source key, var getter, remove CIDR or not).
+        """
+
+        hosts_vars_plan = []
+        if not host_vars:
+            return hosts_vars_plan
+
+        ip_vars_data = host_vars["ip"].values() if "ip" in host_vars else []
+        for category in host_vars:
+            key_name = self.key_map[category]
+            source_key = self.hosts_vars_sources[category]
+
+            for var_name, var_data in host_vars[category].items():
+                remove_cidr = var_data in ip_vars_data
+                hosts_vars_plan.append((var_name, source_key,
+                                        self._make_var_getter(var_data, key_name, self.lookup_tables), remove_cidr))
+        return hosts_vars_plan
+
+    def _make_endpoint(self, endpoint_config):
+        """Make hosts endpoint from its config.
+
+        Any missing "api_url", "group_by", or "hosts_vars" comes from the main config.
+
+        Args:
+            endpoint_config: Dict, endpoint config.
+
+        Returns:
+            Inventory endpoint.
+        """
+
+        api_url = endpoint_config.get("api_url") or self.api_url
+        group_by = endpoint_config.get("group_by", self.group_by) or {}
+        hosts_vars = endpoint_config.get("hosts_vars", self.hosts_vars) or {}
+        filters = endpoint_config.get("filters", self.filters) or {}
+        filters_params = self._get_filters_params(filters)
+        split_filters = endpoint_config.get("split_filters", self.split_filters) or []
+
+        api_params = {}
+        if self.trim_fields:
+            api_params.update(self._get_fields_params(self._get_api_fields(group_by, hosts_vars)))
+        if self.page_size:
+            api_params.update({"limit": min(self.page_size, self.max_page_size)})
+        api_params.update(filters_params)
+
+        return InventoryEndpoint(
+            api_url, group_by, hosts_vars,
+            self._compile_group_by(group_by), self._compile_hosts_vars(hosts_vars), api_params,
+            endpoint_config.get("object_type") or self._get_object_type(api_url),
+            self._get_params_splits(api_params, split_filters), filters)
+
+    @staticmethod
+    def _get_filters_params(filters):
+        """Get query parameters of hosts filters.
+
+        Many values of a filter are sent as a repeated parameter (netbox returns hosts match any of them).
+
+        Args:
+            filters: Dict, "filters" config e.g. {"status": "active", "tag": ["prod", "web"]}.
+
+        Returns:
+            A dict of query parameters.
+        """
+
+        def get_param_value(filter_value):
+            # YAML booleans are sent like netbox expects.
+            if isinstance(filter_value, bool):
+                return "true" if filter_value else "false"
+            return filter_value
+
+        filters_params = {}
+        for filter_name, filter_value in filters.items():
+            if isinstance(filter_value, (list, tuple)):
+                filters_params[filter_name] = [get_param_value(value) for value in filter_value]
+            else:
+                filters_params[filter_name] = get_param_value(filter_value)
+        return filters_params
+
+    @staticmethod
+    def _get_params_splits(api_params, split_filters):
+        """Split query parameters to one request per value of multi-value filters.
+
+        If many filters are split, every combination of their values is a request.
+
+        Args:
+            api_params: Dict, query parameters of the endpoint.
+            split_filters: List, names of filters which are split.
+
+        Returns:
+            A list of query parameters dicts, or an empty list if there is nothing to split.
+        """
+
+        split_values = []
+        for filter_name in split_filters:
+            filter_values = api_params.get(filter_name)
+            if isinstance(filter_values, list) and len(filter_values) > 1:
+                split_values.append([(filter_name, filter_value) for filter_value in filter_values])
+
+        if not split_values:
+            return []
+        return [dict(api_params, **dict(split_params)) for split_params in product(*split_values)]
+
+    @staticmethod
+    def _get_object_type(api_url):
+        """Get netbox object type from hosts API URL.
+
+        e.g. "/api/dcim/devices/" is "dcim.device", and "/api/virtualization/virtual-machines/"
+        is "virtualization.virtualmachine".
+
+        Returns:
+            String, netbox object type.
+        """
+
+        api_path = [path_part for path_part in urlparse(api_url or "").path.split("/") if path_part]
+        if len(api_path) < 2:
+            return None
+        app_label, model_name = api_path[-2], api_path[-1].replace("-", "")
+        if model_name.endswith("s"):
+            model_name = model_name[:-1]
+        return "%s.%s" % (app_label, model_name)
+
+    @staticmethod
+    def _get_changelog_url(api_url):
+        """Get netbox changelog API URL from hosts API URL.
+
+        Returns:
+            String, URL of netbox changelog API (it's "/api/core/object-changes/" in netbox v4.1 and above).
+        """
+
+        api_url_parts = urlparse(api_url or "")
+        api_root = api_url_parts.path.split("/api/")[0]
+        return "%s://%s%s/api/extras/object-changes/" % (api_url_parts.scheme, api_url_parts.netloc, api_root)
+
+    def _get_api_fields(self, group_by, hosts_vars):
+        """Get host fields which are used by "group_by" and "hosts_vars" config.
+
+        Args:
+            group_by: Dict, "group_by" config.
+            hosts_vars: Dict, "hosts_vars" config.
+
+        Returns:
+            A sorted list of top level fields of host data.
+        """
+
+        api_fields = set(["id", "name"])
+        for config_section, categories_sources in ((group_by, self.group_by_sources),
+                                                   (hosts_vars, self.hosts_vars_sources)):
+            for category in config_section or {}:
+                source_key = categories_sources[category]
+                if source_key:
+                    api_fields.add(source_key)
+                elif isinstance(config_section[category], dict):
+                    api_fields.update(path.split(".")[0] for path in config_section[category].values())
+                else:
+                    api_fields.update(path.split(".")[0] for path in config_section[category] or [])
+        return sorted(api_fields)
+
+    @staticmethod
+    def _get_fields_params(api_fields):
+        """Get query parameters which ask netbox API only for selected fields.
+
+        If "id" and "name" are the only needed fields, brief mode is used.
+        Otherwise "fields" parameter is used (netbox v4.0 and above).
+
+        Args:
+            api_fields: List, fields of host data.
+
+        Returns:
+            A dict of query parameters.
+        """
+
+        if set(api_fields) <= set(["id", "name"]):
+            return {"brief": "true"}
+        return {"fields": ",".join(api_fields)}
+
+    @staticmethod
+    def _get_graphql_url(api_url):
+        """Get netbox GraphQL API URL from hosts API URL.
+
+        Returns:
+            String, URL of netbox GraphQL API.
+        """
+
+        api_url_parts = urlparse(api_url or "")
+        api_root = api_url_parts.path.split("/api/")[0]
+        return "%s://%s%s/graphql/" % (api_url_parts.scheme, api_url_parts.netloc, api_root)
+
+    @staticmethod
+    def _get_graphql_list_name(api_url):
+        """Get the name of GraphQL list query from hosts API URL.
+
+        e.g. "/api/dcim/devices/" is "device_list", and "/api/virtualization/virtual-machines/"
+        is "virtual_machine_list".
+
+        Returns:
+            String, name of GraphQL list query.
+        """
+
+        api_path = [path_part for path_part in urlparse(api_url or "").path.split("/") if path_part]
+        model_name = api_path[-1].replace("-", "_") if api_path else ""
+        if model_name.endswith("s"):
+            model_name = model_name[:-1]
+        return "%s_list" % model_name
+
+    @staticmethod
+    def _get_api_response(api_url, api_url_params, api_url_headers, session=None, timeout=None):
+        """Retrieves a single page response from netbox API.
+
+        Args:
+            api_url: String, URL of the page.
+            api_url_params: Dict, query parameters of the page.
+            api_url_headers: Dict, HTTP headers of the request.
+            session: HTTP session, if not set a new connection will be used.
+            timeout: Float, seconds to wait for the API before giving up.
+
+        Returns:
+            The HTTP response of the page.
+        """
+
+        http_client = session or import_requests()
+
+        # Get hosts list.
+        with inventory_stats.timer("http"):
+            api_output = http_client.get(api_url, params=api_url_params, headers=api_url_headers, timeout=timeout)
+            inventory_stats.count("pages_fetched")
+            if not getattr(api_output, "from_http_cache", False):
+                inventory_stats.count("bytes_received", len(api_output.content or b""))
+
+        # Check that a request is 200 and not something else like 404, 401, 500 ... etc.
+        api_output.raise_for_status()
+        return api_output
+
+    @staticmethod
+    def _get_api_page(api_url, api_url_params, api_url_headers, session=None, timeout=None):
+        """Retrieves a single page from netbox API.
+
+        Returns:
+            The decoded JSON output of the page.
+        """
+
+        # Get api output data.
+        return json_loads(NetboxAsInventory._get_api_response(api_url, api_url_params, api_url_headers,
+                                                              session=session, timeout=timeout).content)
+
+    @staticmethod
+    def _tune_page_size(page_limit, page_time, page_bytes, page_hosts, max_page_size):
+        """Calculate the next page size from the time and the size of the last page.
+
+        The page size grows (at most double) while the API responds fast,
+        and it shrinks (at most half) if the page is slow or too big.
+
+        Args:
+            page_limit: Int, the page size of last page.
+            page_time: Float, seconds of last page request.
+            page_bytes: Int, response size of last page.
+            page_hosts: Int, number of hosts in last page.
+            max_page_size: Int, the max page size that netbox API accepts.
+
+        Returns:
+            Int, the next page size.
+        """
+
+        next_page_limit = page_limit * 2
+        if page_time > 0:
+            next_page_limit = min(next_page_limit, page_limit * NetboxAsInventory.page_target_time / page_time)
+        if page_bytes and page_hosts:
+            next_page_limit = min(next_page_limit, NetboxAsInventory.page_target_bytes * page_hosts / page_bytes)
+        next_page_limit = max(next_page_limit, page_limit // 2, NetboxAsInventory.min_page_size)
+        return int(min(next_page_limit, max_page_size))
+
+    @staticmethod
+    def _get_pages_params(api_url_params, api_output_data):
+        """Calculate the params of all remaining pages from the first page.
+
+        It uses "count" and the "limit"/"offset" of the "next" URL,
+        so all pages could be requested at the same time.
+
+        Args:
+            api_url_params: Dict, query parameters of the first page.
+            api_output_data: Dict, the decoded output of the first page.
+
+        Returns:
+            A list of params dicts (one per page), or None if the pages cannot be calculated.
+        """
+
+        next_query = parse_qs(urlparse(api_output_data.get("next") or "").query)
+        hosts_count = api_output_data.get("count")
+
+        try:
+            page_limit = int(next_query["limit"][0])
+            first_offset = int(next_query["offset"][0])
+        except (KeyError, IndexError, ValueError):
+            return None
+
+        if not isinstance(hosts_count, int) or page_limit < 1:
+            return None
+
+        pages_params = []
+        for page_offset in range(first_offset, hosts_count, page_limit):
+            page_params = dict(api_url_params)
+            page_params.update({"limit": page_limit, "offset": page_offset})
+            pages_params.append(page_params)
+        return pages_params
+
+    @staticmethod
+    def iter_hosts_pages(api_url, api_token=None, specific_host=None, max_workers=1, session=None, timeout=None,
+                         api_params=None, adaptive_page_size=False, max_page_size=1000):
+        """Retrieves hosts from netbox API page by page.
+
+        The next pages are fetched in the background while the current page is being processed.
+
+        Args:
+            api_url: String, netbox API URL of hosts.
+            api_token: String, netbox API token.
+            specific_host: String, get only that host from netbox API.
+            max_workers: Int, max number of pages fetched at the same time.
+                If it's more than 1, all pages are calculated from "count" of the first page
+                and fetched concurrently, otherwise "next" is followed page by page.
+            session: HTTP session shared by all requests (connection pooling and retries).
+            timeout: Float, seconds to wait for every API request.
+            api_params: Dict, extra query parameters for hosts API e.g. selected fields or page size "limit".
+            adaptive_page_size: Bool, tune page size of every page based on the time and the size of
+                the previous one. It's used with serial pagination only.
+            max_page_size: Int, the max page size that netbox API accepts ("MAX_PAGE_SIZE" in netbox).
+
+        Yields:
+            A list of hosts for every page, in the same order of netbox API.
+        """
+
+        if not api_url:
+            sys.exit("Please check API URL in script configuration file.")
+
+        from concurrent import futures
+
+        api_url_headers = {}
+        api_url_params = dict(api_params or {})
+
+        if api_token:
+            api_url_headers.update({"Authorization": "Token %s" % api_token})
+
+        if specific_host:
+            api_url_params.update({"name": specific_host})
+
+        def get_page(page_url, page_params):
+            return NetboxAsInventory._get_api_page(page_url, page_params, api_url_headers,
+                                                   session=session, timeout=timeout)
+
+        def get_page_with_stats(page_url, page_params):
+            page_started = time.time()
+            api_output = NetboxAsInventory._get_api_response(page_url, page_params, api_url_headers,
+                                                             session=session, timeout=timeout)
+            page_data = json_loads(api_output.content)
+            return page_data, time.time() - page_started, len(api_output.content or b"")
+
+        def is_hosts_page(page_data):
+            return isinstance(page_data, dict) and "results" in page_data
+
+        # Get first page.
+        api_output_data, page_time, page_bytes = get_page_with_stats(api_url, api_url_params)
+        if not is_hosts_page(api_output_data):
+            return
+
+        # Parallel pagination.
+        pages_params = None
+        if max_workers > 1 and api_output_data["next"]:
+            pages_params = NetboxAsInventory._get_pages_params(api_url_params, api_output_data)
+
+        if pages_params:
+            # Pages are yielded in order, and only a limited number of them are fetched ahead,
+            # so the hosts list is the same as the serial pagination.
+            with futures.ThreadPoolExecutor(max_workers=min(max_workers, len(pages_params))) as executor:
+                pending_pages_params = iter(pages_params)
+                pages_futures = deque(executor.submit(get_page, api_url, page_params)
+                                      for page_params in islice(pending_pages_params, max_workers * 2))
+                yield api_output_data["results"]
+
+                while pages_futures:
+                    page_data = pages_futures.popleft().result()
+                    for page_params in islice(pending_pages_params, 1):
+                        pages_futures.append(executor.submit(get_page, api_url, page_params))
+                    yield page_data.get("results", [])
+            return
+
+        # Serial pagination with adaptive page size.
+        # Pages are requested by "offset", so every page could have a different "limit".
+        if adaptive_page_size:
+            page_limit = int(api_url_params.get("limit") or len(api_output_data["results"]) or 1)
+            page_offset = 0
+            with futures.ThreadPoolExecutor(max_workers=1) as executor:
+                while True:
+                    page_hosts = len(api_output_data["results"])
+                    page_offset += page_hosts
+                    next_page_future = None
+                    if api_output_data["next"] and page_hosts:
+                        # Netbox returns less hosts than requested if the limit is more than its "MAX_PAGE_SIZE".
+                        if page_hosts < page_limit:
+                            max_page_size = page_hosts
+                        page_limit = NetboxAsInventory._tune_page_size(page_limit, page_time, page_bytes,
+                                                                       page_hosts, max_page_size)
+                        page_params = dict(api_url_params)
+                        page_params.update({"limit": page_limit, "offset": page_offset})
+                        next_page_future = executor.submit(get_page_with_stats, api_url, page_params)
+
+                    yield api_output_data["results"]
+
+                    if next_page_future is None:
+                        break
+                    api_output_data, page_time, page_bytes = next_page_future.result()
+                    if not is_hosts_page(api_output_data):
+                        break
+            return
+
+        # Serial pagination.
+        with futures.ThreadPoolExecutor(max_workers=1) as executor:
+            while True:
+                next_page_future = None
+                if api_output_data["next"]:
+                    # The "next" URL already has all query parameters.
+                    next_page_future = executor.submit(get_page, api_output_data["next"], None)
+
+                yield api_output_data["results"]
+
+                if next_page_future is None:
+                    break
+                api_output_data = next_page_future.result()
+                if not is_hosts_page(api_output_data):
+                    break
+
+    @staticmethod
+    def get_hosts_list(api_url, api_token=None, specific_host=None, max_workers=1, session=None, timeout=None,
+                       api_params=None, adaptive_page_size=False, max_page_size=1000):
+        """Retrieves hosts list from netbox API.
+
+        Args:
+            api_url: String, netbox API URL of hosts.
+            api_token: String, netbox API token.
+            specific_host: String, get only that host from netbox API.
+            max_workers: Int, max number of pages fetched at the same time.
+            session: HTTP session shared by all requests (connection pooling and retries).
+            timeout: Float, seconds to wait for every API request.
+            api_params: Dict, extra query parameters for hosts API e.g. selected fields or page size "limit".
+            adaptive_page_size: Bool, tune page size based on the time and the size of previous page.
+            max_page_size: Int, the max page size that netbox API accepts.
+
+        Returns:
+            A list of all hosts from netbox API.
+        """
+
+        hosts_list = []
+        for hosts_page in NetboxAsInventory.iter_hosts_pages(api_url, api_token, specific_host,
+                                                             max_workers=max_workers,
+                                                             session=session, timeout=timeout,
+                                                             api_params=api_params,
+                                                             adaptive_page_size=adaptive_page_size,
+                                                             max_page_size=max_page_size):
+            hosts_list += hosts_page
+
+        # Get hosts list.
+        return hosts_list
+
+    @staticmethod
+    def add_host_to_group(server_name, group_value, inventory_dict):
+        """Add a host to a single group.
+
+        It checks if host in a group and adds the host to that group.
+        The group will be added if it's not in the inventory.
+
+        Args:
+            server_name: String, the server that will be added to a group.
+            group_value: String, name that will be used as a group in the inventory.
+            inventory_dict: Dict, the inventory which will be updated.
+
+        Returns:
+            The dict "inventory_dict" after adding the host to its group/s.
+        """
+
+        # The value could be None/null.
+        if server_name and group_value:
+            # If the group not in the inventory it will be add.
+            if group_value not in inventory_dict:
+                inventory_dict.update({group_value: []})
+
+            # If the host not in the group it will be add.
+            if server_name not in inventory_dict[group_value]:
+                inventory_dict[group_value].append(server_name)
         return inventory_dict
 
     def add_host_to_inventory(self, groups_categories, inventory_dict, host_data):
@@ -223,6 +1594,8 @@ class NetboxAsInventory(object):
 
         It checks if host in the groups and adds the host to these groups.
         The groups are defined in this inventory script config file.
+        The inventory is generated from hosts records, this method is kept for
+        scripts which use this class, and it finds the groups the same way.
 
         Args:
             groups_categories: Dict, it has a categories of groups that will be
@@ -234,54 +1607,25 @@ class NetboxAsInventory(object):
             The dict "inventory_dict" after adding the host to it.
         """
 
-        server_name = host_data.get("name")
-        categories_source = {
-            "default": host_data,
-            "custom": host_data.get("custom_fields")
-        }
-
-        if groups_categories:
-            # There are 2 categories that will be used to group hosts.
-            # One for default section in netbox, and another for "custom_fields" which are being defined by netbox user.
-            for category in groups_categories:
-                key_name = self.key_map[category]
-                data_dict = categories_source[category]
-
-                if groups_categories[category]:
-                    # The groups that will be used to group hosts in the inventory.
-                    for group in groups_categories[category]:
-                        # Try to get group value. If the section not found in netbox, this also will print error message.
-                        if data_dict:
-                            group_value = self._get_value_by_path(data_dict, [group, key_name])
-
-                            if group_value:
-                                inventory_dict = self.add_host_to_group(server_name, group_value, inventory_dict)
-                            # If any groups defined in "group_by" section, but host is not part of that group, it will go to catch-all group.
-                            else:
-                                self._put_host_to_ungrouped(inventory_dict, server_name)
-                # If any category defined but no groups in "group_by" section, the host will go to catch-all group.
-                else:
-                    self._put_host_to_ungrouped(inventory_dict, server_name)
-        # If no groups and no category in "group_by" section, the host will go to catch-all group.
+        endpoint = self.endpoints[0]
+        if groups_categories is endpoint.group_by:
+            group_by_plan = endpoint.group_by_plan
         else:
-            self._put_host_to_ungrouped(inventory_dict, server_name)
+            group_by_plan = self._compile_group_by(groups_categories)
 
+        server_name = host_data.get("name")
+        for group_value in self._get_host_groups(group_by_plan, host_data):
+            self.add_host_to_group(server_name, group_value or "ungrouped", inventory_dict)
         return inventory_dict
 
-    @staticmethod
-    def _put_host_to_ungrouped(inventory_dict, server_name):
-        if "ungrouped" not in inventory_dict:
-            inventory_dict.setdefault("ungrouped", [server_name])
-        else:
-            if server_name not in inventory_dict["ungrouped"]:
-                inventory_dict["ungrouped"].append(server_name)
-
     def get_host_vars(self, host_data, host_vars):
         """Find host vars.
 
         These vars will be used for host in the inventory.
         We can select whatever from netbox to be used as Ansible inventory vars.
         The vars are defined in script config file.
+        The inventory is generated from hosts records, this method is kept for
+        scripts which use this class, and it finds the vars the same way.
 
         Args:
             host_data: Dict, it has a host data which will be added to inventory.
@@ -291,73 +1635,1042 @@ class NetboxAsInventory(object):
             A dict has all vars are associated with the host.
         """
 
+        endpoint = self.endpoints[0]
+        if host_vars is endpoint.hosts_vars:
+            hosts_vars_plan = endpoint.hosts_vars_plan
+        else:
+            hosts_vars_plan = self._compile_hosts_vars(host_vars)
+
+        return self._get_host_vars(hosts_vars_plan, host_data)
+
+    @staticmethod
+    def _get_host_vars(hosts_vars_plan, host_data):
+        """Find host vars using compiled "hosts_vars" config.
+
+        Args:
+            hosts_vars_plan: List, compiled "hosts_vars" config.
+            host_data: Dict, it has a host data which will be added to inventory.
+
+        Returns:
+            A dict has all vars are associated with the host.
+        """
+
         host_vars_dict = dict()
-        if host_vars:
-            categories_source = {
-                "ip": host_data,
-                "general": host_data,
-                "custom": host_data.get("custom_fields")
-            }
-
-            # Get host vars based on selected vars. (that should come from
-            # script's config file)
-            for category in host_vars:
-                key_name = self.key_map[category]
-                data_dict = categories_source[category]
-
-                for var_name, var_data in host_vars[category].items():
-                    # This is because "custom_fields" has more than 1 type.
-                    # Values inside "custom_fields" could be a key:value or a dict.
-                    if isinstance(data_dict.get(var_data), dict):
-                        var_value = self._get_value_by_path(data_dict, [var_data, key_name], ignore_key_error=True)
-                    else:
-                        var_value = data_dict.get(var_data)
-
-                    if var_value is not None:
-                        # Remove CIDR from IP address.
-                        if "ip" in host_vars and var_data in host_vars["ip"].values():
-                            var_value = var_value.split("/")[0]
-                        # Add var to host dict.
-                        host_vars_dict.update({var_name: var_value})
+        host_vars_values = NetboxAsInventory._get_host_vars_values(hosts_vars_plan, host_data)
+        for (var_name, _, _, _), var_value in zip(hosts_vars_plan, host_vars_values):
+            if var_value is not None:
+                # Add var to host dict.
+                host_vars_dict[var_name] = var_value
         return host_vars_dict
 
-    def update_host_meta_vars(self, inventory_dict, host_name, host_vars):
+    @staticmethod
+    def _get_host_vars_values(hosts_vars_plan, host_data):
+        """Find host vars values using compiled "hosts_vars" config.
+
+        Args:
+            hosts_vars_plan: List, compiled "hosts_vars" config.
+            host_data: Dict, it has a host data which will be added to inventory.
+
+        Returns:
+            A tuple of var values in the same order of the compiled config (None if the var is not found).
+        """
+
+        host_vars_values = []
+        for _, source_key, get_var_value, remove_cidr in hosts_vars_plan:
+            data_dict = host_data if source_key is None else host_data.get(source_key) or {}
+            var_value = get_var_value(data_dict)
+
+            # Remove CIDR from IP address.
+            if var_value is not None and remove_cidr:
+                var_value = var_value.split("/")[0]
+            host_vars_values.append(var_value)
+        return tuple(host_vars_values)
+
+    @staticmethod
+    def _get_host_groups(group_by_plan, host_data):
+        """Find host groups using compiled "group_by" config.
+
+        Args:
+            group_by_plan: List, compiled "group_by" config.
+            host_data: Dict, it has a host data which will be added to inventory.
+
+        Returns:
+            A tuple of group values, False means the host goes to "ungrouped" group.
+        """
+
+        host_groups = []
+        for source_key, get_group_value in group_by_plan:
+            if get_group_value is None:
+                host_groups.append(False)
+                continue
+
+            # Try to get group value. If the section not found in netbox, this also will print error message.
+            data_dict = host_data if source_key is None else host_data.get(source_key)
+            if data_dict:
+                group_value = get_group_value(data_dict)
+                # If any groups defined in "group_by" section, but host is not part of that group, it will go to catch-all group.
+                host_groups.append(intern_value(group_value) if group_value else False)
+        return tuple(host_groups)
+
+    def _make_hosts_records(self, endpoint, hosts_list):
+        """Reduce hosts data to compact records which have only their groups and vars.
+
+        Args:
+            endpoint: Inventory endpoint which hosts come from.
+            hosts_list: A list of hosts data from netbox API.
+
+        Returns:
+            A list of host records.
+        """
+
+        group_by_plan = endpoint.group_by_plan
+        hosts_vars_plan = endpoint.hosts_vars_plan
+        with inventory_stats.timer("extraction"):
+            return [HostRecord(host_data.get("id"), host_data.get("name"),
+                               self._get_host_groups(group_by_plan, host_data),
+                               self._get_host_vars_values(hosts_vars_plan, host_data))
+                    for host_data in hosts_list]
+
+    def update_host_meta_vars(self, inventory_dict, host_name, host_vars, specific_host=False):
         """Update host meta vars.
 
         Add host and its vars to "_meta.hostvars" path in the inventory.
+        Hosts without vars are added too, so Ansible doesn't call "--host" for every host.
+        The inventory is generated by "AnsibleInventory", this method is kept for
+        scripts which use this class.
 
         Args:
             inventory_dict: A dict for inventory has groups and hosts.
             host_name: Name of the host that will have vars.
             host_vars: A dict has selected fields to be used as host vars.
+            specific_host: String, the host of "--host" argument (if not set, "--host" argument is used).
 
         Returns:
             The dict "inventory_dict" after updating the host meta data.
         """
 
-        if host_vars and not self.host:
+        if specific_host is False:
+            specific_host = self.host
+
+        if not specific_host:
+            inventory_dict.setdefault("_meta", {"hostvars": {}})
             inventory_dict['_meta']['hostvars'].update({host_name: host_vars})
-        elif host_vars and self.host:
+        elif host_vars:
             inventory_dict.update({host_name: host_vars})
         return inventory_dict
 
-    def generate_inventory(self):
+    def _write_cache(self, entry_name, entry_data):
+        """Write cache entry, a failure in writing cache doesn't stop the script."""
+
+        try:
+            with inventory_stats.timer("cache_write"):
+                self.cache.set(entry_name, entry_data)
+        except (IOError, OSError) as cache_error:
+            sys.stderr.write("Cannot write inventory cache.\n%s\n" % cache_error)
+
+    def _refresh_cache_in_background(self):
+        """Refresh inventory cache by a detached process of this script.
+
+        So stale cached inventory could be returned right away.
+        """
+
+        if not self.cache.lock(self.cache_key):
+            return
+
+        refresh_command = [sys.executable, os.path.abspath(__file__),
+                           "--config-file", os.path.abspath(self.config_file),
+                           "--list", "--refresh-cache"]
+        import subprocess
+        with open(os.devnull, "w") as devnull:
+            subprocess.Popen(refresh_command, stdout=devnull, stderr=devnull, close_fds=True,
+                             preexec_fn=getattr(os, "setsid", None))
+
+    def iter_netbox_hosts_pages(self, endpoint, specific_host=None, fetched_hosts=None):
+        """Get hosts from netbox API page by page.
+
+        Hosts are reduced to compact records right after they are fetched.
+        Only the generated inventory is cached (hosts are not cached on their own,
+        since they are always read with the inventory), and incremental sync stores its hosts records.
+
+        Args:
+            endpoint: Inventory endpoint which hosts come from.
+            specific_host: String, get only that host.
+            fetched_hosts: A list of host records which are already fetched from netbox API (e.g. by asyncio backend).
+
+        Yields:
+            A list of host records for every page.
+        """
+
+        if fetched_hosts is not None:
+            yield fetched_hosts
+            return
+
+        # Incremental sync, all hosts are yielded after merging changed hosts.
+        if self.sync_store and not specific_host:
+            yield self._sync_hosts(endpoint)
+            return
+
+        if self.backend == "graphql":
+            records_pages = (self._make_hosts_records(endpoint, hosts_page)
+                             for hosts_page in self.iter_graphql_hosts_pages(endpoint, specific_host))
+        elif endpoint.api_params_splits and not specific_host:
+            records_pages = self._iter_split_hosts_pages(endpoint)
+        else:
+            records_pages = (self._make_hosts_records(endpoint, hosts_page) for hosts_page in self.iter_hosts_pages(
+                endpoint.api_url, self.api_token, specific_host, max_workers=self.max_workers,
+                session=self.session, timeout=self.timeout, api_params=endpoint.api_params,
+                adaptive_page_size=self.adaptive_page_size, max_page_size=self.max_page_size))
+
+        for records_page in records_pages:
+            yield records_page
+
+    def _iter_split_hosts_pages(self, endpoint):
+        """Get hosts of endpoint by many requests at the same time, one per value of split filters.
+
+        Args:
+            endpoint: Inventory endpoint which hosts come from.
+
+        Yields:
+            A list of host records for every split, hosts which are already yielded by previous splits are skipped.
+        """
+
+        from concurrent import futures
+
+        def get_split_hosts(split_params):
+            return self._make_hosts_records(endpoint, self.get_hosts_list(
+                endpoint.api_url, self.api_token, max_workers=self.max_workers,
+                session=self.session, timeout=self.timeout, api_params=split_params,
+                adaptive_page_size=self.adaptive_page_size, max_page_size=self.max_page_size))
+
+        with futures.ThreadPoolExecutor(max_workers=len(endpoint.api_params_splits)) as executor:
+            splits_futures = [executor.submit(get_split_hosts, split_params)
+                              for split_params in endpoint.api_params_splits]
+            for hosts_list in self._merge_hosts_lists(split_future.result() for split_future in splits_futures):
+                yield hosts_list
+
+    @staticmethod
+    def _merge_hosts_lists(hosts_lists):
+        """Remove hosts which are already in previous lists (e.g. a host has 2 tags of split filter).
+
+        Args:
+            hosts_lists: Iterable of host records lists.
+
+        Yields:
+            Every host records list without duplicate hosts.
+        """
+
+        hosts_ids = set()
+        for hosts_list in hosts_lists:
+            unique_hosts = [host_record for host_record in hosts_list if host_record.id not in hosts_ids]
+            hosts_ids.update(host_record.id for host_record in unique_hosts)
+            yield unique_hosts
+
+    def _update_lookup_tables(self, prefetched_objects):
+        """Index prefetched objects by ID.
+
+        Args:
+            prefetched_objects: A list of tuples of lookup table name and its objects.
+        """
+
+        for table_name, objects_list in prefetched_objects:
+            self.lookup_tables[table_name] = dict((netbox_object.get("id"), netbox_object)
+                                                  for netbox_object in objects_list)
+
+    def prefetch_lookup_tables(self):
+        """Get all related objects of "prefetch" config from netbox API once per run.
+
+        All of them are fetched at the same time, so dotted paths in "group_by" and "hosts_vars"
+        don't need API requests per host.
+        """
+
+        if not self.prefetch or self.lookup_tables:
+            return
+
+        from concurrent import futures
+
+        def get_objects(api_url):
+            return self.get_hosts_list(api_url, self.api_token, max_workers=self.max_workers,
+                                       session=self.session, timeout=self.timeout,
+                                       api_params=self.prefetch_params)
+
+        with futures.ThreadPoolExecutor(max_workers=len(self.prefetch)) as executor:
+            tables_names = list(self.prefetch)
+            objects_lists = list(executor.map(get_objects, [self.prefetch[name] for name in tables_names]))
+        self._update_lookup_tables(zip(tables_names, objects_lists))
+
+    def _fetch_endpoints_hosts_async(self, endpoints, specific_host=None):
+        """Get hosts of many endpoints from netbox API on a single event loop (asyncio backend).
+
+        Related objects of "prefetch" config are fetched on the same event loop too.
+        Hosts are reduced to compact records right after every page is decoded,
+        or after related objects are fetched if they are needed by the records.
+
+        Args:
+            endpoints: A list of inventory endpoints.
+            specific_host: String, get only that host.
+
+        Returns:
+            A list of host records lists, in the same order of endpoints.
+        """
+
+        # The asyncio backend module has Python 3.5 syntax, so it cannot be imported on older versions.
+        if sys.version_info < (3, 5):
+            sys.exit("asyncio backend needs Python 3.5 and above.")
+
+        try:
+            # The script is called directly, so its directory is in the path.
+            import netbox_async
+        except ImportError:
+            from netbox import netbox_async
+
+        tables_names = list(self.prefetch) if not self.lookup_tables else []
+
+        def make_page_hook(endpoint):
+            return lambda hosts_page: self._make_hosts_records(endpoint, hosts_page)
+
+        api_requests = []
+        pages_hooks = []
+        requests_endpoints = []
+        endpoints_requests_counts = []
+        for endpoint in endpoints:
+            if not endpoint.api_url:
+                sys.exit("Please check API URL in script configuration file.")
+            if specific_host:
+                endpoint_params = [dict(endpoint.api_params, name=specific_host)]
+            else:
+                endpoint_params = endpoint.api_params_splits or [endpoint.api_params]
+            api_requests += [(endpoint.api_url, api_url_params) for api_url_params in endpoint_params]
+            # Records need the lookup tables, so pages are reduced later if the tables are not fetched yet.
+            pages_hooks += [None if tables_names else make_page_hook(endpoint)] * len(endpoint_params)
+            requests_endpoints += [endpoint] * len(endpoint_params)
+            endpoints_requests_counts.append(len(endpoint_params))
+
+        endpoints_requests_count = len(api_requests)
+        api_requests += [(self.prefetch[table_name], self.prefetch_params) for table_name in tables_names]
+        pages_hooks += [None] * len(tables_names)
+        if not api_requests:
+            return []
+
+        hosts_lists = netbox_async.fetch_hosts_lists(api_requests, self._get_pages_params, api_token=self.api_token,
+                                                     max_workers=self.max_workers, pool_size=self.pool_size,
+                                                     timeout=self.timeout, retries=self.retries,
+                                                     backoff_factor=self.backoff_factor, json_loads=json_loads,
+                                                     stats=inventory_stats, pages_hooks=pages_hooks,
+                                                     http_cache=self.http_cache)
+        self._update_lookup_tables(zip(tables_names, hosts_lists[endpoints_requests_count:]))
+        hosts_lists = hosts_lists[:endpoints_requests_count]
+        if tables_names:
+            hosts_lists = [self._make_hosts_records(endpoint, hosts_list)
+                           for endpoint, hosts_list in zip(requests_endpoints, hosts_lists)]
+
+        # Hosts of split requests are merged, so every endpoint has one hosts list.
+        endpoints_hosts = []
+        pending_hosts_lists = iter(hosts_lists)
+        for requests_count in endpoints_requests_counts:
+            endpoint_hosts_lists = list(islice(pending_hosts_lists, requests_count))
+            if requests_count == 1:
+                endpoints_hosts.append(endpoint_hosts_lists[0])
+            else:
+                endpoints_hosts.append([host for hosts_list in self._merge_hosts_lists(endpoint_hosts_lists)
+                                        for host in hosts_list])
+        return endpoints_hosts
+
+    def _post_graphql_query(self, graphql_query, graphql_variables=None):
+        """Send a query to netbox GraphQL API.
+
+        Args:
+            graphql_query: String, GraphQL query.
+            graphql_variables: Dict, variables of the query.
+
+        Returns:
+            The "data" of GraphQL output.
+        """
+
+        api_url_headers = {}
+        if self.api_token:
+            api_url_headers.update({"Authorization": "Token %s" % self.api_token})
+
+        with inventory_stats.timer("http"):
+            api_output = self.session.post(self.graphql_url, json={"query": graphql_query,
+                                                                   "variables": graphql_variables or {}},
+                                           headers=api_url_headers, timeout=self.timeout)
+            inventory_stats.count("pages_fetched")
+            inventory_stats.count("bytes_received", len(api_output.content or b""))
+
+        # Check that a request is 200 and not something else like 404, 401, 500 ... etc.
+        api_output.raise_for_status()
+        api_output_data = json_loads(api_output.content)
+        if api_output_data.get("errors"):
+            sys.exit("GraphQL query failed.\n%s" % "\n".join(
+                error.get("message", str(error)) for error in api_output_data["errors"]))
+        return api_output_data.get("data") or {}
+
+    def _get_graphql_type_fields(self, type_name):
+        """Get fields of GraphQL type using introspection, every type is asked once.
+
+        Args:
+            type_name: String, name of GraphQL type e.g. "DeviceType".
+
+        Returns:
+            A dict of field name and a tuple of its kind (e.g. "OBJECT" or "SCALAR") and type name.
+        """
+
+        if type_name in self.graphql_types:
+            return self.graphql_types[type_name]
+
+        type_ref = "kind name ofType { kind name ofType { kind name ofType { kind name } } }"
+        type_data = self._post_graphql_query(
+            "query ($name: String!) { __type(name: $name) { fields { name type { %s } } } }" % type_ref,
+            {"name": type_name}).get("__type") or {}
+
+        type_fields = {}
+        for field in type_data.get("fields") or []:
+            # Lists and non-null types wrap the named type.
+            field_type = field["type"]
+            while field_type.get("ofType") and field_type["kind"] in ("NON_NULL", "LIST"):
+                field_type = field_type["ofType"]
+            type_fields[field["name"]] = (field_type["kind"], field_type["name"])
+        self.graphql_types[type_name] = type_fields
+        return type_fields
+
+    def _add_graphql_field(self, selection, type_name, path_keys, key_name):
+        """Add a path of fields to GraphQL selection.
+
+        Objects at the end of the path select their "key_name" field (e.g. "name" or "address").
+
+        Args:
+            selection: OrderedDict, fields and their sub-selections (None for scalar fields).
+            type_name: String, GraphQL type which has the first key of the path.
+            path_keys: List, keys of the path e.g. ["site", "region"].
+            key_name: String, the key of the value if the last field is an object.
+        """
+
+        type_fields = self._get_graphql_type_fields(type_name)
+        field_name = path_keys[0]
+        if field_name not in type_fields:
+            sys.exit("The field %s is not found in GraphQL type %s." % (field_name, type_name))
+
+        field_kind, field_type = type_fields[field_name]
+        if field_kind not in ("OBJECT", "INTERFACE"):
+            selection[field_name] = None
+            return
+
+        field_selection = selection.get(field_name) or OrderedDict()
+        selection[field_name] = field_selection
+        if len(path_keys) > 1:
+            self._add_graphql_field(field_selection, field_type, path_keys[1:], key_name)
+        elif key_name in self._get_graphql_type_fields(field_type):
+            field_selection[key_name] = None
+        else:
+            field_selection["id"] = None
+
+    @staticmethod
+    def _format_graphql_selection(selection):
+        return " ".join(field_name if field_selection is None else
+                        "%s { %s }" % (field_name, NetboxAsInventory._format_graphql_selection(field_selection))
+                        for field_name, field_selection in selection.items())
+
+    @staticmethod
+    def _format_graphql_value(value):
+        if isinstance(value, dict):
+            return "{%s}" % ", ".join("%s: %s" % (key, NetboxAsInventory._format_graphql_value(key_value))
+                                      for key, key_value in sorted(value.items()))
+        if isinstance(value, (list, tuple)):
+            return "[%s]" % ", ".join(NetboxAsInventory._format_graphql_value(list_value) for list_value in value)
+        return json.dumps(value)
+
+    def _make_graphql_query(self, endpoint, specific_host=None):
+        """Make GraphQL query which gets only the fields of "group_by" and "hosts_vars" config of the endpoint.
+
+        Related objects of dotted paths (e.g. "site.region") are nested in the same query,
+        and "filters" config is sent as GraphQL filters.
+
+        Args:
+            endpoint: Inventory endpoint which hosts come from.
+            specific_host: String, get only that host.
+
+        Returns:
+            String, GraphQL query which has "offset" and "limit" variables.
+        """
+
+        list_name = self._get_graphql_list_name(endpoint.api_url)
+        _, list_type = self._get_graphql_type_fields("Query").get(list_name, (None, None))
+        if not list_type:
+            sys.exit("The GraphQL query %s is not found." % list_name)
+
+        selection = OrderedDict([("id", None), ("name", None)])
+        for config_section, categories_sources in ((endpoint.group_by, self.group_by_sources),
+                                                   (endpoint.hosts_vars, self.hosts_vars_sources)):
+            for category in config_section:
+                source_key = categories_sources[category]
+                if source_key:
+                    self._add_graphql_field(selection, list_type, [source_key], None)
+                    continue
+
+                category_paths = config_section[category] or []
+                if isinstance(category_paths, dict):
+                    category_paths = category_paths.values()
+                for path in category_paths:
+                    self._add_graphql_field(selection, list_type, path.split("."), self.key_map[category])
+
+        filters = dict(endpoint.filters)
+        if specific_host:
+            filters.update({"name": specific_host})
+        list_arguments = "pagination: {offset: $offset, limit: $limit}"
+        if filters:
+            list_arguments += ", filters: %s" % self._format_graphql_value(filters)
+
+        return "query ($offset: Int!, $limit: Int!) { %s(%s) { %s } }" % (
+            list_name, list_arguments, self._format_graphql_selection(selection))
+
+    def iter_graphql_hosts_pages(self, endpoint, specific_host=None):
+        """Get hosts from netbox GraphQL API page by page.
+
+        GraphQL lists have no count, so "max_workers" pages are fetched at the same time
+        until a page has less hosts than the page size.
+
+        Args:
+            endpoint: Inventory endpoint which hosts come from.
+            specific_host: String, get only that host.
+
+        Yields:
+            A list of hosts for every page.
+        """
+
+        if not endpoint.api_url:
+            sys.exit("Please check API URL in script configuration file.")
+
+        from concurrent import futures
+
+        graphql_query = self._make_graphql_query(endpoint, specific_host)
+        list_name = self._get_graphql_list_name(endpoint.api_url)
+        page_limit = min(self.page_size or self.max_page_size, self.max_page_size)
+
+        def get_page(page_offset):
+            hosts_page = self._post_graphql_query(graphql_query, {"offset": page_offset, "limit": page_limit}).get(
+                list_name) or []
+            # GraphQL "ID" type is a string, but REST API and webhooks use integer IDs.
+            for host_data in hosts_page:
+                host_id = host_data.get("id")
+                if isinstance(host_id, (type(""), type(u""))) and host_id.isdigit():
+                    host_data["id"] = int(host_id)
+            return hosts_page
+
+        page_offset = 0
+        with futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                pages_offsets = [page_offset + page_limit * page_index for page_index in range(self.max_workers)]
+                for hosts_page in executor.map(get_page, pages_offsets):
+                    yield hosts_page
+                    if len(hosts_page) < page_limit:
+                        return
+                page_offset += page_limit * self.max_workers
+
+    def _get_deleted_hosts_ids(self, endpoint, since):
+        """Get IDs of hosts which are deleted since specific time from netbox changelog.
+
+        Args:
+            endpoint: Inventory endpoint which hosts come from.
+            since: String, ISO 8601 time.
+
+        Returns:
+            A set of hosts IDs (as strings).
+        """
+
+        changelog_params = {
+            "action": "delete",
+            "changed_object_type": endpoint.object_type,
+            "time_after": since
+        }
+        changelog = self.get_hosts_list(self.sync_changelog_url, self.api_token,
+                                        session=self.session, timeout=self.timeout,
+                                        api_params=changelog_params)
+        return set(str(change.get("changed_object_id")) for change in changelog)
+
+    def _sync_hosts(self, endpoint):
+        """Sync hosts incrementally.
+
+        The first run gets all hosts (baseline) and stores them, next runs get only
+        the hosts which are updated since last sync (using "last_updated" filter)
+        and the deleted ones from netbox changelog, then merge them with stored hosts.
+        A new baseline is made when it's older than "full_sync_interval".
+
+        Args:
+            endpoint: Inventory endpoint which hosts come from.
+
+        Only compact host records are stored, not the whole hosts data.
+
+        Returns:
+            A list of all host records.
+        """
+
+        state_entry = "sync-%s" % InventoryCache.make_key(self.cache_key, endpoint.api_url)
+        sync_state, _ = self.sync_store.get(state_entry)
+
+        # Netbox and local clocks could be different a bit, so sync time goes back few seconds.
+        sync_started = time.time()
+        sync_since = time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(sync_started - self.sync_overlap))
+
+        baseline_age = sync_started - (sync_state or {}).get("baseline_time", 0)
+        if not sync_state or self.refresh_cache or baseline_age >= self.sync_store.cache_ttl:
+            hosts_list = self.get_hosts_list(endpoint.api_url, self.api_token,
+                                             max_workers=self.max_workers,
+                                             session=self.session, timeout=self.timeout,
+                                             api_params=endpoint.api_params,
+                                             adaptive_page_size=self.adaptive_page_size,
+                                             max_page_size=self.max_page_size)
+            hosts_records = self._make_hosts_records(endpoint, hosts_list)
+            sync_state = {"baseline_time": sync_started}
+        else:
+            changed_params = dict(endpoint.api_params)
+            changed_params.update({"last_updated__gte": sync_state["since"]})
+            changed_hosts = self.get_hosts_list(endpoint.api_url, self.api_token,
+                                                max_workers=self.max_workers,
+                                                session=self.session, timeout=self.timeout,
+                                                api_params=changed_params)
+            deleted_hosts_ids = self._get_deleted_hosts_ids(endpoint, sync_state["since"])
+
+            # Hosts which are changed and don't match the filters anymore (e.g. status changed to offline)
+            # are removed too, so changed hosts are fetched again without the filters.
+            if endpoint.filters:
+                unfiltered_params = dict((param_name, param_value)
+                                         for param_name, param_value in changed_params.items()
+                                         if param_name not in endpoint.filters)
+                changed_hosts_ids = set(str(host_data.get("id")) for host_data in changed_hosts)
+                deleted_hosts_ids.update(
+                    str(host_data.get("id")) for host_data in self.get_hosts_list(
+                        endpoint.api_url, self.api_token, max_workers=self.max_workers,
+                        session=self.session, timeout=self.timeout, api_params=unfiltered_params)
+                    if str(host_data.get("id")) not in changed_hosts_ids)
+
+            # Updated hosts keep their order, and new hosts are added at the end.
+            hosts_by_id = OrderedDict((str(record_data[0]), HostRecord.from_list(record_data))
+                                      for record_data in sync_state["hosts"])
+            for changed_record in self._make_hosts_records(endpoint, changed_hosts):
+                hosts_by_id[str(changed_record.id)] = changed_record
+            for deleted_host_id in deleted_hosts_ids:
+                hosts_by_id.pop(deleted_host_id, None)
+            hosts_records = list(hosts_by_id.values())
+
+        sync_state["hosts"] = [host_record.to_list() for host_record in hosts_records]
+        sync_state["since"] = sync_since
+        try:
+            self.sync_store.set(state_entry, sync_state)
+        except (IOError, OSError) as sync_error:
+            sys.stderr.write("Cannot write incremental sync state.\n%s\n" % sync_error)
+        return hosts_records
+
+    def _get_event_endpoint(self, model_name):
+        """Get the endpoint of netbox model of a webhook event e.g. "device" or "virtualmachine".
+
+        Returns:
+            Inventory endpoint, or None if hosts don't come from that model.
+        """
+
+        for endpoint in self.endpoints:
+            if endpoint.object_type and endpoint.object_type.split(".")[-1] == model_name:
+                return endpoint
+        return None
+
+    def _is_endpoint_host(self, endpoint, host_id):
+        """Check if a host matches the filters of its endpoint.
+
+        Filters are checked by netbox API (a request of that host only), so they match like a full fetch.
+        """
+
+        if not endpoint.filters:
+            return True
+
+        host_params = self._get_filters_params(endpoint.filters)
+        host_params.update({"id": host_id})
+        return bool(self.get_hosts_list(endpoint.api_url, self.api_token, session=self.session,
+                                        timeout=self.timeout, api_params=host_params))
+
+    def apply_webhook_event(self, ansible_inventory, event_data, hosts_names):
+        """Apply a host change of netbox webhook to the full inventory without fetching all hosts again.
+
+        The host is moved from its old groups to its new groups, and only the groups and vars
+        of that host are found again. It's removed if it's deleted or it doesn't match
+        the endpoint filters anymore.
+
+        Args:
+            ansible_inventory: Ansible inventory of all hosts which will be updated.
+            event_data: Dict, webhook payload e.g. {"event": "updated", "model": "device", "data": {...}}.
+            hosts_names: Dict, host names by endpoint object type and netbox ID, it's updated too.
+
+        Returns:
+            True if the event is a change of a host and it's applied, otherwise False.
+        """
+
+        endpoint = self._get_event_endpoint(event_data.get("model"))
+        host_data = event_data.get("data") or {}
+        if not endpoint or host_data.get("id") is None:
+            return False
+
+        host_key = (endpoint.object_type, host_data["id"])
+        old_host_name = hosts_names.pop(host_key, None)
+        if event_data.get("event") == "deleted" or not self._is_endpoint_host(endpoint, host_data["id"]):
+            if old_host_name:
+                ansible_inventory.remove_host(old_host_name)
+            return True
+
+        # Dotted paths use the related objects which are prefetched by last full run.
+        host_record = self._make_hosts_records(endpoint, [host_data])[0]
+        # The old name is removed, so a renamed host doesn't stay in the inventory.
+        if old_host_name and old_host_name != host_record.name:
+            ansible_inventory.remove_host(old_host_name)
+        if not host_record.name:
+            return True
+
+        host_vars = dict((var_name, var_value)
+                         for var_name, var_value in zip(endpoint.hosts_vars_names, host_record.vars)
+                         if var_value is not None)
+        ansible_inventory.move_host(host_record.name, host_record.groups, host_vars)
+        hosts_names[host_key] = host_record.name
+        return True
+
+    def write_inventory_cache(self, inventory_dict):
+        """Write the full inventory and its hosts vars index to cache (if cache is enabled)."""
+
+        if not self.cache:
+            return
+        self._write_cache(self.cache_key, inventory_dict)
+        self._write_cache("hostvars-%s" % self.cache_key, inventory_dict["_meta"]["hostvars"])
+
+    def get_inventory(self):
+        """Get Ansible dynamic inventory from cache if it's fresh, otherwise generate it.
+
+        With cache, "--host" is answered from hosts vars index of the full inventory.
+        If the index is not found, the full inventory is generated once and cached,
+        so next "--host" calls don't hit netbox API.
+        If "stale_while_revalidate" is enabled, stale cached inventory is returned
+        and it will be refreshed in the background.
+
+        Returns:
+            A dict has inventory with hosts and their vars.
+        """
+
+        if not self.cache:
+            return self.generate_inventory()
+
+        hosts_vars_entry = "hostvars-%s" % self.cache_key
+        if not self.refresh_cache:
+            with inventory_stats.timer("cache_read"):
+                cached_data, is_fresh = self.cache.get(hosts_vars_entry if self.host else self.cache_key)
+            if cached_data is not None and (is_fresh or self.cache_stale_while_revalidate):
+                if not is_fresh:
+                    self._refresh_cache_in_background()
+
+                if self.host:
+                    return {self.host: cached_data.get(self.host, {})}
+                return cached_data
+
+        inventory_dict = self.generate_inventory(full_inventory=True)
+        hosts_vars = inventory_dict["_meta"]["hostvars"]
+        self.write_inventory_cache(inventory_dict)
+        self.cache.unlock(self.cache_key)
+
+        if self.host:
+            return {self.host: hosts_vars.get(self.host, {})}
+        return inventory_dict
+
+    def print_cached_inventory(self, output_file=None):
+        """Print cached inventory as it is without decoding it (fast path of "--list").
+
+        Args:
+            output_file: File object which inventory is written to (stdout by default).
+
+        Returns:
+            True if the inventory is printed from cache, otherwise False.
+        """
+
+        if not self.cache or self.refresh_cache or self.host or not self.list:
+            return False
+
+        entry_path, is_fresh = self.cache.get_path(self.cache_key)
+        if not entry_path or not (is_fresh or self.cache_stale_while_revalidate):
+            return False
+
+        output_file = output_file or sys.stdout
+        try:
+            with open(entry_path, "r") as entry_file:
+                for entry_chunk in iter(lambda: entry_file.read(65536), ""):
+                    output_file.write(entry_chunk)
+        except (IOError, OSError):
+            return False
+        output_file.write("\n")
+
+        if not is_fresh:
+            self._refresh_cache_in_background()
+        return True
+
+    def _get_export_path(self, export_path=None):
+        export_path = export_path or self.export_path
+        if not export_path:
+            sys.exit("Please set export path in script configuration file or command line.")
+        return os.path.expanduser(export_path)
+
+    @staticmethod
+    def _write_export_file(export_path, inventory_dict, compress=False):
+        """Write inventory to a static JSON file.
+
+        The file is written to a temporary file then renamed, so readers never see a partially written file.
+
+        Args:
+            export_path: String, path of the exported file.
+            inventory_dict: Inventory dict has groups and hosts.
+            compress: Bool, also write a gzip copy of the file (with ".gz" suffix).
+        """
+
+        import tempfile
+        export_dir = os.path.dirname(os.path.abspath(export_path))
+        if not os.path.isdir(export_dir):
+            os.makedirs(export_dir)
+
+        def write_atomic(file_path, write_content, file_mode):
+            file_fd, file_tmp_path = tempfile.mkstemp(dir=export_dir, suffix=".tmp")
+            try:
+                with os.fdopen(file_fd, file_mode) as file_obj:
+                    write_content(file_obj)
+                os.chmod(file_tmp_path, 0o644)
+                os.rename(file_tmp_path, file_path)
+            except (IOError, OSError):
+                if os.path.exists(file_tmp_path):
+                    os.remove(file_tmp_path)
+                raise
+
+        def write_inventory(export_file):
+            write_json(inventory_dict, export_file)
+            export_file.write("\n")
+
+        def write_gzip_copy(export_gzip_file):
+            import gzip
+            import shutil
+            with open(export_path, "rb") as export_file:
+                with gzip.GzipFile(fileobj=export_gzip_file, mode="wb") as gzip_file:
+                    shutil.copyfileobj(export_file, gzip_file)
+
+        write_atomic(export_path, write_inventory, "w")
+        if compress:
+            write_atomic("%s.gz" % export_path, write_gzip_copy, "wb")
+
+    def export_inventory(self, export_path=None):
+        """Generate inventory from netbox API and write it to a static JSON file.
+
+        It could run by cron or systemd timer, so Ansible reads the inventory by "--serve-file"
+        without waiting for netbox API.
+
+        Args:
+            export_path: String, path of the exported file ("export.path" config by default).
+
+        Returns:
+            The path of the exported file.
+        """
+
+        export_path = self._get_export_path(export_path)
+        inventory_dict = self.generate_inventory(full_inventory=True)
+        try:
+            with inventory_stats.timer("export"):
+                self._write_export_file(export_path, inventory_dict, compress=self.export_gzip)
+        except (IOError, OSError) as export_error:
+            sys.exit("Cannot write exported inventory.\n%s" % export_error)
+        return export_path
+
+    def serve_export_file(self, export_path=None, output_file=None):
+        """Print exported inventory file if it's fresh (fast path of "--serve-file").
+
+        For "--list", the file is copied to output as it is (using "sendfile" if it's possible).
+        For "--host", host vars are read from "_meta.hostvars" of the file.
+
+        Args:
+            export_path: String, path of the exported file ("export.path" config by default).
+            output_file: File object which inventory is written to (stdout by default).
+
+        Returns:
+            True if the inventory is printed from the exported file, otherwise False.
+        """
+
+        export_path = self._get_export_path(export_path)
+        output_file = output_file or sys.stdout
+        try:
+            export_age = time.time() - os.path.getmtime(export_path)
+        except OSError:
+            return False
+        if self.export_max_age and export_age >= self.export_max_age:
+            return False
+
+        try:
+            if self.host:
+                with open(export_path, "r") as export_file:
+                    host_vars = json_loads(export_file.read()).get("_meta", {}).get("hostvars", {})
+                write_json(host_vars.get(self.host, {}), output_file)
+                output_file.write("\n")
+            elif self.list:
+                self._copy_file_to_output(export_path, output_file)
+            else:
+                return False
+        except (IOError, OSError, ValueError):
+            return False
+        return True
+
+    @staticmethod
+    def _copy_file_to_output(file_path, output_file):
+        """Copy a file to output file, using "sendfile" system call if it's available."""
+
+        import codecs
+
+        with open(file_path, "rb") as source_file:
+            sent_bytes = 0
+            try:
+                output_fd = output_file.fileno()
+                output_file.flush()
+                file_size = os.fstat(source_file.fileno()).st_size
+                while sent_bytes < file_size:
+                    sent_bytes += os.sendfile(output_fd, source_file.fileno(), sent_bytes, file_size - sent_bytes)
+                return
+            except (AttributeError, ValueError, OSError, io.UnsupportedOperation):
+                # No "sendfile" (e.g. Python 2) or output is not a real file (e.g. captured output).
+                # If some bytes are already sent, the rest of the file is written.
+                source_file.seek(sent_bytes)
+
+            # Chunks could split multi-byte characters, so they are decoded incrementally.
+            utf8_decoder = codecs.getincrementaldecoder("utf-8")()
+            for file_chunk in iter(lambda: source_file.read(65536), b""):
+                output_file.write(utf8_decoder.decode(file_chunk))
+            output_file.write(utf8_decoder.decode(b"", final=True))
+
+    def _iter_endpoints_hosts_pages(self, specific_host=None):
+        """Get hosts of all endpoints at the same time.
+
+        The hosts of first endpoint are yielded page by page while they are still being fetched,
+        and other endpoints are fetched in the background. Endpoints are yielded
+        in the config order, so the inventory is the same every time.
+
+        Args:
+            specific_host: String, get only that host.
+
+        Yields:
+            A tuple of endpoint and its hosts pages.
+        """
+
+        if self.backend == "asyncio":
+            for endpoint_hosts in self._iter_endpoints_hosts_async(specific_host):
+                yield endpoint_hosts
+            return
+
+        def get_endpoint_hosts_pages(endpoint):
+            return list(self.iter_netbox_hosts_pages(endpoint, specific_host))
+
+        first_endpoint, other_endpoints = self.endpoints[0], self.endpoints[1:]
+        if not other_endpoints:
+            yield first_endpoint, self.iter_netbox_hosts_pages(first_endpoint, specific_host)
+            return
+
+        from concurrent import futures
+
+        with futures.ThreadPoolExecutor(max_workers=len(other_endpoints)) as executor:
+            endpoints_futures = [executor.submit(get_endpoint_hosts_pages, endpoint) for endpoint in other_endpoints]
+            yield first_endpoint, self.iter_netbox_hosts_pages(first_endpoint, specific_host)
+            for endpoint, endpoint_future in zip(other_endpoints, endpoints_futures):
+                yield endpoint, endpoint_future.result()
+
+    def _iter_endpoints_hosts_async(self, specific_host=None):
+        """Get hosts of all endpoints using asyncio backend.
+
+        All endpoints are fetched together on a single event loop.
+        Incremental sync still uses the blocking backend.
+
+        Args:
+            specific_host: String, get only that host.
+
+        Yields:
+            A tuple of endpoint and its hosts pages.
+        """
+
+        is_synced = bool(self.sync_store and not specific_host)
+        api_endpoints = [] if is_synced else self.endpoints
+
+        # Prefetched related objects are fetched even if all endpoints are synced.
+        fetched_hosts = iter(self._fetch_endpoints_hosts_async(api_endpoints, specific_host))
+
+        for endpoint in self.endpoints:
+            if is_synced:
+                yield endpoint, self.iter_netbox_hosts_pages(endpoint, specific_host)
+            else:
+                yield endpoint, self.iter_netbox_hosts_pages(endpoint, specific_host,
+                                                             fetched_hosts=next(fetched_hosts))
+
+    def generate_ansible_inventory(self, full_inventory=False, hosts_names=None):
+        """Generate Ansible inventory which hosts could be moved or removed later (e.g. by webhook events).
+
+        Hosts of all endpoints are merged in one inventory.
+
+        Args:
+            full_inventory: Bool, generate inventory of all hosts even if "--host" is used.
+            hosts_names: Dict, host names are added to it by endpoint object type and netbox ID
+                (e.g. to apply webhook events later).
+
+        Returns:
+            Ansible inventory with hosts and their vars.
+        """
+
+        specific_host = None if full_inventory else self.host
+        ansible_inventory = AnsibleInventory()
+        hosts_vars = ansible_inventory.hosts_vars
+
+        # Clock is 0 if stats are disabled.
+        clock = inventory_stats.clock
+
+        # Related objects are fetched before hosts (asyncio backend fetches them with hosts,
+        # and GraphQL backend gets them nested in hosts).
+        if self.backend == "requests":
+            self.prefetch_lookup_tables()
+
+        for endpoint, hosts_pages in self._iter_endpoints_hosts_pages(specific_host):
+            hosts_vars_names = endpoint.hosts_vars_names
+            object_type = endpoint.object_type
+
+            # Hosts are processed while next pages are still being fetched.
+            for hosts_page in hosts_pages:
+                grouping_time = hosts_vars_time = 0
+                for host_record in hosts_page:
+                    host_started = clock()
+                    server_name = host_record.name
+                    ansible_inventory.add_host(server_name, host_record.groups)
+                    host_grouped = clock()
+                    hosts_vars[server_name] = dict((var_name, var_value)
+                                                   for var_name, var_value in zip(hosts_vars_names, host_record.vars)
+                                                   if var_value is not None)
+                    if hosts_names is not None:
+                        hosts_names[(object_type, host_record.id)] = server_name
+                    grouping_time += host_grouped - host_started
+                    hosts_vars_time += clock() - host_grouped
+                inventory_stats.add_time("grouping", grouping_time)
+                inventory_stats.add_time("hosts_vars", hosts_vars_time)
+                inventory_stats.count("hosts_processed", len(hosts_page))
+
+        inventory_stats.count("groups_created", len(ansible_inventory.groups))
+        return ansible_inventory
+
+    def generate_inventory(self, full_inventory=False, hosts_names=None):
         """Generate Ansible dynamic inventory.
 
+        Args:
+            full_inventory: Bool, generate inventory of all hosts even if "--host" is used.
+            hosts_names: Dict, host names are added to it by endpoint object type and netbox ID.
+
         Returns:
             A dict has inventory with hosts and their vars.
         """
 
-        inventory_dict = dict()
-        netbox_hosts_list = self.get_hosts_list(self.api_url, self.api_token, self.host)
+        specific_host = None if full_inventory else self.host
+        inventory_dict = self.generate_ansible_inventory(full_inventory, hosts_names).to_dict()
 
-        if netbox_hosts_list:
-            inventory_dict.update({"_meta": {"hostvars": {}}})
-            for current_host in netbox_hosts_list:
-                server_name = current_host.get("name")
-                self.add_host_to_inventory(self.group_by, inventory_dict, current_host)
-                host_vars = self.get_host_vars(current_host, self.hosts_vars)
-                inventory_dict = self.update_host_meta_vars(inventory_dict, server_name, host_vars)
+        # With "--host", vars of the host are in the top level of the inventory.
+        if specific_host:
+            hosts_vars = inventory_dict["_meta"]["hostvars"]
+            inventory_dict["_meta"]["hostvars"] = {}
+            inventory_dict.update((host_name, host_vars) for host_name, host_vars in hosts_vars.items() if host_vars)
         return inventory_dict
 
     def print_inventory_json(self, inventory_dict):
@@ -376,19 +2689,381 @@ class NetboxAsInventory(object):
             result = inventory_dict
         else:
             result = {}
-        print(json.dumps(result))
+        write_json(result, sys.stdout)
+        sys.stdout.write("\n")
+
+
+class InventoryDaemon(object):
+    """Long-running inventory server which answers on a Unix socket.
+
+    The inventory is generated once and kept in memory (the "--list" output is kept
+    already encoded), then it's refreshed every "refresh_interval" seconds,
+    or right away when a "refresh" request comes. Every connection has one request line:
+    "list", "host <name>", or "refresh", and the answer is JSON.
+
+    If webhook address is set, it also listens for netbox webhooks, and every host change
+    is applied to the inventory in memory without fetching all hosts again. The "--list" output
+    is encoded again on the next "list" request, and the cache is written once for all changes
+    of "cache_write_delay" seconds.
+
+    Attributes:
+        netbox_inventory: Netbox inventory which generates the inventory.
+        socket_path: String, path of the Unix socket.
+        refresh_interval: Seconds between inventory refreshes.
+        webhook_address: A tuple of host and port of the webhook listener (None means no listener).
+        webhook_secret: String, secret of netbox webhooks which their signature is checked by.
+        cache_write_delay: Seconds to wait after a webhook change before the cache is written.
+    """
+
+    def __init__(self, netbox_inventory, socket_path, refresh_interval, webhook_address=None, webhook_secret=None,
+                 cache_write_delay=10):
+        self.netbox_inventory = netbox_inventory
+        self.socket_path = socket_path
+        self.refresh_interval = refresh_interval
+        self.webhook_address = webhook_address
+        self.webhook_secret = webhook_secret
+        self.cache_write_delay = cache_write_delay
+        self.ansible_inventory = None
+        # Encoded "--list" output, None means the inventory is changed since it's encoded.
+        self.inventory_json = None
+        self.hosts_names = {}
+        self.inventory_lock = threading.Lock()
+        self.refresh_requested = threading.Event()
+        self.cache_write_requested = threading.Event()
+        self.servers = []
+
+    def refresh(self):
+        """Generate the inventory and replace the one in memory."""
+
+        # Webhook events wait for the refresh, so they are applied to the new inventory.
+        with self.inventory_lock:
+            # Related objects are fetched again too.
+            self.netbox_inventory.lookup_tables.clear()
+            hosts_names = dict()
+            ansible_inventory = self.netbox_inventory.generate_ansible_inventory(full_inventory=True,
+                                                                                 hosts_names=hosts_names)
+            # Cached inventory is not read by refreshes, and "--refresh-cache" makes only the first one
+            # a full sync, so next refreshes get only changed hosts (if incremental sync is enabled).
+            self.netbox_inventory.refresh_cache = False
+            self.ansible_inventory, self.hosts_names = ansible_inventory, hosts_names
+            self.inventory_json = None
+            # Cached inventory is updated too, so "--list" without the daemon gets it.
+            self.cache_write_requested.clear()
+            self.netbox_inventory.write_inventory_cache(ansible_inventory.to_dict())
+
+    def get_inventory_json(self):
+        """Get "--list" output, it's encoded only once after every change of the inventory.
+
+        Returns:
+            Bytes, JSON of the full inventory.
+        """
+
+        with self.inventory_lock:
+            if self.inventory_json is None:
+                inventory_dict = self.ansible_inventory.to_dict()
+                self.inventory_json = ("%s\n" % "".join(iter_json_chunks(inventory_dict))).encode("utf-8")
+            return self.inventory_json
+
+    def write_cache(self):
+        """Write the inventory in memory to cache if it's changed by webhooks since last write."""
+
+        if not self.cache_write_requested.is_set():
+            return
+        # Changes which come while it's written are written next time.
+        self.cache_write_requested.clear()
+        with self.inventory_lock:
+            self.netbox_inventory.write_inventory_cache(self.ansible_inventory.to_dict())
+
+    def _write_cache_periodically(self):
+        while True:
+            self.cache_write_requested.wait()
+            # Many webhook events (e.g. bulk edit in netbox) are written to cache once.
+            time.sleep(self.cache_write_delay)
+            try:
+                self.write_cache()
+            except (Exception, SystemExit) as cache_error:
+                sys.stderr.write("Cannot write inventory cache.\n%s\n" % cache_error)
+
+    def apply_webhook_event(self, event_data):
+        """Apply a netbox webhook event to the inventory in memory.
+
+        Only the groups of the changed host are updated (by the hosts and groups index of the inventory),
+        the inventory is encoded on the next "list" request, and the cache is written later.
+
+        Args:
+            event_data: Dict, webhook payload.
+
+        Returns:
+            True if the event is a change of a host and it's applied, otherwise False.
+        """
+
+        with self.inventory_lock:
+            is_applied = self.netbox_inventory.apply_webhook_event(self.ansible_inventory, event_data,
+                                                                   self.hosts_names)
+            if is_applied:
+                self.inventory_json = None
+        if is_applied and self.netbox_inventory.cache:
+            self.cache_write_requested.set()
+        return is_applied
+
+    def is_webhook_signed(self, request_body, signature):
+        """Check the signature of a webhook (HMAC-SHA512 of the body like netbox "X-Hook-Signature").
+
+        Returns:
+            True if the signature is valid or no secret is set.
+        """
+
+        if not self.webhook_secret:
+            return True
+
+        import hmac
+        import hashlib
+        expected_signature = hmac.new(self.webhook_secret.encode("utf-8"), request_body, hashlib.sha512).hexdigest()
+        return hmac.compare_digest(expected_signature, signature or "")
+
+    def _refresh_periodically(self):
+        while True:
+            self.refresh_requested.wait(self.refresh_interval)
+            self.refresh_requested.clear()
+            try:
+                self.refresh()
+            except (Exception, SystemExit) as refresh_error:
+                # The daemon keeps answering with the last inventory.
+                sys.stderr.write("Cannot refresh inventory.\n%s\n" % refresh_error)
+
+    def answer(self, request_line):
+        """Answer a request of the socket.
+
+        Args:
+            request_line: String, "list", "host <name>", or "refresh".
+
+        Returns:
+            Bytes, JSON answer.
+        """
+
+        request_name, _, request_arg = request_line.strip().partition(" ")
+        if request_name == "list":
+            return self.get_inventory_json()
+        if request_name == "host":
+            with self.inventory_lock:
+                host_json = json_dumps(self.ansible_inventory.hosts_vars.get(request_arg, {}))
+            return (host_json + "\n").encode("utf-8")
+        if request_name == "refresh":
+            self.refresh_requested.set()
+            return b"{}\n"
+        return (json_dumps({"error": "Unknown request %s." % request_name}) + "\n").encode("utf-8")
+
+    def _make_webhook_server(self):
+        try:
+            from socketserver import ThreadingMixIn
+            from http.server import BaseHTTPRequestHandler, HTTPServer
+        except ImportError:
+            from SocketServer import ThreadingMixIn  # Python 2.
+            from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+        daemon = self
+
+        class WebhookRequestHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                request_body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if not daemon.is_webhook_signed(request_body, self.headers.get("X-Hook-Signature")):
+                    self.send_error(403, "Invalid signature.")
+                    return
+
+                try:
+                    event_data = json_loads(request_body)
+                except ValueError:
+                    event_data = None
+                if not isinstance(event_data, dict):
+                    self.send_error(400, "Invalid webhook payload.")
+                    return
+
+                try:
+                    daemon.apply_webhook_event(event_data)
+                except (Exception, SystemExit) as event_error:
+                    # A full refresh gets the change later.
+                    sys.stderr.write("Cannot apply webhook event.\n%s\n" % event_error)
+                    self.send_error(500)
+                    return
+                self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        class WebhookServer(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        return WebhookServer(self.webhook_address, WebhookRequestHandler)
+
+    def start(self):
+        """Generate the inventory and start listening on the Unix socket (in a background thread)."""
+
+        import socket
+        try:
+            import socketserver
+        except ImportError:
+            import SocketServer as socketserver  # Python 2.
+
+        if not hasattr(socket, "AF_UNIX"):
+            sys.exit("Unix sockets are not supported on this platform.")
+
+        self.refresh()
+        daemon = self
+
+        class InventoryRequestHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                request_line = self.rfile.readline().decode("utf-8")
+                self.wfile.write(daemon.answer(request_line))
+
+        class InventoryServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+
+        socket_dir = os.path.dirname(self.socket_path)
+        if socket_dir and not os.path.isdir(socket_dir):
+            os.makedirs(socket_dir)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self.servers.append(InventoryServer(self.socket_path, InventoryRequestHandler))
+        # The inventory could have secrets, so only the same user could connect.
+        os.chmod(self.socket_path, 0o600)
+
+        if self.webhook_address:
+            self.servers.append(self._make_webhook_server())
+
+        threads_targets = [server.serve_forever for server in self.servers] + [self._refresh_periodically,
+                                                                               self._write_cache_periodically]
+        for thread_target in threads_targets:
+            daemon_thread = threading.Thread(target=thread_target)
+            daemon_thread.daemon = True
+            daemon_thread.start()
+        return self
+
+    def stop(self):
+        """Stop listening, remove the Unix socket, and write webhook changes which are not in cache yet."""
+
+        while self.servers:
+            server = self.servers.pop()
+            server.shutdown()
+            server.server_close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self.write_cache()
+
+    def serve_forever(self):
+        """Run the daemon until it's interrupted or terminated."""
+
+        import signal
+        signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+
+        self.start()
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+
+def get_daemon_inventory(socket_path, request_line, output_file=None, timeout=60):
+    """Get inventory from the daemon and write it as it is (thin client of "--client").
+
+    Args:
+        socket_path: String, path of the daemon Unix socket.
+        request_line: String, "list" or "host <name>".
+        output_file: File object which the answer is written to (stdout by default).
+        timeout: Seconds to wait for the daemon.
+
+    Returns:
+        True if the daemon answered, otherwise False (e.g. it's not running).
+    """
+
+    import socket
+    if not hasattr(socket, "AF_UNIX"):
+        return False
+
+    output_file = output_file or sys.stdout
+    daemon_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    daemon_socket.settimeout(timeout)
+    try:
+        daemon_socket.connect(socket_path)
+        daemon_socket.sendall(("%s\n" % request_line).encode("utf-8"))
+        answer_chunks = []
+        for answer_chunk in iter(lambda: daemon_socket.recv(65536), b""):
+            answer_chunks.append(answer_chunk)
+    except (IOError, OSError):
+        return False
+    finally:
+        daemon_socket.close()
+    if not answer_chunks:
+        return False
+
+    output_file.write(b"".join(answer_chunks).decode("utf-8"))
+    return True
 
 
 # Main.
-def main():
-    # Script vars.
-    args = cli_arguments()
+def run(args):
+    started = time.time()
     config_data = open_yaml_file(args.config_file)
 
     # Netbox vars.
     netbox = NetboxAsInventory(args, config_data)
-    ansible_inventory = netbox.generate_inventory()
-    netbox.print_inventory_json(ansible_inventory)
+    if getattr(args, "daemon", False):
+        webhook_address = None
+        if netbox.daemon_webhook_port:
+            webhook_address = (netbox.daemon_webhook_listen, int(netbox.daemon_webhook_port))
+        InventoryDaemon(netbox, netbox.daemon_socket, netbox.daemon_refresh_interval,
+                        webhook_address=webhook_address, webhook_secret=netbox.daemon_webhook_secret,
+                        cache_write_delay=netbox.daemon_cache_write_delay).serve_forever()
+        return
+
+    # The daemon answer is printed as it is, otherwise the inventory is generated as usual.
+    if netbox.daemon_client and (netbox.list or netbox.host):
+        request_line = "host %s" % netbox.host if netbox.host else "list"
+        if get_daemon_inventory(netbox.daemon_socket, request_line):
+            return
+
+    export_file = getattr(args, "export", None)
+    serve_file = getattr(args, "serve_file", None)
+    if serve_file is None and netbox.export_serve:
+        serve_file = ""
+    if export_file is not None:
+        netbox.export_inventory(export_file)
+        is_printed = True
+    else:
+        with inventory_stats.timer("output"):
+            is_printed = serve_file is not None and netbox.serve_export_file(serve_file)
+            is_printed = is_printed or netbox.print_cached_inventory()
+    if not is_printed:
+        ansible_inventory = netbox.get_inventory()
+        with inventory_stats.timer("output"):
+            netbox.print_inventory_json(ansible_inventory)
+
+    # Stats are written to stderr or a file, so stdout has the inventory only.
+    if args.stats:
+        inventory_stats.add_time("total", time.time() - started)
+        inventory_stats.write(args.stats)
+
+
+def main():
+    # Script vars.
+    args = cli_arguments()
+
+    if not args.profile:
+        run(args)
+        return
+
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        run(args)
+    finally:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
 
 
 # Run main.
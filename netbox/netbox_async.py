@@ -0,0 +1,182 @@
+# Copyright: (c) 2017, Ahmed AbouZaid <http://aabouzaid.com/>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""Asyncio HTTP backend for Netbox dynamic inventory script.
+
+All API requests (all pages of all endpoints) run on a single event loop.
+It needs Python 3.5 and above with "aiohttp" package.
+"""
+
+import sys
+import json
+import asyncio
+
+try:
+    from urllib.parse import urlencode
+except ImportError:
+    from urllib import urlencode
+
+try:
+    import aiohttp
+except ImportError:
+    sys.exit('aiohttp package is required for asyncio backend.')
+
+# Retry on rate limiting and server errors, the same as the blocking backend.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def fetch_hosts_lists(api_requests, get_pages_params, api_token=None, max_workers=1, pool_size=10,
+                      timeout=None, retries=3, backoff_factor=0.5, json_loads=json.loads, stats=None,
+                      pages_hooks=None, http_cache=None):
+    """Retrieves hosts of many API URLs from netbox API at the same time.
+
+    Args:
+        api_requests: A list of tuples of API URL and its query parameters.
+        get_pages_params: A function takes the params and the output of the first page,
+            and returns the params of all remaining pages (or None if they cannot be calculated).
+        api_token: String, netbox API token.
+        max_workers: Int, max number of pages fetched at the same time for every API URL
+            (every API URL has its own limit).
+        pool_size: Int, max number of connections per host.
+        timeout: Float, seconds to wait for every API request.
+        retries: Int, number of retries when the API is down or rate limited (429/5xx).
+        backoff_factor: Float, factor of the exponential sleep between retries.
+        json_loads: A function decodes the bytes of JSON output.
+        stats: Inventory stats which HTTP timing and counters are added to.
+        pages_hooks: A list of functions (or None) in the same order of API requests,
+            every one takes the hosts of a page right after it's decoded and returns what is kept of them.
+        http_cache: HTTP cache which requests are revalidated by (no cache if it's None).
+
+    Returns:
+        A list of hosts lists, in the same order of API requests.
+    """
+
+    event_loop = asyncio.new_event_loop()
+    try:
+        return event_loop.run_until_complete(_fetch_hosts_lists(
+            api_requests, get_pages_params, api_token=api_token, max_workers=max_workers,
+            pool_size=pool_size, timeout=timeout, retries=retries, backoff_factor=backoff_factor,
+            json_loads=json_loads, stats=stats, pages_hooks=pages_hooks, http_cache=http_cache))
+    finally:
+        event_loop.close()
+
+
+async def _fetch_hosts_lists(api_requests, get_pages_params, api_token=None, max_workers=1, pool_size=10,
+                             timeout=None, retries=3, backoff_factor=0.5, json_loads=json.loads, stats=None,
+                             pages_hooks=None, http_cache=None):
+    api_url_headers = {}
+    if api_token:
+        api_url_headers.update({"Authorization": "Token %s" % api_token})
+
+    # Connections to the same host are limited by "pool_size".
+    connector = aiohttp.TCPConnector(limit=pool_size, limit_per_host=pool_size)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=client_timeout,
+                                     headers=api_url_headers) as session:
+        # Every API URL has its own semaphore, so it uses up to "max_workers" requests at the same time
+        # (one API URL with many pages doesn't take the requests of other API URLs).
+        def make_get_page(requests_semaphore):
+            def get_page(page_url, page_params):
+                return _get_api_page(session, requests_semaphore, page_url, page_params,
+                                     retries=retries, backoff_factor=backoff_factor, json_loads=json_loads,
+                                     stats=stats, http_cache=http_cache)
+            return get_page
+
+        return await asyncio.gather(*[
+            _fetch_hosts_list(make_get_page(asyncio.Semaphore(max(max_workers, 1))), get_pages_params,
+                              api_url, api_params, page_hook)
+            for (api_url, api_params), page_hook in zip(api_requests, pages_hooks or [None] * len(api_requests))
+        ])
+
+
+async def _fetch_hosts_list(get_page, get_pages_params, api_url, api_url_params, page_hook=None):
+    def is_hosts_page(page_data):
+        return isinstance(page_data, dict) and "results" in page_data
+
+    def get_page_hosts(page_data):
+        page_hosts = page_data.get("results", [])
+        return page_hook(page_hosts) if page_hook else list(page_hosts)
+
+    # The page is reduced as soon as it's decoded, so decoded pages are not kept until all pages are fetched.
+    async def fetch_page_hosts(page_params):
+        return get_page_hosts(await get_page(api_url, page_params))
+
+    # Get first page.
+    api_output_data = await get_page(api_url, api_url_params)
+    if not is_hosts_page(api_output_data):
+        return []
+    hosts_list = get_page_hosts(api_output_data)
+
+    # All pages are requested at the same time if they could be calculated from the first page.
+    pages_params = None
+    if api_output_data["next"]:
+        pages_params = get_pages_params(api_url_params, api_output_data)
+
+    if pages_params:
+        pages_hosts = await asyncio.gather(*[fetch_page_hosts(page_params) for page_params in pages_params])
+        for page_hosts in pages_hosts:
+            hosts_list += page_hosts
+        return hosts_list
+
+    # Otherwise "next" URL is followed page by page.
+    while api_output_data["next"]:
+        api_output_data = await get_page(api_output_data["next"], None)
+        if not is_hosts_page(api_output_data):
+            break
+        hosts_list += get_page_hosts(api_output_data)
+    return hosts_list
+
+
+async def _get_api_page(session, requests_semaphore, api_url, api_url_params, retries=3, backoff_factor=0.5,
+                        json_loads=json.loads, stats=None, http_cache=None):
+    # Query parameters values must be strings, and a list value is a repeated parameter.
+    page_url = api_url
+    if api_url_params:
+        query_params = []
+        for key, value in api_url_params.items():
+            for param_value in (value if isinstance(value, list) else [value]):
+                query_params.append((key, str(param_value)))
+        api_url_params = query_params
+        page_url = "%s?%s" % (api_url, urlencode(query_params))
+
+    # The stored response is revalidated by its validators.
+    request_headers = {}
+    validators, cached_body = http_cache.get(page_url) if http_cache else (None, None)
+    if validators:
+        if validators.get("etag"):
+            request_headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            request_headers["If-Modified-Since"] = validators["last_modified"]
+
+    for attempt in range(retries + 1):
+        async with requests_semaphore:
+            request_started = stats.clock() if stats else 0
+            async with session.get(api_url, params=api_url_params, headers=request_headers) as api_output:
+                if api_output.status not in RETRY_STATUSES or attempt == retries:
+                    received_content = b""
+                    if api_output.status == 304 and cached_body is not None:
+                        api_output_content = cached_body
+                        if stats:
+                            stats.count("http_not_modified")
+                    else:
+                        # Check that a request is 200 and not something else like 404, 401, 500 ... etc.
+                        api_output.raise_for_status()
+                        api_output_content = received_content = await api_output.read()
+                        if http_cache and api_output.status == 200:
+                            _store_response(http_cache, page_url, api_output, api_output_content)
+                    if stats:
+                        stats.add_time("http", stats.clock() - request_started)
+                        stats.count("pages_fetched")
+                        stats.count("bytes_received", len(received_content))
+                    return json_loads(api_output_content)
+        await asyncio.sleep(backoff_factor * (2 ** attempt))
+
+
+def _store_response(http_cache, page_url, api_output, api_output_content):
+    validators = {"etag": api_output.headers.get("ETag"), "last_modified": api_output.headers.get("Last-Modified")}
+    if validators["etag"] or validators["last_modified"]:
+        try:
+            http_cache.set(page_url, validators, api_output_content)
+        except (IOError, OSError) as cache_error:
+            sys.stderr.write("Cannot write HTTP cache.\n%s\n" % cache_error)
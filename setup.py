@@ -134,6 +134,8 @@ setup(
     install_requires=main_requirements,
     extras_require={
         'tests': tests_requirements,
+        'asyncio': ['aiohttp; python_version >= "3.5"'],
+        'orjson': ['orjson; python_version >= "3.6"'],
     },
     cmdclass={
         'test': PyTest,
@@ -1,7 +1,11 @@
 #!/usr/bin/env python
 from __future__ import absolute_import
 
+import io
+import os
 import sys
+import time
+import copy
 import json
 import yaml
 import pytest
@@ -183,9 +187,53 @@ netbox_api_output = json.loads('''
 def mock_response(json_payload):
     response = Response()
     response.status_code = 200
-    response.json = MagicMock(return_value=json_payload)
+    response._content = json.dumps(json_payload).encode("utf-8")
     return MagicMock(return_value=response)
 
+
+# Fake paginated Netbox API response (uses "limit" and "offset" like Netbox).
+def mock_paginated_response(hosts, page_limit, max_page_size=1000):
+    def get_page(api_url, params=None, **kwargs):
+        params = params or {}
+        if "?" in api_url:
+            api_url, query = api_url.split("?", 1)
+            params = dict(pair.split("=") for pair in query.split("&"))
+        page_limit_param = min(int(params.get("limit", page_limit)), max_page_size)
+        page_offset = int(params.get("offset", 0))
+        page_hosts = hosts[page_offset:page_offset + page_limit_param]
+        next_offset = page_offset + page_limit_param
+        next_url = None
+        if next_offset < len(hosts):
+            next_url = "%s?limit=%s&offset=%s" % (api_url, page_limit_param, next_offset)
+        return mock_response({
+            "count": len(hosts),
+            "next": next_url,
+            "previous": None,
+            "results": page_hosts
+        })()
+    return MagicMock(side_effect=get_page)
+
+
+# Fake Netbox API page without next pages.
+def make_api_page(results):
+    return {"count": len(results), "next": None, "previous": None, "results": results}
+
+
+# Fake Netbox API of many endpoints, the page of the first API URL part which is found is used.
+# Every page could be a function which gets the page by the query parameters.
+def mock_api(url_pages, default_page):
+    def get_page(api_url, params=None, **kwargs):
+        api_page = next((page for url_part, page in url_pages if url_part in api_url), default_page)
+        if callable(api_page):
+            api_page = api_page(params or {})
+        return mock_response(api_page)()
+    return MagicMock(side_effect=get_page)
+
+
+paginated_hosts = [{"id": host_id, "name": "fake_host%02d" % host_id, "device_role": None, "rack": None, "platform": None}
+                   for host_id in range(1, 12)]
+
+
 # Set API output with a single host.
 netbox_api_output_single = netbox_api_output.copy()
 netbox_api_output_single.update({
@@ -204,6 +252,7 @@ class Args(object):
     config_file = "netbox.yml"
     host = None
     list = True
+    refresh_cache = False
 
 netbox_inventory = netbox.NetboxAsInventory(Args, netbox_config_data)
 Args.list = False
@@ -212,6 +261,25 @@ Args.host = "fake_host01"
 netbox_inventory_single = netbox.NetboxAsInventory(Args, netbox_config_data)
 
 
+# Init Netbox class with other config sections ("main" section is updated, other sections are replaced).
+# The arguments are set here, because "Args" is changed above.
+def make_netbox_inventory(host=None, refresh_cache=False, backend=None, **netbox_sections):
+    config_data = copy.deepcopy(netbox_config_data)
+    for section_name, section_config in netbox_sections.items():
+        if section_name == "main":
+            config_data["netbox"]["main"].update(section_config)
+        else:
+            config_data["netbox"][section_name] = section_config
+
+    class InventoryArgs(Args):
+        pass
+    InventoryArgs.host = host
+    InventoryArgs.list = not host
+    InventoryArgs.refresh_cache = refresh_cache
+    InventoryArgs.backend = backend
+    return netbox.NetboxAsInventory(InventoryArgs, config_data)
+
+
 #
 # Tests.
 ###############################################################################
@@ -304,6 +372,1277 @@ class TestNetboxUtils(object):
                 netbox.open_yaml_file(yaml_file)
         assert invalid_yaml_syntax
 
+    @pytest.mark.parametrize("json_data", [
+        {"_meta": {"hostvars": {"fake_host01": {"rack_name": "fake_rack01"}, "fake_host02": {}}},
+         "fake_rack01": ["fake_host01", "fake_host02"], 1: ["fake_host03"], "empty": {}},
+        {"fake_host01": {"rack_name": "fake_rack01"}},
+        {}
+    ])
+    def test_write_json(self, json_data):
+        """
+        Test JSON which is written in chunks is the same as the standard and the fast JSON libraries.
+        """
+        with patch("netbox.netbox.orjson", None):
+            json_output = MagicMock()
+            netbox.write_json(json_data, json_output, buffer_size=10)
+            assert "".join(call[0][0] for call in json_output.write.call_args_list) == json.dumps(json_data)
+            assert len(json_output.write.call_args_list) > 1 or not json_data
+
+        json_output = MagicMock()
+        netbox.write_json(json_data, json_output)
+        assert json.loads("".join(call[0][0] for call in json_output.write.call_args_list)) == \
+            json.loads(json.dumps(json_data))
+
+    def test_iter_json_chunks_hostvars(self):
+        """
+        Test every host of "_meta.hostvars" is encoded in its own chunk.
+        """
+        hosts_vars = dict(("fake_host%02d" % host_id, {"rack_name": "fake_rack01"}) for host_id in range(10))
+        json_data = {"_meta": {"hostvars": hosts_vars}, "fake_rack01": sorted(hosts_vars)}
+        json_chunks = list(netbox.iter_json_chunks(json_data))
+        assert json.loads("".join(json_chunks)) == json_data
+        assert max(json_chunk.count("rack_name") for json_chunk in json_chunks) == 1
+
+    @pytest.mark.parametrize("json_data", [
+        b'{"count": 1, "results": [{"name": "fake_host01"}]}',
+        u'{"count": 1, "results": [{"name": "fake_host01"}]}'
+    ])
+    def test_json_loads(self, json_data):
+        """
+        Test JSON decoding of bytes and strings.
+        """
+        assert netbox.json_loads(json_data) == {"count": 1, "results": [{"name": "fake_host01"}]}
+        with patch("netbox.netbox.orjson", None):
+            assert netbox.json_loads(json_data) == {"count": 1, "results": [{"name": "fake_host01"}]}
+
+
+# Test inventory cache.
+class TestInventoryCache(object):
+
+    def test_cache_set_get(self, tmpdir):
+        """
+        Test cache entry is written and read back as fresh.
+        """
+        inventory_cache = netbox.InventoryCache(str(tmpdir.join("cache")), 300)
+        inventory_cache.set("entry", {"group": ["host"]})
+        assert inventory_cache.get("entry") == ({"group": ["host"]}, True)
+        assert not tmpdir.join("cache").listdir(fil="*.tmp")
+
+    def test_cache_get_stale(self, tmpdir):
+        """
+        Test cache entry is stale after its TTL.
+        """
+        inventory_cache = netbox.InventoryCache(str(tmpdir), 0)
+        inventory_cache.set("entry", [])
+        assert inventory_cache.get("entry") == ([], False)
+        assert inventory_cache.get("missing_entry") == (None, False)
+
+    def test_cache_lock(self, tmpdir):
+        """
+        Test only one refresh lock is acquired.
+        """
+        inventory_cache = netbox.InventoryCache(str(tmpdir), 300)
+        assert inventory_cache.lock("entry")
+        assert not inventory_cache.lock("entry")
+        inventory_cache.unlock("entry")
+        assert inventory_cache.lock("entry")
+
+    def test_get_inventory_cached(self, tmpdir):
+        """
+        Test inventory is generated once then it's read from cache for "--list" and "--host".
+        """
+        cache_config = {"enabled": True, "path": str(tmpdir)}
+        with patch('requests.Session.get', mock_response(netbox_api_output)) as session_get:
+            inventory = make_netbox_inventory(cache=cache_config).get_inventory()
+            assert make_netbox_inventory(cache=cache_config).get_inventory() == inventory
+            host_inventory = make_netbox_inventory("fake_host01", cache=cache_config).get_inventory()
+            assert host_inventory["fake_host01"]["ansible_ssh_host"] == "192.168.0.2"
+            assert session_get.call_count == 1
+
+    def test_get_inventory_host_snapshot(self, tmpdir):
+        """
+        Test "--host" builds full inventory once, then next "--host" calls use its hosts vars index.
+        """
+        cache_config = {"enabled": True, "path": str(tmpdir)}
+        with patch('requests.Session.get', mock_response(netbox_api_output)) as session_get:
+            host_inventory = make_netbox_inventory("fake_host02", cache=cache_config).get_inventory()
+            assert host_inventory == {"fake_host02": {"rack_name": "fake_rack01"}}
+            assert "name" not in session_get.call_args[1]["params"]
+
+            host_inventory = make_netbox_inventory("fake_host01", cache=cache_config).get_inventory()
+            assert host_inventory["fake_host01"]["ansible_ssh_host"] == "192.168.0.2"
+            assert make_netbox_inventory("unknown_host", cache=cache_config).get_inventory() == {"unknown_host": {}}
+            assert session_get.call_count == 1
+
+    def test_get_inventory_refresh_cache(self, tmpdir):
+        """
+        Test "--refresh-cache" ignores cached inventory.
+        """
+        cache_config = {"enabled": True, "path": str(tmpdir)}
+        with patch('requests.Session.get', mock_response(netbox_api_output)) as session_get:
+            make_netbox_inventory(cache=cache_config).get_inventory()
+            make_netbox_inventory(refresh_cache=True, cache=cache_config).get_inventory()
+            assert session_get.call_count == 2
+
+    def test_get_inventory_stale_while_revalidate(self, tmpdir):
+        """
+        Test stale cached inventory is returned and refreshed in the background.
+        """
+        cache_config = {"enabled": True, "path": str(tmpdir), "ttl": 0, "stale_while_revalidate": True}
+        with patch('requests.Session.get', mock_response(netbox_api_output)) as session_get:
+            inventory = make_netbox_inventory(cache=cache_config).get_inventory()
+            with patch('subprocess.Popen') as refresh_process:
+                stale_inventory = make_netbox_inventory(cache=cache_config).get_inventory()
+                assert stale_inventory == inventory
+                assert "--refresh-cache" in refresh_process.call_args[0][0]
+            assert session_get.call_count == 1
+
+    def test_print_cached_inventory(self, tmpdir):
+        """
+        Test "--list" prints cached inventory as it is, and nothing is printed if it's not cached.
+        """
+        cache_config = {"enabled": True, "path": str(tmpdir)}
+        json_output = MagicMock()
+        assert not make_netbox_inventory(cache=cache_config).print_cached_inventory(json_output)
+        assert not make_netbox_inventory("fake_host01", cache=cache_config).print_cached_inventory(json_output)
+
+        with patch('requests.Session.get', mock_response(netbox_api_output)):
+            inventory = make_netbox_inventory(cache=cache_config).get_inventory()
+        assert make_netbox_inventory(cache=cache_config).print_cached_inventory(json_output)
+        assert json.loads("".join(call[0][0] for call in json_output.write.call_args_list)) == inventory
+        assert not make_netbox_inventory(refresh_cache=True, cache=cache_config).print_cached_inventory(json_output)
+
+    def test_lazy_imports(self):
+        """
+        Test "requests" is not imported until netbox API is called.
+        """
+        import subprocess
+        import_check = "import sys; from netbox import netbox; sys.exit('requests' in sys.modules)"
+        assert subprocess.call([sys.executable, "-c", import_check]) == 0
+
+
+# Test HTTP cache of conditional requests.
+class TestHttpCache(object):
+
+    @staticmethod
+    def fake_send(body, etag):
+        """Fake HTTP adapter "send" which answers 304 if "If-None-Match" matches the ETag."""
+        def send_request(request, **kwargs):
+            response = Response()
+            response.headers["ETag"] = etag
+            if request.headers.get("If-None-Match") == etag:
+                response.status_code = 304
+                response._content = b""
+            else:
+                response.status_code = 200
+                response._content = body
+            return response
+        return MagicMock(side_effect=send_request)
+
+    @staticmethod
+    def make_request(url):
+        import requests
+        return requests.Request("GET", url).prepare()
+
+    def test_http_cache_not_modified(self, tmpdir):
+        """
+        Test stored response is revalidated by its ETag and used on "304 Not Modified".
+        """
+        http_cache = netbox.HttpCache(str(tmpdir), 1024)
+        page_url = "http://localhost/api/dcim/devices/?limit=50"
+        send_request = self.fake_send(b'{"results": []}', '"v1"')
+
+        response = http_cache.send(send_request, self.make_request(page_url))
+        assert (response.status_code, response.content) == (200, b'{"results": []}')
+        assert "If-None-Match" not in send_request.call_args[0][0].headers
+
+        response = http_cache.send(send_request, self.make_request(page_url))
+        assert (response.status_code, response.content) == (200, b'{"results": []}')
+        assert send_request.call_args[0][0].headers["If-None-Match"] == '"v1"'
+        assert response.from_http_cache
+
+        response = http_cache.send(self.fake_send(b'{"results": [1]}', '"v2"'), self.make_request(page_url))
+        assert response.content == b'{"results": [1]}'
+        assert http_cache.get(page_url)[1] == b'{"results": [1]}'
+        assert http_cache.get("http://localhost/api/dcim/devices/") == (None, None)
+
+    def test_http_cache_lru(self, tmpdir):
+        """
+        Test the least recently used responses are removed when the cache is bigger than its max size.
+        """
+        http_cache = netbox.HttpCache(str(tmpdir), 500)
+        for page_index in range(3):
+            http_cache.set("http://localhost/page%d" % page_index, {"etag": '"v1"'}, b"x" * 100)
+            entry_time = time.time() - 100 + page_index
+            os.utime(http_cache._entry_path("http://localhost/page%d" % page_index), (entry_time, entry_time))
+
+        assert http_cache.get("http://localhost/page0")[1] == b"x" * 100
+        http_cache.set("http://localhost/page3", {"etag": '"v1"'}, b"x" * 100)
+        assert http_cache.get("http://localhost/page1") == (None, None)
+        assert http_cache.get("http://localhost/page0")[1] and http_cache.get("http://localhost/page3")[1]
+
+    def test_http_cache_session(self, tmpdir):
+        """
+        Test HTTP session uses the HTTP cache if it's enabled in config.
+        """
+        http_cache_inventory = make_netbox_inventory(http_cache={"enabled": True, "path": str(tmpdir)})
+        assert http_cache_inventory.http_cache.max_size == 100 * 1024 * 1024
+        with patch.object(netbox.HttpCache, "send") as http_cache_send:
+            http_cache_send.return_value = self.fake_send(b'{}', '"v1"')(self.make_request("http://localhost/"))
+            http_cache_inventory.session.get("http://localhost/api/dcim/devices/")
+            assert http_cache_send.call_args[0][1].url == "http://localhost/api/dcim/devices/"
+        assert netbox_inventory.http_cache is None
+
+
+# Test incremental sync.
+class TestIncrementalSync(object):
+
+    # Changed hosts are the hosts list which has "last_updated__gte" parameter.
+    @staticmethod
+    def mock_sync_api(changed_hosts, deleted_hosts_ids):
+        changelog_page = make_api_page([{"changed_object_id": host_id} for host_id in deleted_hosts_ids])
+        return mock_api([("object-changes", changelog_page)],
+                        lambda params: make_api_page(changed_hosts) if "last_updated__gte" in params else netbox_api_output)
+
+    def test_get_changelog_url(self):
+        """
+        Test changelog API URL is based on hosts API URL.
+        """
+        changelog_url = netbox_inventory._get_changelog_url("https://netbox.local/netbox/api/dcim/devices/")
+        assert changelog_url == "https://netbox.local/netbox/api/extras/object-changes/"
+
+    def test_sync_hosts(self, tmpdir):
+        """
+        Test first sync gets all hosts, and next sync merges changed and deleted hosts only.
+        """
+        new_host = dict(fake_host, id=3, name="fake_host03")
+        moved_host = copy.deepcopy(fake_host)
+        moved_host["rack"]["name"] = "fake_rack02"
+
+        sync_config = {"cache": {"path": str(tmpdir)}, "sync": {"incremental": True}}
+        with patch('requests.Session.get', self.mock_sync_api([moved_host, new_host], [2])) as session_get:
+            baseline_inventory = make_netbox_inventory(**sync_config).generate_inventory()
+            assert sorted(baseline_inventory["_meta"]["hostvars"]) == ["fake_host01", "fake_host02"]
+            assert session_get.call_count == 1
+
+            synced_inventory = make_netbox_inventory(**sync_config).generate_inventory()
+            assert sorted(synced_inventory["_meta"]["hostvars"]) == ["fake_host01", "fake_host03"]
+            assert synced_inventory["fake_rack02"] == ["fake_host01"]
+            assert "last_updated__gte" in session_get.call_args_list[1][1]["params"]
+            assert session_get.call_args_list[2][1]["params"]["action"] == "delete"
+
+            make_netbox_inventory(refresh_cache=True, **sync_config).generate_inventory()
+            assert "last_updated__gte" not in session_get.call_args[1]["params"]
+
+    def test_sync_hosts_filters(self, tmpdir):
+        """
+        Test changed host which doesn't match the filters anymore is removed from synced hosts.
+        """
+        sync_config = {"cache": {"path": str(tmpdir)}, "sync": {"incremental": True}, "filters": {"status": "active"}}
+
+        # The changed host is not found with the filters.
+        def get_hosts_page(params):
+            if "last_updated__gte" not in params:
+                return netbox_api_output
+            return make_api_page([] if "status" in params else [dict(fake_host, status="offline")])
+
+        sync_api = mock_api([("object-changes", make_api_page([]))], get_hosts_page)
+        with patch('requests.Session.get', sync_api) as session_get:
+            make_netbox_inventory(**sync_config).generate_inventory(full_inventory=True)
+            synced_inventory = make_netbox_inventory(**sync_config).generate_inventory(full_inventory=True)
+            assert list(synced_inventory["_meta"]["hostvars"]) == ["fake_host02"]
+            assert synced_inventory["fake_rack01"] == ["fake_host02"]
+            assert "status" not in session_get.call_args_list[-1][1]["params"]
+
+
+# Test multi-endpoint inventory.
+class TestEndpoints(object):
+
+    netbox_vms_output = {
+        "count": 1,
+        "next": None,
+        "previous": None,
+        "results": [
+            {
+                "id": 1,
+                "name": "fake_vm01",
+                "cluster": {"id": 1, "name": "fake_cluster01"},
+                "primary_ip": {"id": 3, "family": 4, "address": "192.168.0.3/32"}
+            }
+        ]
+    }
+
+    def test_generate_inventory_endpoints(self):
+        """
+        Test hosts of many endpoints are merged in one inventory, every endpoint with its own groups and vars.
+        """
+        config_data = copy.deepcopy(netbox_config_data)
+        del config_data["netbox"]["main"]["api_url"]
+        config_data["netbox"]["endpoints"] = [
+            {"api_url": "http://localhost/api/dcim/devices/"},
+            {"api_url": "http://localhost/api/virtualization/virtual-machines/",
+             "group_by": {"default": ["cluster"]},
+             "hosts_vars": {"ip": {"ansible_ssh_host": "primary_ip"}}}
+        ]
+
+        class ListArgs(Args):
+            host = None
+            list = True
+        endpoints_inventory = netbox.NetboxAsInventory(ListArgs, config_data)
+        assert [endpoint.object_type for endpoint in endpoints_inventory.endpoints] == [
+            "dcim.device", "virtualization.virtualmachine"]
+
+        endpoints_api = mock_api([("virtual-machines", self.netbox_vms_output)], netbox_api_output)
+        with patch('requests.Session.get', endpoints_api) as session_get:
+            ansible_inventory = endpoints_inventory.generate_inventory()
+            assert session_get.call_count == 2
+
+        assert ansible_inventory["fake_rack01"] == ["fake_host01", "fake_host02"]
+        assert ansible_inventory["fake_cluster01"] == ["fake_vm01"]
+        assert ansible_inventory["_meta"]["hostvars"]["fake_vm01"] == {"ansible_ssh_host": "192.168.0.3"}
+        assert list(ansible_inventory["_meta"]["hostvars"]) == ["fake_host01", "fake_host02", "fake_vm01"]
+
+    @pytest.mark.parametrize("api_url, object_type", [
+        ("http://localhost/api/dcim/devices/", "dcim.device"),
+        ("http://localhost/api/virtualization/virtual-machines/", "virtualization.virtualmachine"),
+        ("http://localhost/", None)
+    ])
+    def test_get_object_type(self, api_url, object_type):
+        """
+        Test netbox object type is based on API URL.
+        """
+        assert netbox_inventory._get_object_type(api_url) == object_type
+
+
+# Test asyncio backend.
+class TestAsyncioBackend(object):
+
+    @staticmethod
+    def fake_api_server(hosts, page_limit, failures=0):
+        """Start a fake Netbox API HTTP server, the first "failures" requests return 503."""
+        from threading import Thread
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+
+        get_page = mock_paginated_response(hosts, page_limit)
+        requests_paths = []
+
+        class FakeApiHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                requests_paths.append(self.path)
+                if len(requests_paths) <= failures:
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+                api_url = "http://%s:%s%s" % (self.server.server_name, self.server.server_port, self.path)
+                page_data = get_page(api_url).json()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                self.wfile.write(json.dumps(page_data).encode("utf-8"))
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(("127.0.0.1", 0), FakeApiHandler)
+        Thread(target=server.serve_forever).start()
+        return server, requests_paths
+
+    @staticmethod
+    def server_config(server, max_workers=1):
+        return {"api_url": "http://127.0.0.1:%s/api/dcim/devices/" % server.server_port,
+                "max_workers": max_workers, "backoff_factor": 0}
+
+    @pytest.mark.parametrize("max_workers", [
+        1,
+        4
+    ])
+    def test_generate_inventory_asyncio_backend(self, max_workers):
+        """
+        Test inventory of asyncio backend is the same as blocking backend.
+        """
+        pytest.importorskip("aiohttp")
+        server, requests_paths = self.fake_api_server(netbox_api_output["results"] + paginated_hosts, 3)
+        try:
+            main_config = self.server_config(server, max_workers)
+            requests_inventory = make_netbox_inventory(backend="requests", main=main_config).generate_inventory()
+            asyncio_inventory = make_netbox_inventory(backend="asyncio", main=main_config).generate_inventory()
+        finally:
+            server.shutdown()
+            server.server_close()
+        assert json.dumps(asyncio_inventory) == json.dumps(requests_inventory)
+        assert len(requests_paths) == 10
+
+    def test_asyncio_backend_retries(self):
+        """
+        Test asyncio backend retries on server errors.
+        """
+        pytest.importorskip("aiohttp")
+        server, requests_paths = self.fake_api_server(paginated_hosts, 3, failures=2)
+        try:
+            asyncio_inventory = make_netbox_inventory(backend="asyncio",
+                                                      main=self.server_config(server)).generate_inventory()
+        finally:
+            server.shutdown()
+            server.server_close()
+        assert asyncio_inventory["ungrouped"] == [host["name"] for host in paginated_hosts]
+        assert len(requests_paths) == 6
+
+    def test_asyncio_backend_max_workers_per_endpoint(self):
+        """
+        Test every API URL uses up to "max_workers" requests at the same time.
+        """
+        pytest.importorskip("aiohttp")
+        from threading import Thread, Lock
+        from socketserver import ThreadingMixIn
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        from netbox import netbox_async
+
+        get_page = mock_paginated_response(paginated_hosts, 1)
+        requests_lock = Lock()
+        requests_count = {}
+        max_requests_count = {}
+
+        class FakeApiHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                api_path = self.path.split("?")[0]
+                with requests_lock:
+                    requests_count[api_path] = requests_count.get(api_path, 0) + 1
+                    max_requests_count[api_path] = max(max_requests_count.get(api_path, 0), requests_count[api_path])
+                time.sleep(0.02)
+                with requests_lock:
+                    requests_count[api_path] -= 1
+                api_url = "http://%s:%s%s" % (self.server.server_name, self.server.server_port, self.path)
+                page_data = json.dumps(get_page(api_url).json()).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(page_data)))
+                self.end_headers()
+                self.wfile.write(page_data)
+
+            def log_message(self, *args):
+                pass
+
+        class FakeApiServer(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        server = FakeApiServer(("127.0.0.1", 0), FakeApiHandler)
+        Thread(target=server.serve_forever).start()
+        api_root = "http://127.0.0.1:%s/api/" % server.server_port
+        try:
+            hosts_lists = netbox_async.fetch_hosts_lists(
+                [(api_root + "dcim/devices/", {"limit": 1}), (api_root + "virtualization/virtual-machines/", {"limit": 1})],
+                netbox.NetboxAsInventory._get_pages_params, max_workers=2)
+        finally:
+            server.shutdown()
+            server.server_close()
+        assert [len(hosts_list) for hosts_list in hosts_lists] == [11, 11]
+        assert sorted(max_requests_count.values()) == [2, 2]
+
+    def test_asyncio_backend_old_python(self):
+        """
+        Test exit when asyncio backend is used on Python older than 3.5.
+        """
+        with patch.object(netbox.sys, "version_info", (2, 7, 18)):
+            with pytest.raises(SystemExit) as exit_status:
+                netbox_inventory._fetch_endpoints_hosts_async(netbox_inventory.endpoints)
+        assert "Python 3.5" in str(exit_status.value)
+
+    def test_unsupported_backend(self):
+        """
+        Test exit when the backend is not supported.
+        """
+        with pytest.raises(SystemExit) as exit_status:
+            make_netbox_inventory(main={"backend": "fake_backend"})
+        assert "fake_backend" in str(exit_status.value)
+
+
+# Test GraphQL backend.
+class TestGraphqlBackend(object):
+
+    graphql_types = {
+        "Query": {"device_list": ("OBJECT", "DeviceType")},
+        "DeviceType": {"id": ("SCALAR", "ID"), "name": ("SCALAR", "String"), "serial": ("SCALAR", "String"),
+                       "device_role": ("OBJECT", "DeviceRoleType"), "rack": ("OBJECT", "RackType"),
+                       "platform": ("OBJECT", "PlatformType"), "primary_ip": ("OBJECT", "IPAddressType"),
+                       "site": ("OBJECT", "SiteType"), "custom_fields": ("SCALAR", "JSON")},
+        "DeviceRoleType": {"id": ("SCALAR", "ID"), "name": ("SCALAR", "String")},
+        "RackType": {"id": ("SCALAR", "ID"), "name": ("SCALAR", "String")},
+        "PlatformType": {"id": ("SCALAR", "ID"), "name": ("SCALAR", "String")},
+        "IPAddressType": {"id": ("SCALAR", "ID"), "address": ("SCALAR", "String")},
+        "SiteType": {"id": ("SCALAR", "ID"), "name": ("SCALAR", "String"), "region": ("OBJECT", "RegionType")},
+        "RegionType": {"id": ("SCALAR", "ID"), "name": ("SCALAR", "String")}
+    }
+
+    graphql_hosts = netbox_api_output["results"] + paginated_hosts[2:]
+
+    @classmethod
+    def mock_graphql(cls, hosts):
+        def post_query(api_url, json=None, **kwargs):
+            variables = json["variables"]
+            if "__type" in json["query"]:
+                fields = [{"name": field_name, "type": {"kind": "NON_NULL", "name": None,
+                                                        "ofType": {"kind": kind, "name": type_name, "ofType": None}}}
+                          for field_name, (kind, type_name) in cls.graphql_types[variables["name"]].items()]
+                return mock_response({"data": {"__type": {"fields": fields}}})()
+            # GraphQL "ID" type is a string.
+            page_hosts = [dict(host, id=str(host["id"])) if "id" in host else host
+                          for host in hosts[variables["offset"]:variables["offset"] + variables["limit"]]]
+            return mock_response({"data": {"device_list": page_hosts}})()
+        return MagicMock(side_effect=post_query)
+
+    def test_get_graphql_url(self):
+        """
+        Test GraphQL API URL and list query are based on hosts API URL.
+        """
+        assert netbox_inventory._get_graphql_url("https://netbox.local/netbox/api/dcim/devices/") == \
+            "https://netbox.local/netbox/graphql/"
+        assert netbox_inventory._get_graphql_list_name("/api/virtualization/virtual-machines/") == \
+            "virtual_machine_list"
+
+    @pytest.mark.parametrize("netbox_config, specific_host, expected_query", [
+        ({}, None,
+         "query ($offset: Int!, $limit: Int!) { device_list(pagination: {offset: $offset, limit: $limit}) "
+         "{ id name device_role { name } rack { name } platform { name } primary_ip { address } } }"),
+        ({"group_by": {"default": ["site.region"], "custom": ["env"]}, "hosts_vars": {"general": {"serial": "serial"}},
+          "filters": {"status": "active", "site": ["site-a", "site-b"]}}, "fake_host01",
+         "query ($offset: Int!, $limit: Int!) { device_list(pagination: {offset: $offset, limit: $limit}, "
+         "filters: {name: \"fake_host01\", site: [\"site-a\", \"site-b\"], status: \"active\"}) "
+         "{ id name site { region { name } } custom_fields serial } }")
+    ])
+    def test_make_graphql_query(self, netbox_config, specific_host, expected_query):
+        """
+        Test GraphQL query has only the fields of the config, and the filters.
+        """
+        with patch('requests.Session.post', self.mock_graphql([])):
+            graphql_netbox_inventory = make_netbox_inventory(backend="graphql", **netbox_config)
+            graphql_query = graphql_netbox_inventory._make_graphql_query(graphql_netbox_inventory.endpoints[0],
+                                                                         specific_host)
+        assert graphql_query == expected_query
+
+    @pytest.mark.parametrize("max_workers", [
+        1,
+        3
+    ])
+    def test_generate_inventory_graphql_backend(self, max_workers):
+        """
+        Test inventory of GraphQL backend is the same as REST API, and hosts are fetched page by page.
+        """
+        with patch('requests.Session.get', mock_paginated_response(self.graphql_hosts, 4)):
+            requests_inventory = make_netbox_inventory().generate_inventory()
+
+        with patch('requests.Session.post', self.mock_graphql(self.graphql_hosts)) as session_post:
+            graphql_inventory = make_netbox_inventory(backend="graphql", main={
+                "max_workers": max_workers, "page_size": 4}).generate_inventory()
+            queries_variables = [call[1]["json"]["variables"] for call in session_post.call_args_list]
+
+        assert json.dumps(graphql_inventory) == json.dumps(requests_inventory)
+        pages_offsets = [variables["offset"] for variables in queries_variables if "offset" in variables]
+        assert pages_offsets == [0, 4, 8]
+
+    def test_graphql_errors(self):
+        """
+        Test GraphQL errors and unknown fields stop the script.
+        """
+        error_response = mock_response({"data": None, "errors": [{"message": "Cannot query field"}]})
+        with patch('requests.Session.post', error_response):
+            with pytest.raises(SystemExit) as graphql_error:
+                make_netbox_inventory(backend="graphql").generate_inventory()
+        assert "Cannot query field" in str(graphql_error.value)
+
+        with patch('requests.Session.post', self.mock_graphql([])):
+            graphql_netbox_inventory = make_netbox_inventory(backend="graphql", group_by={"default": ["tenant"]})
+            with pytest.raises(SystemExit) as field_error:
+                graphql_netbox_inventory.generate_inventory()
+        assert "tenant" in str(field_error.value)
+
+    def test_graphql_hosts_ids(self):
+        """
+        Test GraphQL string IDs are the same integers as webhooks IDs.
+        """
+        hosts_names = {}
+        graphql_netbox_inventory = make_netbox_inventory(backend="graphql")
+        with patch('requests.Session.post', self.mock_graphql(self.graphql_hosts)):
+            ansible_inventory = graphql_netbox_inventory.generate_ansible_inventory(
+                full_inventory=True, hosts_names=hosts_names)
+        assert ("dcim.device", 1) in hosts_names
+
+        event_data = {"event": "deleted", "model": "device", "data": {"id": 1, "name": hosts_names[("dcim.device", 1)]}}
+        assert graphql_netbox_inventory.apply_webhook_event(ansible_inventory, event_data, hosts_names)
+        assert ("dcim.device", 1) not in hosts_names
+
+
+# Test related objects prefetch.
+class TestPrefetch(object):
+
+    netbox_devices_output = {
+        "count": 3,
+        "next": None,
+        "previous": None,
+        "results": [
+            {"id": 1, "name": "fake_host01", "site": {"id": 1, "name": "fake_site01"},
+             "primary_ip": {"id": 1, "address": "192.168.0.2/32"}},
+            {"id": 2, "name": "fake_host02", "site": {"id": 2, "name": "fake_site02"},
+             "primary_ip": {"id": 2, "address": "192.168.0.3/32"}},
+            {"id": 3, "name": "fake_host03", "site": None, "primary_ip": None}
+        ]
+    }
+    netbox_sites_output = {
+        "count": 2,
+        "next": None,
+        "previous": None,
+        "results": [
+            {"id": 1, "name": "fake_site01", "region": {"id": 1, "name": "fake_region01"}},
+            {"id": 2, "name": "fake_site02", "region": None}
+        ]
+    }
+    netbox_ips_output = {
+        "count": 1,
+        "next": None,
+        "previous": None,
+        "results": [
+            {"id": 1, "address": "192.168.0.2/32", "dns_name": "fake-host01.example.com"}
+        ]
+    }
+
+    prefetch_config = {
+        "group_by": {"default": ["site.region"]},
+        "hosts_vars": {
+            "ip": {"ansible_ssh_host": "primary_ip"},
+            "general": {"dns_name": "primary_ip.dns_name", "region": "site.region"}
+        },
+        "prefetch": {
+            "site": "http://localhost/api/dcim/sites/",
+            "primary_ip": "http://localhost/api/ipam/ip-addresses/"
+        }
+    }
+
+    def test_generate_inventory_prefetch(self):
+        """
+        Test dotted paths in "group_by" and "hosts_vars" go through prefetched related objects.
+        """
+        prefetch_api = mock_api([("sites", self.netbox_sites_output), ("ip-addresses", self.netbox_ips_output)],
+                                self.netbox_devices_output)
+        with patch('requests.Session.get', prefetch_api) as session_get:
+            ansible_inventory = make_netbox_inventory(**self.prefetch_config).generate_inventory()
+            assert session_get.call_count == 3
+
+        assert ansible_inventory["fake_region01"] == ["fake_host01"]
+        assert ansible_inventory["ungrouped"] == ["fake_host02", "fake_host03"]
+        assert ansible_inventory["_meta"]["hostvars"]["fake_host01"] == {
+            "ansible_ssh_host": "192.168.0.2", "dns_name": "fake-host01.example.com", "region": "fake_region01"}
+        assert ansible_inventory["_meta"]["hostvars"]["fake_host02"] == {"ansible_ssh_host": "192.168.0.3"}
+
+    @pytest.mark.parametrize("path_keys, lookup_tables, path_value", [
+        (["site", "region"], {"site": {1: {"id": 1, "region": {"id": 5}}}}, {"id": 5}),
+        (["site", "region"], {}, None),
+        (["site", "name"], {}, "fake_site01"),
+        (["rack", "name"], {}, None)
+    ])
+    def test_follow_path(self, path_keys, lookup_tables, path_value):
+        """
+        Test dotted path is followed through lookup tables, and the object itself is used if it's not prefetched.
+        """
+        host_data = {"site": {"id": 1, "name": "fake_site01"}, "rack": None}
+        assert netbox_inventory._follow_path(host_data, path_keys, lookup_tables, strict=False) == path_value
+
+    def test_get_api_fields_prefetch(self):
+        """
+        Test only top level field of dotted paths is requested.
+        """
+        prefetch_inventory = make_netbox_inventory(**self.prefetch_config)
+        assert prefetch_inventory._get_api_fields(prefetch_inventory.group_by, prefetch_inventory.hosts_vars) == [
+            "id", "name", "primary_ip", "site"]
+
+
+# Test hosts filters.
+class TestFilters(object):
+
+    filters_config = {
+        "group_by": {},
+        "hosts_vars": {},
+        "filters": {"status": "active", "site": ["site-a", "site-b"], "has_primary_ip": True}
+    }
+
+    # Hosts of the sites in "site" parameter.
+    @staticmethod
+    def get_sites_hosts_page(params):
+        sites_hosts = {
+            "site-a": [{"id": 1, "name": "fake_host01"}, {"id": 2, "name": "fake_host02"}],
+            "site-b": [{"id": 2, "name": "fake_host02"}, {"id": 3, "name": "fake_host03"}]
+        }
+        sites = params["site"] if isinstance(params["site"], list) else [params["site"]]
+        return make_api_page([host for site in sites for host in sites_hosts[site]])
+
+    @pytest.mark.parametrize("filters, filters_params", [
+        ({"status": "active", "tag": ["prod", "web"]}, {"status": "active", "tag": ["prod", "web"]}),
+        ({"has_primary_ip": True, "virtual_chassis_member": False},
+         {"has_primary_ip": "true", "virtual_chassis_member": "false"}),
+        ({}, {})
+    ])
+    def test_get_filters_params(self, filters, filters_params):
+        """
+        Test filters config is converted to netbox API query parameters.
+        """
+        assert netbox_inventory._get_filters_params(filters) == filters_params
+
+    @pytest.mark.parametrize("split_filters, params_splits", [
+        (["site"], [{"site": "site-a", "tag": ["prod", "web"]}, {"site": "site-b", "tag": ["prod", "web"]}]),
+        (["site", "tag"], [{"site": "site-a", "tag": "prod"}, {"site": "site-a", "tag": "web"},
+                           {"site": "site-b", "tag": "prod"}, {"site": "site-b", "tag": "web"}]),
+        (["status"], []),
+        ([], [])
+    ])
+    def test_get_params_splits(self, split_filters, params_splits):
+        """
+        Test multi-value filters are split to one request per value.
+        """
+        api_params = {"site": ["site-a", "site-b"], "tag": ["prod", "web"], "status": ["active"]}
+        assert [dict((key, value) for key, value in split_params.items() if key != "status")
+                for split_params in netbox_inventory._get_params_splits(api_params, split_filters)] == params_splits
+
+    def test_generate_inventory_filters(self):
+        """
+        Test filters are sent to netbox API.
+        """
+        with patch('requests.Session.get', mock_api([], self.get_sites_hosts_page)) as session_get:
+            ansible_inventory = make_netbox_inventory(**self.filters_config).generate_inventory()
+            assert session_get.call_count == 1
+            assert session_get.call_args[1]["params"]["status"] == "active"
+            assert session_get.call_args[1]["params"]["has_primary_ip"] == "true"
+        assert ansible_inventory["ungrouped"] == ["fake_host01", "fake_host02", "fake_host03"]
+
+    def test_generate_inventory_split_filters(self):
+        """
+        Test split filters are fetched by one request per value, and duplicate hosts are removed.
+        """
+        with patch('requests.Session.get', mock_api([], self.get_sites_hosts_page)) as session_get:
+            ansible_inventory = make_netbox_inventory(split_filters=["site"], **self.filters_config).generate_inventory()
+            assert sorted(call[1]["params"]["site"] for call in session_get.call_args_list) == ["site-a", "site-b"]
+        assert ansible_inventory["ungrouped"] == ["fake_host01", "fake_host02", "fake_host03"]
+        assert list(ansible_inventory["_meta"]["hostvars"]) == ["fake_host01", "fake_host02", "fake_host03"]
+
+
+# Test compact host records.
+class TestHostRecord(object):
+
+    def test_make_hosts_records(self):
+        """
+        Test hosts are reduced to their groups and vars only.
+        """
+        endpoint = netbox_inventory.endpoints[0]
+        host_record = netbox_inventory._make_hosts_records(endpoint, [fake_host])[0]
+        assert (host_record.id, host_record.name) == (1, "fake_host01")
+        assert host_record.groups == ("Fake Server", "fake_rack01", False)
+        assert host_record.vars == ("192.168.0.2", "fake_rack01")
+        assert endpoint.hosts_vars_names == ["ansible_ssh_host", "rack_name"]
+        assert not hasattr(host_record, "__dict__")
+
+    def test_make_hosts_records_ungrouped(self):
+        """
+        Test groups without value are "ungrouped" (False), and missing vars are None.
+        """
+        endpoint = netbox_inventory.endpoints[0]
+        host_data = dict(fake_host, device_role={"name": ""}, primary_ip=None)
+        host_record = netbox_inventory._make_hosts_records(endpoint, [host_data])[0]
+        assert host_record.groups == (False, "fake_rack01", False)
+        assert host_record.vars == (None, "fake_rack01")
+
+    def test_host_record_from_list(self):
+        """
+        Test host record is the same after JSON round trip, and its group values are interned.
+        """
+        endpoint = netbox_inventory.endpoints[0]
+        host_record = netbox_inventory._make_hosts_records(endpoint, [fake_host])[0]
+        loaded_record = netbox.HostRecord.from_list(json.loads(json.dumps(host_record.to_list())))
+        assert loaded_record.to_list() == host_record.to_list()
+        assert loaded_record.groups[1] is host_record.groups[1]
+
+
+# Test static inventory export.
+class TestExport(object):
+
+    @staticmethod
+    def export_config(tmpdir, **export_config):
+        return dict({"path": str(tmpdir.join("export", "inventory.json"))}, **export_config)
+
+    def test_export_inventory(self, tmpdir):
+        """
+        Test inventory is exported to a JSON file and its gzip copy, without temporary files.
+        """
+        import gzip
+        with patch('requests.Session.get', mock_response(netbox_api_output)):
+            export_netbox_inventory = make_netbox_inventory(export=self.export_config(tmpdir, gzip=True))
+            export_path = export_netbox_inventory.export_inventory()
+            inventory = export_netbox_inventory.generate_inventory()
+
+        with open(export_path) as export_file:
+            assert json.loads(export_file.read()) == inventory
+        with gzip.open("%s.gz" % export_path, "rb") as export_gzip_file:
+            assert json.loads(export_gzip_file.read().decode("utf-8")) == inventory
+        assert sorted(tmpdir.join("export").listdir()) == [
+            tmpdir.join("export", "inventory.json"), tmpdir.join("export", "inventory.json.gz")]
+
+    @pytest.mark.parametrize("host", [None, "fake_host01"])
+    def test_serve_export_file(self, tmpdir, host):
+        """
+        Test "--serve-file" prints exported inventory for "--list" and "--host".
+        """
+        with patch('requests.Session.get', mock_response(netbox_api_output)):
+            inventory = make_netbox_inventory(export=self.export_config(tmpdir)).generate_inventory(full_inventory=True)
+        export_netbox_inventory = make_netbox_inventory(host, export=self.export_config(tmpdir))
+        assert not export_netbox_inventory.serve_export_file()
+
+        export_path = str(tmpdir.join("export", "inventory.json"))
+        export_netbox_inventory._write_export_file(export_path, inventory)
+        output_path = tmpdir.join("output.json")
+        with open(str(output_path), "w") as output_file:
+            assert export_netbox_inventory.serve_export_file(output_file=output_file)
+        expected_output = inventory["_meta"]["hostvars"]["fake_host01"] if host else inventory
+        assert json.loads(output_path.read()) == expected_output
+
+        json_output = MagicMock()
+        json_output.fileno.side_effect = io.UnsupportedOperation
+        assert export_netbox_inventory.serve_export_file(export_path, output_file=json_output)
+        assert json.loads("".join(call[0][0] for call in json_output.write.call_args_list)) == expected_output
+
+    def test_serve_export_file_stale(self, tmpdir):
+        """
+        Test exported file older than "max_age" is not printed.
+        """
+        export_netbox_inventory = make_netbox_inventory(export=self.export_config(tmpdir, max_age=1))
+        export_path = str(tmpdir.join("export", "inventory.json"))
+        export_netbox_inventory._write_export_file(export_path, {"_meta": {"hostvars": {}}})
+        assert export_netbox_inventory.serve_export_file(output_file=MagicMock())
+
+        export_mtime = time.time() - 60
+        os.utime(export_path, (export_mtime, export_mtime))
+        assert not export_netbox_inventory.serve_export_file(output_file=MagicMock())
+
+    def test_run_export_and_serve_file(self, tmpdir, capsys):
+        """
+        Test "--export" prints nothing, and "--serve-file" prints the exported inventory without netbox API.
+        """
+        config_file = tmpdir.join("netbox.yml")
+        config_file.write(netbox_config)
+        export_path = str(tmpdir.join("inventory.json"))
+
+        class RunArgs(Args):
+            host = None
+            list = True
+            backend = None
+            stats = None
+            serve_file = None
+        RunArgs.config_file = str(config_file)
+        RunArgs.export = export_path
+
+        with patch('requests.Session.get', mock_response(netbox_api_output)) as session_get:
+            netbox.run(RunArgs)
+            assert capsys.readouterr()[0] == ""
+            RunArgs.export, RunArgs.serve_file = None, export_path
+            netbox.run(RunArgs)
+            assert json.loads(capsys.readouterr()[0])["_meta"]["hostvars"]["fake_host01"]
+            assert session_get.call_count == 1
+
+    def test_run_serve_file_config(self, tmpdir, capsys):
+        """
+        Test "export.serve" config prints the exported inventory for plain "--list" like "--serve-file".
+        """
+        config_data = copy.deepcopy(netbox_config_data)
+        config_data["netbox"]["export"] = {"path": str(tmpdir.join("inventory.json")), "serve": True}
+        config_file = tmpdir.join("netbox.yml")
+        config_file.write(yaml.safe_dump(config_data))
+
+        class RunArgs(Args):
+            host = None
+            list = True
+            stats = None
+        RunArgs.config_file = str(config_file)
+
+        with patch('requests.Session.get', mock_response(netbox_api_output)) as session_get:
+            netbox.run(RunArgs)
+            inventory = json.loads(capsys.readouterr()[0])
+            netbox.NetboxAsInventory(RunArgs, config_data).export_inventory()
+            netbox.run(RunArgs)
+            assert json.loads(capsys.readouterr()[0]) == inventory
+            assert session_get.call_count == 2
+
+    def test_copy_file_to_output_resume(self, tmpdir):
+        """
+        Test the rest of the file is written if "sendfile" fails after a partial send.
+        """
+        source_file = tmpdir.join("inventory.json")
+        source_file.write_binary(json.dumps({"fake_group": ["fake_h\u00f6st%02d" % host_id for host_id in range(20)]},
+                                            ensure_ascii=False).encode("utf-8"))
+        source_data = source_file.read_binary()
+
+        # The first call sends 13 bytes, then "sendfile" fails.
+        def partial_sendfile(output_fd, source_fd, offset, count):
+            if offset:
+                raise OSError()
+            return os.write(output_fd, source_data[:13])
+
+        output_path = str(tmpdir.join("output.json"))
+        with io.open(output_path, "w", encoding="utf-8") as output_file:
+            with patch.object(os, "sendfile", side_effect=partial_sendfile, create=True):
+                netbox.NetboxAsInventory._copy_file_to_output(str(source_file), output_file)
+        assert tmpdir.join("output.json").read_binary() == source_data
+
+    def test_export_path_missing(self):
+        """
+        Test export fails if there is no export path.
+        """
+        with pytest.raises(SystemExit) as export_error:
+            netbox_inventory.export_inventory()
+        assert "export path" in str(export_error.value)
+
+
+# Test inventory daemon and its client.
+class TestInventoryDaemon(object):
+
+    def test_daemon_answers(self, tmpdir):
+        """
+        Test daemon answers "--list" and "--host" from memory, and "refresh" request refreshes the inventory.
+        """
+        with patch('requests.Session.get', mock_response(netbox_api_output)) as session_get:
+            daemon_netbox_inventory = make_netbox_inventory(daemon={"socket": str(tmpdir.join("netbox.sock")),
+                                                                    "refresh_interval": 3600})
+            inventory_daemon = netbox.InventoryDaemon(daemon_netbox_inventory, daemon_netbox_inventory.daemon_socket,
+                                                      daemon_netbox_inventory.daemon_refresh_interval).start()
+            try:
+                json_output = MagicMock()
+                assert netbox.get_daemon_inventory(inventory_daemon.socket_path, "list", json_output)
+                inventory = json.loads(json_output.write.call_args[0][0])
+                assert inventory == daemon_netbox_inventory.generate_inventory(full_inventory=True)
+
+                assert netbox.get_daemon_inventory(inventory_daemon.socket_path, "host fake_host01", json_output)
+                assert json.loads(json_output.write.call_args[0][0]) == inventory["_meta"]["hostvars"]["fake_host01"]
+
+                requests_count = session_get.call_count
+                assert netbox.get_daemon_inventory(inventory_daemon.socket_path, "refresh", json_output)
+                for _ in range(100):
+                    if session_get.call_count > requests_count:
+                        break
+                    time.sleep(0.01)
+                assert session_get.call_count > requests_count
+            finally:
+                inventory_daemon.stop()
+        assert not os.path.exists(inventory_daemon.socket_path)
+
+    def test_daemon_refresh_sync(self, tmpdir):
+        """
+        Test daemon refreshes get only changed hosts with incremental sync.
+        """
+        daemon_netbox_inventory = make_netbox_inventory(cache={"enabled": True, "path": str(tmpdir)},
+                                                        sync={"incremental": True})
+        moved_host = dict(fake_host, rack={"id": 2, "name": "fake_rack02"})
+
+        with patch('requests.Session.get', TestIncrementalSync.mock_sync_api([moved_host], [])) as session_get:
+            inventory_daemon = netbox.InventoryDaemon(daemon_netbox_inventory, str(tmpdir.join("netbox.sock")), 3600)
+            inventory_daemon.refresh()
+            assert "last_updated__gte" not in session_get.call_args[1]["params"]
+            inventory_daemon.refresh()
+            assert "last_updated__gte" in session_get.call_args_list[1][1]["params"]
+            assert session_get.call_count == 3
+        assert inventory_daemon.ansible_inventory.hosts_vars["fake_host01"]["rack_name"] == "fake_rack02"
+
+    def test_daemon_webhook_changes(self, tmpdir):
+        """
+        Test webhook changes are encoded on the next "list" request, and written to cache later once.
+        """
+        daemon_netbox_inventory = make_netbox_inventory(cache={"enabled": True, "path": str(tmpdir)})
+
+        with patch('requests.Session.get', mock_response(netbox_api_output)):
+            inventory_daemon = netbox.InventoryDaemon(daemon_netbox_inventory, str(tmpdir.join("netbox.sock")), 3600)
+            inventory_daemon.refresh()
+        assert json.loads(inventory_daemon.answer("list"))["_meta"]["hostvars"]["fake_host01"]
+
+        with patch.object(daemon_netbox_inventory, "write_inventory_cache") as write_inventory_cache:
+            for host_data in netbox_api_output["results"]:
+                assert inventory_daemon.apply_webhook_event({"event": "deleted", "model": "device", "data": host_data})
+            assert inventory_daemon.inventory_json is None
+            assert not write_inventory_cache.called
+
+            assert json.loads(inventory_daemon.answer("list")) == {"_meta": {"hostvars": {}}}
+            assert json.loads(inventory_daemon.answer("host fake_host01")) == {}
+            inventory_daemon.stop()
+            inventory_daemon.write_cache()
+        assert write_inventory_cache.call_count == 1
+        assert write_inventory_cache.call_args[0][0] == {"_meta": {"hostvars": {}}}
+
+    def test_daemon_client_not_running(self, tmpdir):
+        """
+        Test client doesn't print anything if the daemon is not running.
+        """
+        json_output = MagicMock()
+        assert not netbox.get_daemon_inventory(str(tmpdir.join("netbox.sock")), "list", json_output)
+        assert not json_output.write.called
+
+    def test_run_client(self, tmpdir, capsys):
+        """
+        Test "--client" prints the daemon answer without netbox API, and it generates inventory if there is no daemon.
+        """
+        config_data = copy.deepcopy(netbox_config_data)
+        config_data["netbox"]["daemon"] = {"socket": str(tmpdir.join("netbox.sock"))}
+        config_file = tmpdir.join("netbox.yml")
+        config_file.write(yaml.safe_dump(config_data))
+
+        class ClientArgs(Args):
+            host = None
+            list = True
+            stats = None
+            client = True
+        ClientArgs.config_file = str(config_file)
+
+        with patch('requests.Session.get', mock_response(netbox_api_output)) as session_get:
+            netbox.run(ClientArgs)
+            inventory = json.loads(capsys.readouterr()[0])
+            assert session_get.call_count == 1
+
+            with patch.object(netbox, "get_daemon_inventory", return_value=True) as get_daemon_inventory:
+                netbox.run(ClientArgs)
+                assert get_daemon_inventory.call_args[0] == (str(tmpdir.join("netbox.sock")), "list")
+            assert session_get.call_count == 1
+        assert inventory["_meta"]["hostvars"]["fake_host01"]
+
+
+# Test Ansible inventory with hosts and groups index.
+class TestAnsibleInventory(object):
+
+    @staticmethod
+    def make_inventory():
+        ansible_inventory = netbox.AnsibleInventory()
+        ansible_inventory.add_host("fake_host01", ("fake_group01", "fake_group02"), {"fake_var": 1})
+        ansible_inventory.add_host("fake_host02", ("fake_group01", False), {})
+        ansible_inventory.add_host("fake_host03", ("fake_group01", "fake_group02", "fake_group01"), {})
+        return ansible_inventory
+
+    def test_add_host(self):
+        """
+        Test hosts are added to groups once and in order, and both indexes match.
+        """
+        ansible_inventory = self.make_inventory()
+        assert ansible_inventory.to_dict() == {
+            "_meta": {"hostvars": {"fake_host01": {"fake_var": 1}, "fake_host02": {}, "fake_host03": {}}},
+            "fake_group01": ["fake_host01", "fake_host02", "fake_host03"],
+            "fake_group02": ["fake_host01", "fake_host03"],
+            "ungrouped": ["fake_host02"]
+        }
+        assert ansible_inventory.hosts_groups == {
+            "fake_host01": ("fake_group01", "fake_group02"),
+            "fake_host02": ("fake_group01", "ungrouped"),
+            "fake_host03": ("fake_group01", "fake_group02")
+        }
+
+    def test_move_host(self):
+        """
+        Test moved host keeps its place in groups which it's still in, and empty groups are removed.
+        """
+        ansible_inventory = self.make_inventory()
+        ansible_inventory.move_host("fake_host02", ("fake_group01", "fake_group03"), {"fake_var": 2})
+        ansible_inventory.move_host("fake_host04", ("fake_group03",))
+        inventory_dict = ansible_inventory.to_dict()
+        assert inventory_dict["fake_group01"] == ["fake_host01", "fake_host02", "fake_host03"]
+        assert inventory_dict["fake_group03"] == ["fake_host02", "fake_host04"]
+        assert "ungrouped" not in inventory_dict
+        assert inventory_dict["_meta"]["hostvars"]["fake_host02"] == {"fake_var": 2}
+        assert ansible_inventory.hosts_groups["fake_host02"] == ("fake_group01", "fake_group03")
+
+    def test_remove_host(self):
+        """
+        Test removed host is not in its groups, vars, or index.
+        """
+        ansible_inventory = self.make_inventory()
+        for host_name in ("fake_host01", "fake_host03", "fake_host05"):
+            ansible_inventory.remove_host(host_name)
+        assert ansible_inventory.to_dict() == {
+            "_meta": {"hostvars": {"fake_host02": {}}},
+            "fake_group01": ["fake_host02"],
+            "ungrouped": ["fake_host02"]
+        }
+        assert list(ansible_inventory.hosts_groups) == ["fake_host02"]
+
+
+# Fake hosts with changes of some of them.
+def make_changed_hosts(*changes):
+    hosts_list = copy.deepcopy(netbox_api_output["results"])
+    for host_index, host_changes in changes:
+        hosts_list[host_index].update(host_changes)
+    return hosts_list
+
+
+# Test netbox webhook events.
+class TestWebhookEvents(object):
+
+    @staticmethod
+    def normalize(inventory_dict):
+        return dict((group, group_hosts if group == "_meta" else sorted(group_hosts))
+                    for group, group_hosts in inventory_dict.items())
+
+    @staticmethod
+    def generate_inventory(netbox_inventory, hosts_list, hosts_names=None):
+        with patch('requests.Session.get', mock_response(dict(netbox_api_output, results=hosts_list))):
+            return netbox_inventory.generate_ansible_inventory(full_inventory=True, hosts_names=hosts_names)
+
+    @pytest.mark.parametrize("event, host_data, new_hosts_list", [
+        ("updated", dict(fake_host, rack={"id": 2, "name": "fake_rack02"}),
+         make_changed_hosts((0, {"rack": {"id": 2, "name": "fake_rack02"}}))),
+        ("updated", dict(fake_host, name="fake_host03"), make_changed_hosts((0, {"name": "fake_host03"}))),
+        ("created", dict(fake_host, id=3, name="fake_host03", platform={"id": 1, "name": "Linux"}),
+         make_changed_hosts() + [dict(fake_host, id=3, name="fake_host03", platform={"id": 1, "name": "Linux"})]),
+        ("deleted", fake_host, make_changed_hosts()[1:]),
+    ])
+    def test_apply_webhook_event(self, event, host_data, new_hosts_list):
+        """
+        Test host change is applied like a full inventory generation.
+        """
+        hosts_names = {}
+        ansible_inventory = self.generate_inventory(netbox_inventory, make_changed_hosts(), hosts_names)
+        assert hosts_names == {("dcim.device", 1): "fake_host01", ("dcim.device", 2): "fake_host02"}
+
+        event_data = {"event": event, "model": "device", "data": host_data}
+        with patch('requests.Session.get') as session_get:
+            assert netbox_inventory.apply_webhook_event(ansible_inventory, event_data, hosts_names)
+            assert not session_get.called
+
+        expected_inventory = self.generate_inventory(netbox_inventory, new_hosts_list)
+        assert self.normalize(ansible_inventory.to_dict()) == self.normalize(expected_inventory.to_dict())
+        assert "fake_rack01" in ansible_inventory.groups
+        assert sorted(hosts_names.values()) == sorted(host["name"] for host in new_hosts_list)
+
+    def test_apply_webhook_event_ignored(self):
+        """
+        Test events of other models don't change the inventory.
+        """
+        hosts_names = {}
+        ansible_inventory = self.generate_inventory(netbox_inventory, make_changed_hosts(), hosts_names)
+        expected_inventory = ansible_inventory.to_dict()
+        assert not netbox_inventory.apply_webhook_event(
+            ansible_inventory, {"event": "deleted", "model": "site", "data": {"id": 1, "name": "fake_site"}},
+            hosts_names)
+        assert ansible_inventory.to_dict() == expected_inventory
+
+    def test_apply_webhook_event_filters(self):
+        """
+        Test updated host is removed if it doesn't match the endpoint filters anymore.
+        """
+        filtered_netbox_inventory = make_netbox_inventory(filters={"status": "active"})
+
+        hosts_names = {}
+        ansible_inventory = self.generate_inventory(filtered_netbox_inventory, make_changed_hosts(), hosts_names)
+        event_data = {"event": "updated", "model": "device", "data": dict(fake_host, status="offline")}
+        with patch('requests.Session.get', mock_response(dict(netbox_api_output, results=[]))) as session_get:
+            assert filtered_netbox_inventory.apply_webhook_event(ansible_inventory, event_data, hosts_names)
+            assert session_get.call_args[1]["params"] == {"status": "active", "id": 1}
+
+        inventory_dict = ansible_inventory.to_dict()
+        assert "fake_host01" not in inventory_dict["_meta"]["hostvars"]
+        assert inventory_dict["fake_rack01"] == ["fake_host02"]
+        assert "Fake Server" not in inventory_dict
+
+    def test_daemon_webhook(self, tmpdir):
+        """
+        Test daemon applies signed webhooks to the inventory in memory and rejects unsigned ones.
+        """
+        import hmac
+        import hashlib
+        try:
+            from urllib.request import Request, urlopen
+            from urllib.error import HTTPError
+        except ImportError:
+            from urllib2 import Request, urlopen, HTTPError
+
+        daemon_netbox_inventory = make_netbox_inventory(daemon={"socket": str(tmpdir.join("netbox.sock"))})
+
+        with patch('requests.Session.get', mock_response(netbox_api_output)):
+            inventory_daemon = netbox.InventoryDaemon(
+                daemon_netbox_inventory, daemon_netbox_inventory.daemon_socket, 3600,
+                webhook_address=("127.0.0.1", 0), webhook_secret="fake_secret").start()
+        try:
+            webhook_url = "http://127.0.0.1:%s/" % inventory_daemon.servers[-1].server_address[1]
+            event_body = json.dumps({"event": "deleted", "model": "device", "data": fake_host}).encode("utf-8")
+
+            with pytest.raises(HTTPError) as webhook_error:
+                urlopen(Request(webhook_url, event_body, {"X-Hook-Signature": "invalid"}))
+            assert webhook_error.value.code == 403
+
+            signature = hmac.new(b"fake_secret", event_body, hashlib.sha512).hexdigest()
+            assert urlopen(Request(webhook_url, event_body, {"X-Hook-Signature": signature})).getcode() == 204
+
+            json_output = MagicMock()
+            assert netbox.get_daemon_inventory(inventory_daemon.socket_path, "list", json_output)
+            inventory = json.loads(json_output.write.call_args[0][0])
+            assert list(inventory["_meta"]["hostvars"]) == ["fake_host02"]
+            assert inventory["fake_rack01"] == ["fake_host02"]
+        finally:
+            inventory_daemon.stop()
+
+
+# Test "--stats" and "--profile".
+class TestInventoryStats(object):
+
+    @staticmethod
+    def stats_args(tmpdir, stats=None, profile=None):
+        config_file = tmpdir.join("netbox.yml")
+        config_file.write(netbox_config)
+
+        class StatsArgs(Args):
+            host = None
+            list = True
+        StatsArgs.config_file = str(config_file)
+        StatsArgs.backend = None
+        StatsArgs.stats = stats
+        StatsArgs.profile = profile
+        return StatsArgs
+
+    def test_stats_disabled(self):
+        """
+        Test disabled stats record nothing.
+        """
+        inventory_stats = netbox.InventoryStats()
+        inventory_stats.count("pages_fetched")
+        with inventory_stats.timer("http"):
+            pass
+        assert inventory_stats.clock() == 0
+        assert not inventory_stats.counters and not inventory_stats.timings
+
+    def test_run_stats(self, tmpdir, capsys):
+        """
+        Test "--stats" writes timing and counters to stderr, and stdout has the inventory only.
+        """
+        with patch('requests.Session.get', mock_response(netbox_api_output)):
+            netbox.run(self.stats_args(tmpdir, stats="-"))
+        output = capsys.readouterr()
+        assert "fake_host01" in json.loads(output.out)["_meta"]["hostvars"]
+        assert "pages_fetched" in output.err and "grouping" in output.err
+
+    def test_run_stats_file(self, tmpdir, capsys):
+        """
+        Test "--stats" with a path writes timing and counters to a JSON file.
+        """
+        stats_file = tmpdir.join("stats.json")
+        with patch('requests.Session.get', mock_response(netbox_api_output)):
+            netbox.run(self.stats_args(tmpdir, stats=str(stats_file)))
+        output = capsys.readouterr()
+        assert json.loads(output.out) and not output.err
+
+        run_stats = json.loads(stats_file.read())
+        assert run_stats["counters"]["pages_fetched"] == 1
+        assert run_stats["counters"]["hosts_processed"] == 2
+        assert run_stats["counters"]["groups_created"] == 4
+        assert set(["http", "json_decode", "grouping", "hosts_vars", "output", "total"]) <= set(run_stats["timings"])
+
+    def test_main_profile(self, tmpdir, capsys):
+        """
+        Test "--profile" writes cProfile stats of the run.
+        """
+        import pstats
+        profile_file = tmpdir.join("netbox.prof")
+        with patch('requests.Session.get', mock_response(netbox_api_output)):
+            with patch("netbox.netbox.cli_arguments", return_value=self.stats_args(tmpdir, profile=str(profile_file))):
+                netbox.main()
+        assert json.loads(capsys.readouterr().out)
+        assert pstats.Stats(str(profile_file)).total_calls > 0
+
 
 # Test NetboxAsInventory class.
 class TestNetboxAsInventory(object):
@@ -353,6 +1692,114 @@ class TestNetboxAsInventory(object):
                 netbox_inventory.get_hosts_list(api_url, api_token)
             assert none_url_error
 
+    @pytest.mark.parametrize("max_workers", [
+        1, 2, 8
+    ])
+    def test_get_hosts_list_paginated(self, max_workers):
+        """
+        Test get hosts list with many pages, serial and parallel pagination should return the same order.
+        """
+        with patch('requests.get', mock_paginated_response(paginated_hosts, 3)) as api_get:
+            hosts_list = netbox_inventory.get_hosts_list(netbox_inventory.api_url, max_workers=max_workers)
+            assert hosts_list == paginated_hosts
+            assert api_get.call_count == 4
+
+    @pytest.mark.parametrize("max_workers", [
+        1, 3
+    ])
+    def test_iter_hosts_pages(self, max_workers):
+        """
+        Test hosts are yielded page by page in the same order of the API.
+        """
+        with patch('requests.get', mock_paginated_response(paginated_hosts, 3)):
+            hosts_pages = netbox_inventory.iter_hosts_pages(netbox_inventory.api_url, max_workers=max_workers)
+            assert next(hosts_pages) == paginated_hosts[:3]
+            assert list(hosts_pages) == [paginated_hosts[3:6], paginated_hosts[6:9], paginated_hosts[9:]]
+
+    def test_generate_inventory_from_pages(self):
+        """
+        Test generating inventory from many pages.
+        """
+        with patch('requests.Session.get', mock_paginated_response(paginated_hosts, 3)):
+            ansible_inventory = netbox_inventory.generate_inventory()
+            assert ansible_inventory["ungrouped"] == [host["name"] for host in paginated_hosts]
+
+    @pytest.mark.parametrize("group_by, hosts_vars, expected_params", [
+        ({"default": ["device_role", "rack", "platform"]},
+         {"ip": {"ansible_ssh_host": "primary_ip"}, "general": {"rack_name": "rack"}},
+         {"fields": "device_role,id,name,platform,primary_ip,rack"}),
+        ({"custom": ["env"]},
+         {"custom": {"env": "env"}},
+         {"fields": "custom_fields,id,name"}),
+        ({},
+         {},
+         {"brief": "true"})
+    ])
+    def test_trim_fields(self, group_by, hosts_vars, expected_params):
+        """
+        Test only fields used in config are requested from the API.
+        """
+        trimmed_inventory = make_netbox_inventory(main={"trim_fields": True}, group_by=group_by, hosts_vars=hosts_vars)
+        assert trimmed_inventory.endpoints[0].api_params == expected_params
+
+        with patch('requests.Session.get', mock_response(netbox_api_output)) as session_get:
+            trimmed_inventory.generate_inventory()
+            assert session_get.call_args[1]["params"] == expected_params
+
+    def test_get_hosts_list_adaptive_page_size(self):
+        """
+        Test adaptive page size grows the page size and respects the API max page size.
+        """
+        with patch('requests.get', mock_paginated_response(paginated_hosts, 3, max_page_size=5)) as api_get:
+            hosts_list = netbox_inventory.get_hosts_list(netbox_inventory.api_url, adaptive_page_size=True)
+            assert hosts_list == paginated_hosts
+            requested_limits = [call[1]["params"].get("limit") for call in api_get.call_args_list]
+            assert requested_limits == [None, 10, 5]
+
+    @pytest.mark.parametrize("page_limit, page_time, page_bytes, page_hosts, max_page_size, next_page_limit", [
+        (100, 0.1, 1000, 100, 1000, 200),
+        (100, 4.0, 1000, 100, 1000, 50),
+        (100, 0.1, 8 * 1024 * 1024, 100, 1000, 50),
+        (800, 0.01, 1000, 800, 1000, 1000)
+    ])
+    def test_tune_page_size(self, page_limit, page_time, page_bytes, page_hosts, max_page_size, next_page_limit):
+        """
+        Test calculating next page size from the time and size of last page.
+        """
+        assert netbox_inventory._tune_page_size(
+            page_limit, page_time, page_bytes, page_hosts, max_page_size) == next_page_limit
+
+    def test_page_size_config(self):
+        """
+        Test page size from config is sent as "limit" and bounded by max page size.
+        """
+        page_size_inventory = make_netbox_inventory(main={"page_size": 5000, "max_page_size": 2000})
+        assert page_size_inventory.endpoints[0].api_params == {"limit": 2000}
+
+    def test_get_hosts_list_session(self):
+        """
+        Test get hosts list through HTTP session with a timeout.
+        """
+        with patch('requests.Session.get', netbox_api_all_hosts) as session_get:
+            hosts_list = netbox_inventory.get_hosts_list(netbox_inventory.api_url,
+                                                         session=netbox_inventory.session, timeout=5)
+            assert len(hosts_list) == 2
+            assert session_get.call_args[1]["timeout"] == 5
+
+    @pytest.mark.parametrize("pool_size, retries", [
+        (10, 3),
+        (2, 0)
+    ])
+    def test_create_http_session(self, pool_size, retries):
+        """
+        Test HTTP session has connections pool and retries.
+        """
+        session = netbox.create_http_session(pool_size=pool_size, retries=retries)
+        adapter = session.get_adapter("https://localhost/api/dcim/devices/")
+        assert adapter._pool_maxsize == pool_size
+        assert adapter.max_retries.total == retries
+        assert 429 in adapter.max_retries.status_forcelist
+
     @pytest.mark.parametrize("api_url, api_token, host_name", [
         (netbox_inventory_single.api_url, netbox_inventory_single.api_token, netbox_inventory_single.host)
     ])
@@ -439,6 +1886,33 @@ class TestNetboxAsInventory(object):
             netbox_inventory.add_host_to_inventory(groups_categories, inventory_dict, host_data)
         assert no_group_error
 
+    @pytest.mark.parametrize("groups_categories, steps_count, ungrouped_steps", [
+        ({}, 1, 1),
+        ({"default": []}, 1, 1),
+        ({"default": ["device_role", "rack"], "custom": ["env"]}, 3, 0)
+    ])
+    def test_compile_group_by(self, groups_categories, steps_count, ungrouped_steps):
+        """
+        Test compiling "group_by" config to a list of groups getters.
+        """
+        group_by_plan = netbox_inventory._compile_group_by(groups_categories)
+        assert len(group_by_plan) == steps_count
+        assert len([step for step in group_by_plan if step[1] is None]) == ungrouped_steps
+
+    @pytest.mark.parametrize("host_vars, expected_vars", [
+        ({"ip": {"ansible_ssh_host": "primary_ip"}, "custom": {"env": "env", "label": "label"}},
+         {"ansible_ssh_host": "192.168.0.2", "env": "Prod", "label": "Web"}),
+        ({"general": {"rack_name": "rack", "platform": "platform"}},
+         {"rack_name": "fake_rack01"})
+    ])
+    def test_compile_hosts_vars(self, host_vars, expected_vars):
+        """
+        Test compiled "hosts_vars" config gets the same vars as the config.
+        """
+        hosts_vars_plan = netbox_inventory._compile_hosts_vars(host_vars)
+        assert netbox_inventory._get_host_vars(hosts_vars_plan, fake_host) == expected_vars
+        assert netbox_inventory.get_host_vars(fake_host, host_vars) == expected_vars
+
     @pytest.mark.parametrize("host_data, host_vars", [
         (fake_host,
          {"ip": {"ansible_ssh_host": "primary_ip"}, "general": {"rack_name": "rack"}})
@@ -464,6 +1938,18 @@ class TestNetboxAsInventory(object):
         netbox_inventory.update_host_meta_vars(inventory_dict, host_name, host_vars)
         assert inventory_dict["_meta"]["hostvars"]["fake_host01"]["rack_name"] == "fake_rack01"
 
+    @pytest.mark.parametrize("inventory_dict, host_name, host_vars", [
+        ({"_meta": {"hostvars": {}}},
+         "fake_host01",
+         {})
+    ])
+    def test_update_host_meta_vars_empty(self, inventory_dict, host_name, host_vars):
+        """
+        Test host without vars is added to inventory hosts vars.
+        """
+        netbox_inventory.update_host_meta_vars(inventory_dict, host_name, host_vars)
+        assert inventory_dict["_meta"]["hostvars"]["fake_host01"] == {}
+
     @pytest.mark.parametrize("inventory_dict, host_name, host_vars", [
         ({"_meta": {"hostvars": {}}},
          "fake_host01",
@@ -480,7 +1966,7 @@ class TestNetboxAsInventory(object):
         """
         Test generateing final Ansible inventory before convert it to JSON.
         """
-        with patch('requests.get', netbox_api_all_hosts):
+        with patch('requests.Session.get', netbox_api_all_hosts):
             ansible_inventory = netbox_inventory.generate_inventory()
             assert "fake_host01" in ansible_inventory["_meta"]["hostvars"]
             assert isinstance(ansible_inventory["_meta"]["hostvars"]["fake_host02"], dict)